@@ -174,6 +174,69 @@ def custom():
     run("example")
 
 
+def batch(commands):
+    """Run a list of commands with a single invocation of this program.
+
+    When batch mode is enabled, rollingpin runs this program once per host
+    with the "batch" command rather than once per command, and sends it the
+    list of commands to run as a JSON document on stdin:
+
+        {
+            "commands": [
+                {
+                    "name": "deploy",
+                    "args": ["foo@012345"],
+                    "explicit": false,
+                    "skip_remaining_unless_changed": true
+                },
+                {
+                    "name": "restart",
+                    "args": ["foo"],
+                    "explicit": true,
+                    "skip_remaining_unless_changed": false
+                }
+            ]
+        }
+
+    Commands run in order. When a command with
+    `skip_remaining_unless_changed` set reports that none of its components
+    changed, the remaining commands that weren't explicitly requested are
+    skipped. Instead of a single JSON blob, the progress of the batch is
+    written to stdout as one line of JSON per event, which rollingpin
+    processes as they arrive:
+
+        {"event": "begin", "index": 0}
+        {"event": "end", "index": 0, "result": {...}}
+
+    Commands run in a batch must not write to stdout themselves. If one
+    fails, the batch stops and exits with a non-zero status like a single
+    command would.
+
+    """
+    document = json.load(sys.stdin)
+
+    def emit(event):
+        print(json.dumps(event))
+        sys.stdout.flush()
+
+    skipping = False
+    for index, command in enumerate(document["commands"]):
+        if skipping and not command["explicit"]:
+            continue
+
+        command_fn = commands.get(command["name"])
+        if not command_fn:
+            raise Exception("unknown command {}".format(command["name"]))
+
+        emit({"event": "begin", "index": index})
+        result = command_fn(*command["args"]) or {}
+        emit({"event": "end", "index": index, "result": result})
+
+        if command["skip_remaining_unless_changed"] and result:
+            skipping = not any(value == "repo_changed"
+                               for value in result.values())
+
+
 def main(commands):
     """Do basic setup and dispatch commands to their handlers.
 
@@ -192,7 +255,8 @@ def main(commands):
 
     This main function uses the first command line argument to select a
     function to execute, then JSON encodes the return value of the function (or
-    {} if None) for response to rollingpin.
+    {} if None) for response to rollingpin. The "batch" command is the
+    exception, it writes its own output as it goes.
 
     """
     progname = os.path.basename(sys.argv[0])
@@ -210,6 +274,13 @@ def main(commands):
         print(formatted, file=sys.stderr)
         sys.exit(1)
 
+    if command_name == "batch":
+        try:
+            batch(commands)
+        except Exception as e:
+            fatal_error(str(e))
+        return
+
     command_fn = commands.get(command_name)
     if not command_fn:
         fatal_error("unknown command")
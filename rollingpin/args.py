@@ -3,6 +3,7 @@ import os
 import sys
 
 import rollingpin.commands as commands
+from rollingpin.hostlist import HOST_ORDERS
 
 
 COMMANDS_BY_NAME = {
@@ -48,6 +49,17 @@ def _add_selection_arguments(config, parser):
         dest="host_refs",
     )
 
+    order_default = config["deploy"].get("default-order", "id")
+    selection_group.add_argument(
+        "--order",
+        default=order_default,
+        choices=HOST_ORDERS,
+        help="order to deploy to hosts in after the canaries. longest-first "
+             "starts with the hosts that took longest in recent deploys "
+             "(default: {})".format(order_default),
+        dest="order",
+    )
+
 
 def _add_iteration_arguments(config, parser):
     iteration_group = parser.add_argument_group("host iteration")
@@ -63,6 +75,55 @@ def _add_iteration_arguments(config, parser):
         dest="parallel",
     )
 
+    min_parallel_default = config["deploy"].get("default-min-parallel", 1)
+    iteration_group.add_argument(
+        "--min-parallel",
+        default=min_parallel_default,
+        type=int,
+        help="lowest number of hosts to back off to when adapting "
+             "parallelism (default: {})".format(min_parallel_default),
+        metavar="COUNT",
+        dest="min_parallel",
+    )
+
+    max_parallel_default = config["deploy"].get("default-max-parallel", 0)
+    iteration_group.add_argument(
+        "--max-parallel",
+        default=max_parallel_default,
+        type=int,
+        help="adapt the number of hosts worked on simultaneously, starting "
+             "at --parallel and growing up to this many while the deploy is "
+             "healthy (default: {}, 0 to disable)".format(max_parallel_default),
+        metavar="COUNT",
+        dest="max_parallel",
+    )
+
+    ready_parallel_default = config["deploy"].get("default-ready-parallel", 0)
+    iteration_group.add_argument(
+        "--ready-parallel",
+        default=ready_parallel_default,
+        type=int,
+        help="free up a host's slot once it is only waiting for components "
+             "to be ready, and wait on up to this many hosts at once "
+             "(default: {}, 0 to keep the slot)".format(ready_parallel_default),
+        metavar="COUNT",
+        dest="ready_parallel",
+    )
+
+    prefetch_parallel_default = config["deploy"].get(
+        "default-prefetch-parallel", 0)
+    iteration_group.add_argument(
+        "--prefetch-parallel",
+        default=prefetch_parallel_default,
+        type=int,
+        help="deploy components to all hosts up front, this many at a time, "
+             "then roll out only the restarts and other commands (default: "
+             "{}, 0 to roll out everything together)".format(
+                 prefetch_parallel_default),
+        metavar="COUNT",
+        dest="prefetch_parallel",
+    )
+
     sleeptime_default = config["deploy"]["default-sleeptime"]
     iteration_group.add_argument(
         "--sleeptime",
@@ -74,6 +135,29 @@ def _add_iteration_arguments(config, parser):
         dest="sleeptime",
     )
 
+    rate_default = config["deploy"].get("default-rate", 0)
+    iteration_group.add_argument(
+        "--rate",
+        default=rate_default,
+        type=float,
+        help="start hosts at this steady rate instead of sleeping a fixed "
+             "time between them (default: {}, 0 to use --sleeptime)".format(
+                 rate_default),
+        metavar="HOSTS_PER_MINUTE",
+        dest="rate",
+    )
+
+    burst_default = config["deploy"].get("default-burst", 1)
+    iteration_group.add_argument(
+        "--burst",
+        default=burst_default,
+        type=int,
+        help="number of hosts that may be started back to back when pacing "
+             "with --rate (default: {})".format(burst_default),
+        metavar="COUNT",
+        dest="burst",
+    )
+
     timeout_default = config["deploy"]["execution-timeout"]
     iteration_group.add_argument(
         "--timeout",
@@ -85,6 +169,17 @@ def _add_iteration_arguments(config, parser):
         dest="timeout",
     )
 
+    retries_default = config["deploy"].get("default-retries", 0)
+    iteration_group.add_argument(
+        "--retries",
+        default=retries_default,
+        type=int,
+        help="retry hosts that failed this many times once the rollout is "
+             "done (default: {})".format(retries_default),
+        metavar="COUNT",
+        dest="retries",
+    )
+
 
 def _add_flags(config, parser):
     options_group = parser.add_argument_group("options")
@@ -119,6 +214,40 @@ def _add_flags(config, parser):
         dest="dangerously_fast",
     )
 
+    options_group.add_argument(
+        "--resume",
+        default=None,
+        help="resume an interrupted deploy, skipping hosts it finished",
+        metavar="WORD",
+        dest="resume",
+    )
+
+    options_group.add_argument(
+        "--skip-up-to-date",
+        action="store_true",
+        default=False,
+        help="check which components each host is running before rolling out "
+             "and skip hosts already running what is being deployed",
+        dest="skip_up_to_date",
+    )
+
+    options_group.add_argument(
+        "--check-reachable",
+        action="store_true",
+        default=False,
+        help="check that every host accepts connections before rolling out "
+             "and leave out the ones that don't",
+        dest="check_reachable",
+    )
+
+    options_group.add_argument(
+        "--no-build-cache",
+        action="store_false",
+        default=True,
+        help="rebuild components even if a cached build is available",
+        dest="use_build_cache",
+    )
+
     options_group.add_argument(
         "--no-harold",
         action="store_false",
@@ -260,13 +389,30 @@ def construct_canonical_commandline(config, args):
     arg_list.extend(args.host_refs)
     arg_list.append("--parallel=%d" % args.parallel)
 
+    if args.max_parallel > args.parallel:
+        arg_list.append("--min-parallel=%d" % args.min_parallel)
+        arg_list.append("--max-parallel=%d" % args.max_parallel)
+
+    if args.ready_parallel:
+        arg_list.append("--ready-parallel=%d" % args.ready_parallel)
+
+    if args.prefetch_parallel:
+        arg_list.append("--prefetch-parallel=%d" % args.prefetch_parallel)
+
     sleeptime_default = config["deploy"]["default-sleeptime"]
     if args.sleeptime != sleeptime_default:
         arg_list.append("--sleeptime=%d" % args.sleeptime)
 
+    if args.rate:
+        arg_list.append("--rate=%g" % args.rate)
+        arg_list.append("--burst=%d" % args.burst)
+
     if args.timeout is not None:
         arg_list.append("--timeout=%d" % args.timeout)
 
+    if args.retries:
+        arg_list.append("--retries=%d" % args.retries)
+
     if config["harold"]["base-url"] and not args.notify_harold:
         arg_list.append("--really-no-harold")
 
@@ -276,6 +422,21 @@ def construct_canonical_commandline(config, args):
     if args.dangerously_fast:
         arg_list.append("--dangerously-fast")
 
+    if args.resume:
+        arg_list.append("--resume=%s" % args.resume)
+
+    if args.order != "id":
+        arg_list.append("--order=%s" % args.order)
+
+    if args.skip_up_to_date:
+        arg_list.append("--skip-up-to-date")
+
+    if args.check_reachable:
+        arg_list.append("--check-reachable")
+
+    if not args.use_build_cache:
+        arg_list.append("--no-build-cache")
+
     if args.components:
         arg_list.append("-d")
         arg_list.extend(args.components)
@@ -296,9 +457,27 @@ def build_action_summary(config, args):
 
     summary_points = []
 
+    if args.resume:
+        summary_points.append(
+            "Resume deploy `{}`, skipping hosts it finished.".format(
+                args.resume))
+
     for component in args.components:
         summary_points.append("Deploy the `{}` component.".format(component))
 
+    if args.check_reachable:
+        summary_points.append(
+            "Leave out hosts that can't be connected to.")
+
+    if args.components and args.skip_up_to_date:
+        summary_points.append(
+            "Skip hosts already running the components being deployed.")
+
+    if args.components and args.prefetch_parallel:
+        summary_points.append((
+            "Deploy to all hosts up front, {} at a time, before rolling out "
+            "the rest.").format(args.prefetch_parallel))
+
     for command in args.commands:
         if isinstance(command, commands.RestartCommand):
             summary_points.append(
@@ -311,10 +490,59 @@ def build_action_summary(config, args):
     for host in args.host_refs:
         summary_details.append("on `{}` hosts".format(host))
 
-    summary_details.append("{} at a time".format(args.parallel))
+    if args.order == "longest-first":
+        summary_details.append("slowest hosts first")
+
+    if args.max_parallel > args.parallel:
+        summary_details.append(
+            "starting {} at a time and adapting between {} and {}".format(
+                args.parallel, args.min_parallel, args.max_parallel))
+    else:
+        summary_details.append("{} at a time".format(args.parallel))
+    if args.ready_parallel:
+        summary_details.append(
+            "waiting on up to {} hosts to be ready at a time".format(
+                args.ready_parallel))
+    command_parallel = config["deploy"].get("command-parallel", {})
+    for name, count in sorted(command_parallel.iteritems()):
+        summary_details.append(
+            "at most {} running `{}` at a time".format(count, name))
+    if args.rate:
+        summary_details.append(
+            "starting {:g} hosts per minute in bursts of up to {}".format(
+                args.rate, args.burst))
     if args.timeout is not None:
         summary_details.append(
             "timing out if a host takes more than {} seconds".format(args.timeout))
+    command_timeouts = config["deploy"].get("command-timeouts", {})
+    for name, timeout in sorted(command_timeouts.iteritems()):
+        summary_details.append(
+            "timing out `{}` after {} seconds".format(name, timeout))
+    command_dependencies = config["deploy"].get("command-dependencies", {})
+    for name, needs in sorted(command_dependencies.iteritems()):
+        if needs:
+            summary_details.append(
+                "running `{}` depending only on {}".format(
+                    name, ", ".join("`%s`" % need for need in sorted(needs))))
+        else:
+            summary_details.append(
+                "running `{}` alongside other commands".format(name))
+    if config["deploy"].get("batch-mode"):
+        summary_details.append(
+            "sending each host all of its commands in one batch")
+    adaptive_timeout_factor = config["deploy"].get(
+        "adaptive-timeout-factor", 0)
+    if adaptive_timeout_factor:
+        summary_details.append(
+            "timing out other commands after {:g} times their usual "
+            "longest duration".format(adaptive_timeout_factor))
+    error_budget = config["deploy"].get("error-budget")
+    if error_budget:
+        summary_details.append(
+            "stopping after more than {}".format(error_budget))
+    if args.retries:
+        summary_details.append(
+            "retrying failed hosts up to {} times".format(args.retries))
 
     return "\n".join([expanded_command, "", "This will:", ""] +
                      ["* {}".format(p) for p in summary_points] +
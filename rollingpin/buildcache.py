@@ -0,0 +1,114 @@
+"""A local cache of build results.
+
+Building a component is only necessary when its synchronized source changes.
+This cache remembers the deploy token that the build host returned for each
+``component@sync_token`` ref so that redeploys of the same code (reverts,
+restart-only redeploys, etc.) can skip the build round-trip.
+
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+CACHE_FILENAME = "build-cache.json"
+
+
+class BuildCache(object):
+
+    def __init__(self, path, ttl, max_entries):
+        """
+        :param str path: file to persist the cache to
+        :param int ttl: seconds after which a cached build is ignored
+        :param int max_entries: number of builds to keep, least recently used
+            builds are evicted first
+
+        """
+        self.log = logging.getLogger(__name__)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except IOError:
+            return {}
+        except ValueError as e:
+            self.log.warning("ignoring corrupt build cache %s: %s",
+                             self.path, e)
+            return {}
+
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def _is_expired(self, entry, now):
+        return now - entry["created"] > self.ttl
+
+    def get(self, ref):
+        """Return the deploy token for a ``component@sync_token`` ref.
+
+        Returns None if the ref has not been built or the build has expired.
+
+        """
+        entry = self.entries.get(ref)
+        if not entry:
+            return None
+
+        now = time.time()
+        if self._is_expired(entry, now):
+            del self.entries[ref]
+            return None
+
+        entry["used"] = now
+        return entry["token"]
+
+    def put(self, ref, token):
+        now = time.time()
+        self.entries[ref] = {
+            "token": token,
+            "created": now,
+            "used": now,
+        }
+
+    def _evict(self):
+        now = time.time()
+        live = [(ref, entry) for ref, entry in self.entries.iteritems()
+                if not self._is_expired(entry, now)]
+        live.sort(key=lambda (ref, entry): entry["used"], reverse=True)
+        self.entries = dict(live[:self.max_entries])
+
+    def save(self):
+        self._evict()
+
+        # write to a temporary file and move it into place so concurrent
+        # deploys never see a partially written cache
+        directory = os.path.dirname(self.path)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".build-cache")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.entries, f)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as e:
+            self.log.warning("could not save build cache: %s", e)
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+
+def load_build_cache(config):
+    """Return the configured build cache or None if caching is disabled."""
+    ttl = config["deploy"]["build-cache-ttl"]
+    if not ttl:
+        return None
+
+    directory = (config["deploy"]["build-cache-directory"] or
+                 config["deploy"]["log-directory"])
+    path = os.path.join(directory, CACHE_FILENAME)
+    return BuildCache(path, ttl, config["deploy"]["build-cache-size"])
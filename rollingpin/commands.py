@@ -2,6 +2,16 @@ class Command(object):
     CONTINUE = 1
     SKIP_REMAINING = 2
 
+    # commands that don't disrupt the host, such as waiting for it to warm
+    # up, can run without taking up one of the rollout's parallel slots.
+    concurrency_critical = True
+
+    # whether the remaining commands that weren't explicitly requested are
+    # skipped if this command reports that nothing changed. this is what
+    # check_result decides, spelled out for batch mode where the host has to
+    # make the decision itself.
+    skips_remaining_unless_changed = False
+
     def __init__(self, args=None, explicit=False):
         self.explicit = explicit
         self._args = args or []
@@ -19,6 +29,16 @@ class Command(object):
     def check_result(self, result):
         return Command.CONTINUE
 
+    def to_batch(self):
+        """Describe the command for a batch document."""
+        return {
+            "name": self.name,
+            "args": self._args,
+            "explicit": self.explicit,
+            "skip_remaining_unless_changed":
+                self.skips_remaining_unless_changed,
+        }
+
     def __repr__(self):
         return "Command(name={}, args={})".format(self.name, self._args)
 
@@ -33,6 +53,7 @@ class DeployCommand(Command):
     REPO_CHANGED = "repo_changed"
 
     name = "deploy"
+    skips_remaining_unless_changed = True
 
     def check_result(self, result):
         # For backwards compatibility
@@ -54,8 +75,13 @@ class RestartCommand(Command):
     name = "restart"
 
 
+class ComponentsCommand(Command):
+    name = "components"
+
+
 class WaitUntilComponentsReadyCommand(Command):
     name = "wait-until-components-ready"
+    concurrency_critical = False
 
 
 class GenericCommand(Command):
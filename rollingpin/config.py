@@ -12,6 +12,14 @@ class Option(object):
         self.default = default
 
 
+def parse_bool(value):
+    """Coerce a boolean spelled any way ConfigParser.getboolean accepts."""
+    try:
+        return ConfigParser.RawConfigParser._boolean_states[value.lower()]
+    except KeyError:
+        raise ValueError("expected a boolean, got %r" % value)
+
+
 class OptionalSection(dict):
 
     def __init__(self, options):
@@ -1,12 +1,15 @@
 import collections
 import logging
 import signal
+import time
 import traceback
 
 from twisted.internet import reactor
 from twisted.internet.defer import (
     DeferredList,
     DeferredSemaphore,
+    FirstError,
+    gatherResults,
     inlineCallbacks,
     returnValue,
 )
@@ -14,14 +17,32 @@ from twisted.internet.defer import (
 from .commands import (
     Command,
     BuildCommand,
+    ComponentsCommand,
     DeployCommand,
     RestartCommand,
     SynchronizeCommand,
     WaitUntilComponentsReadyCommand,
 )
 from .hostsources import Host
-from .transports import TransportError
-from .utils import sleep
+from .errorbudget import enable_circuit_breaker
+from .parallelism import enable_adaptive_parallelism
+from .scheduling import HostPacer, PoolScheduler, Slot, batch_commands
+from .transports import ConnectionError, TransportError
+from .utils import (
+    MAX_PARALLELISM,
+    ResizableSemaphore,
+    gather_fail_fast,
+    probe_tcp,
+    sleep,
+)
+
+
+# pre-connections may sit idle through the build and canary prompts. older
+# ones are replaced rather than trusted to still work.
+PRECONNECTION_MAX_AGE = 120
+
+# how long a pre-connection gets to answer a keepalive before it's replaced
+PRECONNECTION_CHECK_TIMEOUT = 5
 
 
 SIGNAL_MESSAGES = {
@@ -62,10 +83,38 @@ class ComponentNotBuiltError(DeployError):
 DeployResult = collections.namedtuple('DeployResult', ['command', 'result'])
 
 
+def is_up_to_date(components_result, deploy_command):
+    """Check if a host runs the deploy token for every deployed component.
+
+    :param dict components_result: the host's result from the `components`
+        command, mapping components to the count of processes running each
+        token.
+
+    """
+    running = components_result.get("components", {})
+    for ref in deploy_command.args:
+        component, at, token = ref.partition("@")
+        running_tokens = {running_token for running_token, count
+                          in running.get(component, {}).iteritems() if count}
+        if running_tokens != {token}:
+            return False
+    return True
+
+
 class Deployer(object):
 
     def __init__(self, config, event_bus, parallel,
-                 sleeptime, timeout, dangerously_fast):
+                 sleeptime, timeout, dangerously_fast, build_parallel=0,
+                 build_cache=None, min_parallel=1, max_parallel=0, rate=0,
+                 burst=1, pool_limits=None, ready_parallel=0,
+                 command_parallel=None, prefetch_parallel=0,
+                 skip_up_to_date=False, preflight_parallel=MAX_PARALLELISM,
+                 completed_hosts=None, retries=0, retry_backoff=0,
+                 retry_parallel=1, error_budget=None,
+                 terminated_error_budget=None, error_budget_window=20,
+                 command_timeouts=None, reachability_parallel=0,
+                 reachability_timeout=3, reachability_port=22,
+                 command_dependencies=None, batch_mode=False):
         """
         :param dict config:
         :param EventBus event_bus:
@@ -73,6 +122,64 @@ class Deployer(object):
         :param float sleeptime: sleep time between hosts
         :param int timeout: command execution timeout
         :param bool dangerously_fast: flag to ignore wait for reloads
+        :param int build_parallel: number of build hosts to build on in
+            parallel, 0 for no limit
+        :param BuildCache build_cache: cache of previous builds to skip
+            rebuilding already built components, None to always build
+        :param int min_parallel: lower bound for adaptive parallelism
+        :param int max_parallel: upper bound for adaptive parallelism. if
+            greater than `parallel`, the number of hosts processed in parallel
+            starts at `parallel` and adapts to how the deploy is going
+        :param float rate: hosts to start per minute, overrides `sleeptime`
+            when non-zero
+        :param int burst: how many hosts may be started back to back when
+            pacing by `rate`
+        :param list pool_limits: (glob, PoolLimit) pairs limiting how many
+            hosts of each pool may be in flight at once
+        :param int ready_parallel: if non-zero, hosts give up their parallel
+            slot when they reach commands that aren't concurrency critical,
+            like waiting for components to be ready, and up to this many hosts
+            run those commands at once instead
+        :param dict command_parallel: mapping of command names to how many
+            hosts may run that command at once
+        :param int prefetch_parallel: if non-zero, run the deploy command on
+            every host up front, this many at a time, and only roll out the
+            remaining commands afterwards
+        :param bool skip_up_to_date: query the running components on every
+            host before rolling out and skip hosts that already run the
+            tokens being deployed
+        :param int preflight_parallel: how many hosts to query at once before
+            rolling out
+        :param dict completed_hosts: when resuming a deploy, a mapping of
+            names of hosts that already finished to the deploy tokens they
+            finished with. those hosts are skipped if the tokens still match.
+        :param int retries: how many times to retry hosts that failed once
+            the rollout is done
+        :param int retry_backoff: seconds to wait before the first retry,
+            doubled for every retry after that
+        :param int retry_parallel: number of hosts to retry in parallel
+        :param ErrorBudget error_budget: how many hosts that should be alive
+            may fail before the rollout is stopped, None for no limit
+        :param ErrorBudget terminated_error_budget: how many possibly
+            terminated hosts may fail before the rollout is stopped, None for
+            no limit
+        :param int error_budget_window: how many of the most recently
+            finished hosts percentage error budgets apply to
+        :param dict command_timeouts: mapping of command names to timeouts
+            that override `timeout` for those commands
+        :param int reachability_parallel: if non-zero, check that every host
+            accepts TCP connections before rolling out, this many at a time,
+            and leave out hosts that don't
+        :param int reachability_timeout: seconds to wait for each host to
+            accept a connection when checking reachability
+        :param int reachability_port: port to check reachability on
+        :param dict command_dependencies: mapping of command names to the
+            names of the commands they depend on. commands run at the same
+            time on a host when their dependencies allow it. commands that
+            aren't listed wait for every command before them.
+        :param bool batch_mode: send each host all of its commands at once
+            and have the deploy script's batch command run them, rather than
+            invoking the deploy script once per command
 
         """
         self.log = logging.getLogger(__name__)
@@ -84,45 +191,285 @@ class Deployer(object):
         self.execution_timeout = timeout
         self.sleeptime = sleeptime
         self.dangerously_fast = dangerously_fast
+        self.build_parallel = build_parallel
+        self.build_cache = build_cache
+        self.min_parallel = min_parallel
+        self.max_parallel = max_parallel
+        self.rate = rate
+        self.burst = burst
+        self.pool_limits = pool_limits or []
+        if ready_parallel:
+            self.ready_limiter = DeferredSemaphore(tokens=ready_parallel)
+        else:
+            self.ready_limiter = None
+        self.command_limiters = {
+            name: DeferredSemaphore(tokens=count)
+            for name, count in (command_parallel or {}).iteritems()
+        }
+        self.prefetch_parallel = prefetch_parallel
+        self.skip_up_to_date = skip_up_to_date
+        self.preflight_parallel = preflight_parallel
+        self.completed_hosts = completed_hosts or {}
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_parallel = retry_parallel
+        self.error_budget = error_budget
+        self.terminated_error_budget = terminated_error_budget
+        self.error_budget_window = error_budget_window
+        self.command_timeouts = command_timeouts or {}
+        self.reachability_parallel = reachability_parallel
+        self.reachability_timeout = reachability_timeout
+        self.reachability_port = reachability_port
+        self.command_dependencies = command_dependencies or {}
+        self.batch_mode = batch_mode
+        self.preconnections = {}
+        self.failed_hosts = []
+        self.breaker = None
+        self.breaker_skipped = []
+
+    def preconnect(self, hosts):
+        """Start connecting to hosts before they're processed.
+
+        This is used to overlap connection setup for the first wave of hosts
+        with the sync/build phase. The connections are picked up by
+        :meth:`process_host` when the host's turn comes.
+
+        """
+        def on_preconnect_error(reason, host):
+            # process_host will try again and report the error properly
+            self.log.debug("pre-connect to %s failed: %s",
+                           host.name, reason.getErrorMessage())
+            return None
+
+        for host in hosts:
+            connecting = self.transport.connect_to(host.address)
+            connecting.addErrback(on_preconnect_error, host)
+            self.preconnections[host] = (connecting, time.time())
+
+    def close_preconnections(self, keep=()):
+        """Disconnect pre-connections that were never used.
+
+        :param list keep: hosts whose pre-connections should be left open
+            because they're still going to be deployed to
+
+        """
+        def disconnect(connection):
+            if connection:
+                return connection.disconnect()
+
+        keep = set(keep)
+        for host in self.preconnections.keys():
+            if host in keep:
+                continue
+
+            connecting, connect_time = self.preconnections.pop(host)
+            connecting.addCallback(disconnect)
+            connecting.addErrback(lambda reason: None)
 
     @inlineCallbacks
-    def process_host(self, host, commands, timeout=0):
-        log = logging.LoggerAdapter(self.log, {"host": host.name})
+    def take_preconnection(self, host):
+        """Return the host's pre-connection if it's still usable, else None.
 
-        yield self.event_bus.trigger("host.begin", host=host)
+        Pre-connections that are too old or don't answer a keepalive are
+        disconnected, the host can't be left hanging on a dead connection.
 
+        """
+        connecting, connect_time = self.preconnections.pop(host)
+        connection = yield connecting
+        if not connection:
+            returnValue(None)
+
+        is_alive = False
+        if time.time() - connect_time < PRECONNECTION_MAX_AGE:
+            is_alive = yield connection.check_alive(
+                PRECONNECTION_CHECK_TIMEOUT)
+        if is_alive:
+            returnValue(connection)
+
+        self.log.debug("discarding stale pre-connection to %s", host.name)
+        yield connection.disconnect()
+        returnValue(None)
+
+    @inlineCallbacks
+    def connect_to_host(self, host):
+        if host in self.preconnections:
+            connection = yield self.take_preconnection(host)
+            if connection:
+                returnValue(connection)
+
+        connection = yield self.transport.connect_to(host.address)
+        returnValue(connection)
+
+    @inlineCallbacks
+    def run_command(self, log, host, connection, command, timeout=0):
+        """Run a single command on a host that's already connected to.
+
+        Commands may run at the same time on a host, so every command that
+        succeeds reports how long it took with a host.command_end event.
+
+        """
+        log.info(" ".join(command.cmdline()))
+        yield self.event_bus.trigger(
+            "host.command", host=host, command=command.name)
+        start_time = time.time()
+        command_timeout = self.command_timeouts.get(command.name, timeout)
+        command_limiter = self.command_limiters.get(command.name)
+        if command_limiter:
+            result = yield command_limiter.run(
+                connection.execute, log, command.cmdline(), command_timeout)
+        else:
+            result = yield connection.execute(
+                log, command.cmdline(), command_timeout)
+        yield self.event_bus.trigger(
+            "host.command_end", host=host, command=command.name,
+            duration=time.time() - start_time)
+        returnValue(result)
+
+    @inlineCallbacks
+    def run_commands_in_batch(self, log, host, connection, commands,
+                              timeout=0):
+        """Run all of a host's commands with a single remote invocation.
+
+        The host decides which commands to skip and the commands run in
+        order, so per-command parallelism limits, dependencies and moving to
+        the ready limiter don't apply. The batch times out once the timeouts
+        of all its commands have passed.
+
+        """
         results = []
+        start_times = {}
 
-        try:
-            log.info("connecting")
-            connection = yield self.transport.connect_to(host.address)
-            command_queue = commands[:]
-            while command_queue:
-                command = command_queue.pop(0)
+        def on_event(event):
+            index = event.get("index")
+            if not (isinstance(index, int) and 0 <= index < len(commands)):
+                log.warning("unexpected event from batch: %r", event)
+                return
+            command = commands[index]
+
+            if event.get("event") == "begin":
                 log.info(" ".join(command.cmdline()))
-                yield self.event_bus.trigger(
+                start_times[index] = time.time()
+                self.event_bus.trigger(
                     "host.command", host=host, command=command.name)
-                result = yield connection.execute(log, command.cmdline(), timeout)
-
+            elif event.get("event") == "end":
+                if index in start_times:
+                    self.event_bus.trigger(
+                        "host.command_end", host=host, command=command.name,
+                        duration=time.time() - start_times.pop(index))
+                result = event.get("result") or {}
                 results.append(DeployResult(command.name, result))
+                if command.check_result(result) == Command.SKIP_REMAINING:
+                    log.info("{} reported no changes, skipping remaining not "
+                             "explicitly defined steps.".format(command.name))
 
-                control = command.check_result(result)
-                if control == Command.SKIP_REMAINING:
-                    log.info("{} reported no changes, skipping remaining not explicitly defined steps.".format(command.name))
-                    command_queue = [cmd for cmd in command_queue if cmd.explicit]
+        timeouts = [self.command_timeouts.get(command.name, timeout)
+                    for command in commands]
+        batch_timeout = sum(timeouts) if all(timeouts) else 0
 
-            yield connection.disconnect()
-        except TransportError as e:
-            should_be_alive = yield self.host_source.should_be_alive(host)
-            if should_be_alive:
-                log.error("error: %s", e)
-            else:
-                log.warning("error on possibly terminated host: %s", e)
+        yield connection.execute_batch(
+            log, [command.to_batch() for command in commands], on_event,
+            batch_timeout)
+        returnValue(results)
+
+    @inlineCallbacks
+    def run_commands(self, log, host, commands, timeout=0, slot=None):
+        """Connect to a host and run commands on it.
+
+        Commands that don't depend on each other run at the same time over
+        the same connection.
 
+        :param Slot slot: the parallelism slot the host was started with. it
+            will be moved to the ready limiter for commands that aren't
+            concurrency critical.
+        :raises TransportError: if connecting or any of the commands fails
+
+        """
+        log.info("connecting")
+        connection = yield self.connect_to_host(host)
+        yield self.event_bus.trigger("host.connected", host=host)
+
+        running = []
+        try:
+            if self.batch_mode:
+                results = yield self.run_commands_in_batch(
+                    log, host, connection, commands, timeout)
+                returnValue(results)
+
+            results = []
+            batch_queue = batch_commands(commands, self.command_dependencies)
+            while batch_queue:
+                batch = batch_queue.pop(0)
+
+                if slot and self.ready_limiter:
+                    if any(command.concurrency_critical for command in batch):
+                        yield slot.move_to(slot.home)
+                    else:
+                        yield slot.move_to(self.ready_limiter)
+
+                running = [
+                    self.run_command(log, host, connection, command, timeout)
+                    for command in batch
+                ]
+                try:
+                    batch_results = yield gatherResults(
+                        running, consumeErrors=True)
+                except FirstError as e:
+                    e.subFailure.raiseException()
+
+                skip_remaining = False
+                for command, result in zip(batch, batch_results):
+                    results.append(DeployResult(command.name, result))
+
+                    control = command.check_result(result)
+                    if control == Command.SKIP_REMAINING:
+                        log.info("{} reported no changes, skipping remaining "
+                                 "not explicitly defined steps.".format(
+                                     command.name))
+                        skip_remaining = True
+
+                if skip_remaining:
+                    batch_queue = [
+                        [cmd for cmd in queued if cmd.explicit]
+                        for queued in batch_queue
+                    ]
+                    batch_queue = [queued for queued in batch_queue if queued]
+        finally:
+            # disconnecting stops any commands that were running alongside
+            # one that failed. the host isn't done until they have stopped.
+            yield connection.disconnect()
+            yield DeferredList(running, consumeErrors=True)
             yield self.event_bus.trigger(
-                "host.abort", host=host, error=e,
-                should_be_alive=should_be_alive)
-            raise HostDeployError(host, e)
+                "transport.timers", live=self.transport.live_timers)
+
+        returnValue(results)
+
+    @inlineCallbacks
+    def report_host_error(self, log, host, error):
+        """Report a host as failed and raise HostDeployError for it."""
+        should_be_alive = yield self.host_source.should_be_alive(host)
+        if should_be_alive:
+            log.error("error: %s", error)
+        else:
+            log.warning("error on possibly terminated host: %s", error)
+        if error.stderr_tail:
+            log.warning("last output:\n%s", "\n".join(error.stderr_tail))
+
+        yield self.event_bus.trigger(
+            "host.abort", host=host, error=error,
+            should_be_alive=should_be_alive)
+        raise HostDeployError(host, error)
+
+    @inlineCallbacks
+    def process_host(self, host, commands, timeout=0, slot=None):
+        log = logging.LoggerAdapter(self.log, {"host": host.name})
+
+        yield self.event_bus.trigger("host.begin", host=host)
+
+        try:
+            results = yield self.run_commands(
+                log, host, commands, timeout, slot)
+        except TransportError as e:
+            yield self.report_host_error(log, host, e)
         else:
             log.info("success! all done")
             yield self.event_bus.trigger(
@@ -130,6 +477,317 @@ class Deployer(object):
 
         returnValue(results)
 
+    @inlineCallbacks
+    def skip_completed_hosts(self, hosts, deploy_tokens):
+        """Drop hosts that finished with the same tokens before a resume.
+
+        :returns: the hosts that still need to be deployed to
+
+        """
+        remaining_hosts = []
+        completed_hosts = []
+        for host in hosts:
+            if self.completed_hosts.get(host.name) == deploy_tokens:
+                completed_hosts.append(host)
+            else:
+                remaining_hosts.append(host)
+
+        yield self.event_bus.trigger(
+            "deploy.skip", hosts=completed_hosts,
+            reason="completed before resuming")
+        for host in completed_hosts:
+            yield self.event_bus.trigger("host.end", host=host, results=[])
+
+        returnValue(remaining_hosts)
+
+    @inlineCallbacks
+    def query_components(self, host):
+        """Return the host's `components` result or None if it failed."""
+        log = logging.LoggerAdapter(self.log, {"host": host.name})
+
+        try:
+            (result,) = yield self.run_commands(
+                log, host, [ComponentsCommand()], self.execution_timeout)
+        except TransportError as e:
+            log.warning("could not query components: %s", e)
+            returnValue(None)
+        returnValue(result)
+
+    @inlineCallbacks
+    def skip_hosts_up_to_date(self, hosts, deploy_command):
+        """Drop hosts that already run what we're about to deploy.
+
+        Hosts that can't be queried are kept and left for the rollout to deal
+        with. Skipped hosts are reported as done.
+
+        :returns: the hosts that still need to be deployed to
+
+        """
+        limiter = DeferredSemaphore(tokens=self.preflight_parallel)
+        queries = [limiter.run(self.query_components, host) for host in hosts]
+        results = yield gatherResults(queries)
+
+        outdated_hosts = []
+        up_to_date = []
+        for host, result in zip(hosts, results):
+            if result and is_up_to_date(result.result, deploy_command):
+                up_to_date.append((host, result))
+            else:
+                outdated_hosts.append(host)
+
+        yield self.event_bus.trigger(
+            "deploy.skip", hosts=[host for host, result in up_to_date],
+            reason="already up to date")
+        for host, result in up_to_date:
+            yield self.event_bus.trigger(
+                "host.end", host=host, results=[result])
+
+        returnValue(outdated_hosts)
+
+    @inlineCallbacks
+    def find_unreachable_hosts(self, hosts):
+        """Return the hosts that don't accept TCP connections."""
+        limiter = DeferredSemaphore(tokens=self.reachability_parallel)
+        reachable = yield gatherResults([
+            limiter.run(probe_tcp, host.address, self.reachability_port,
+                        self.reachability_timeout)
+            for host in hosts
+        ])
+        returnValue([host for host, is_reachable in zip(hosts, reachable)
+                     if not is_reachable])
+
+    @inlineCallbacks
+    def skip_unreachable_hosts(self, hosts, unreachable_hosts):
+        """Leave unreachable hosts out of the rollout.
+
+        They are reported as failed up front, rather than each holding a slot
+        until its connection times out. Hosts that the host source still
+        expects to be alive count as failures and may be retried.
+
+        :returns: the hosts that were reachable
+
+        """
+        unreachable = set(unreachable_hosts)
+        unreachable_hosts = [host for host in hosts if host in unreachable]
+        yield self.event_bus.trigger(
+            "deploy.skip", hosts=unreachable_hosts, reason="unreachable")
+
+        limiter = DeferredSemaphore(tokens=self.preflight_parallel)
+        reports = []
+        for host in unreachable_hosts:
+            log = logging.LoggerAdapter(self.log, {"host": host.name})
+            error = ConnectionError("unreachable on port %d" %
+                                    self.reachability_port)
+            deferred = limiter.run(self.report_host_error, log, host, error)
+            deferred.addErrback(self.record_host_failure)
+            deferred.addErrback(lambda reason: reason.trap(HostDeployError))
+            reports.append(deferred)
+        yield gatherResults(reports)
+
+        returnValue([host for host in hosts if host not in unreachable])
+
+    @inlineCallbacks
+    def prefetch_host(self, host, deploy_command):
+        log = logging.LoggerAdapter(self.log, {"host": host.name})
+
+        try:
+            (result,) = yield self.run_commands(
+                log, host, [deploy_command], self.execution_timeout)
+        except TransportError as e:
+            yield self.report_host_error(log, host, e)
+
+        returnValue(result)
+
+    @inlineCallbacks
+    def prefetch(self, hosts, deploy_command, commands):
+        """Run the deploy command on every host ahead of the rollout.
+
+        Deploying doesn't disrupt the host, so it is run everywhere at once
+        without pacing or waiting on the deploy strategy. Only the remaining
+        commands are rolled out afterwards. Hosts where the deploy changed
+        nothing only run the remaining explicit commands, if any.
+
+        :returns: a tuple of the hosts that still need to be rolled out to and
+            a mapping of those hosts to the commands they need to run
+
+        """
+        yield self.event_bus.trigger("prefetch.begin", hosts=hosts)
+
+        limiter = DeferredSemaphore(tokens=self.prefetch_parallel)
+        prefetches = []
+        for host in hosts:
+            deferred = limiter.run(self.prefetch_host, host, deploy_command)
+            deferred.addErrback(self.record_host_failure)
+            deferred.addErrback(self.on_host_error)
+            prefetches.append(deferred)
+        prefetch_results = yield gatherResults(prefetches)
+
+        remaining_hosts = []
+        host_commands = {}
+        done_hosts = []
+        unchanged_count = 0
+        for host, result in zip(hosts, prefetch_results):
+            if result is None:
+                # the host failed and has already been reported
+                continue
+
+            control = deploy_command.check_result(result.result)
+            if control == Command.SKIP_REMAINING:
+                unchanged_count += 1
+                commands_left = [cmd for cmd in commands if cmd.explicit]
+            else:
+                commands_left = commands
+
+            if commands_left:
+                remaining_hosts.append(host)
+                host_commands[host] = commands_left
+            else:
+                done_hosts.append((host, result))
+
+        yield self.event_bus.trigger(
+            "deploy.skip", hosts=[host for host, result in done_hosts],
+            reason="nothing left to do after the deploy")
+        for host, result in done_hosts:
+            yield self.event_bus.trigger(
+                "host.end", host=host, results=[result])
+
+        yield self.event_bus.trigger(
+            "prefetch.end",
+            remaining=len(remaining_hosts),
+            unchanged=unchanged_count,
+            failed=prefetch_results.count(None),
+        )
+        returnValue((remaining_hosts, host_commands))
+
+    @inlineCallbacks
+    def build_on_host(self, build_hostname, build_refs):
+        """Build components on a build host and return their deploy refs.
+
+        Components with a cached build are not built again.
+
+        """
+        log = logging.LoggerAdapter(self.log, {"host": build_hostname})
+
+        deploy_refs = []
+        refs_to_build = []
+        for ref in build_refs:
+            component, at, sync_token = ref.partition("@")
+            assert at == "@"
+
+            cached_token = None
+            if self.build_cache:
+                cached_token = self.build_cache.get(ref)
+
+            if cached_token:
+                log.info("using cached build of %s", ref)
+                deploy_refs.append(component + "@" + cached_token)
+                yield self.event_bus.trigger(
+                    "build.cache_hit", component=component, ref=ref,
+                    token=cached_token)
+            else:
+                refs_to_build.append(ref)
+
+        if not refs_to_build:
+            returnValue(deploy_refs)
+
+        build_command = BuildCommand(refs_to_build)
+        build_host = Host.from_hostname(build_hostname)
+        (build_result,) = yield self.process_host(
+            build_host, [build_command])
+
+        for ref in refs_to_build:
+            component, at, sync_token = ref.partition("@")
+            try:
+                deploy_token = build_result.result[ref]
+            except KeyError:
+                raise ComponentNotBuiltError(component)
+            deploy_refs.append(component + "@" + deploy_token)
+
+            if self.build_cache:
+                self.build_cache.put(ref, deploy_token)
+        returnValue(deploy_refs)
+
+    def make_pacer(self):
+        if self.rate:
+            return HostPacer.from_hosts_per_minute(self.rate, self.burst)
+        elif self.sleeptime:
+            return HostPacer.from_sleeptime(self.sleeptime)
+        return None
+
+    @inlineCallbacks
+    def process_host_in_slot(self, limiter, host, commands):
+        """Wait for a slot from limiter, then process the host."""
+        slot = Slot(limiter)
+        yield slot.acquire()
+        try:
+            # hosts queue up for a slot long before it's their turn, so the
+            # error budget may have run out while this one was waiting
+            if self.breaker and self.breaker.tripped:
+                self.breaker_skipped.append(host)
+                returnValue(None)
+
+            results = yield self.process_host(
+                host, commands, timeout=self.execution_timeout, slot=slot)
+        finally:
+            slot.release()
+        returnValue(results)
+
+    def _on_host_done(self, result, scheduler, host):
+        scheduler.host_done(host)
+        return result
+
+    def record_host_failure(self, reason):
+        """Remember hosts that failed so they can be retried later."""
+        if reason.check(HostDeployError):
+            self.failed_hosts.append(reason.value.host)
+        return reason
+
+    @inlineCallbacks
+    def retry_failed_hosts(self, host_commands, commands):
+        """Retry hosts that failed during the rollout.
+
+        Each round waits out an exponential backoff and then processes the
+        failed hosts again, independently of the rollout's parallelism,
+        pacing, and deploy strategy. Hosts that the host source no longer
+        expects to be alive are dropped rather than retried.
+
+        """
+        for attempt in xrange(self.retries):
+            if not self.failed_hosts:
+                break
+            failed_hosts, self.failed_hosts = self.failed_hosts, []
+
+            limiter = DeferredSemaphore(tokens=self.preflight_parallel)
+            alive = yield gatherResults([
+                limiter.run(self.host_source.should_be_alive, host)
+                for host in failed_hosts
+            ])
+            hosts = [host for host, should_be_alive
+                     in zip(failed_hosts, alive) if should_be_alive]
+            yield self.event_bus.trigger(
+                "deploy.skip",
+                hosts=[host for host in failed_hosts if host not in hosts],
+                reason="possibly terminated, not retrying")
+            if not hosts:
+                break
+
+            delay = self.retry_backoff * 2 ** attempt
+            yield self.event_bus.trigger(
+                "deploy.retry", hosts=hosts, attempt=attempt + 1, delay=delay)
+            if delay:
+                yield sleep(delay)
+
+            limiter = DeferredSemaphore(tokens=self.retry_parallel)
+            retries = []
+            for host in hosts:
+                deferred = limiter.run(
+                    self.process_host, host, host_commands.get(host, commands),
+                    timeout=self.execution_timeout)
+                deferred.addErrback(self.record_host_failure)
+                deferred.addErrback(self.on_host_error)
+                retries.append(deferred)
+            yield DeferredList(retries)
+
     @inlineCallbacks
     def on_host_error(self, reason):
         if not reason.check(DeployError):
@@ -157,10 +815,20 @@ class Deployer(object):
 
         yield self.event_bus.trigger("deploy.begin")
 
+        host_commands = {}
+        deploy_tokens = []
         try:
+            if self.reachability_parallel:
+                # check the hosts while syncing and building
+                reachability_scan = self.find_unreachable_hosts(hosts)
+
             if components:
                 yield self.event_bus.trigger("build.begin")
 
+                # get the ssh handshakes for the first wave of hosts out of
+                # the way while we wait on the sync and build
+                self.preconnect(hosts[:self.parallel])
+
                 try:
                     # synchronize the code host with upstreams
                     # this will return a build token and build host for each
@@ -172,11 +840,8 @@ class Deployer(object):
                     yield self.event_bus.trigger("build.sync",
                                                  sync_info=sync_result.result)
 
-                    # this is where we build up the final deploy command
-                    # resulting from all our syncing and building
-                    deploy_command = DeployCommand()
-
                     # collect the results of the sync per-buildhost
+                    deploy_refs = []
                     by_buildhost = collections.defaultdict(list)
                     for component, sync_info in sync_result.result.iteritems():
                         component_ref = component + "@" + sync_info["token"]
@@ -187,25 +852,33 @@ class Deployer(object):
                         else:
                             # no build host means we just pass the sync token
                             # straight through as a deploy token
-                            deploy_command.add_argument(component_ref)
+                            deploy_refs.append(component_ref)
 
                     # ask each build host to build our components and return
-                    # a deploy token
-                    for build_hostname, build_refs in by_buildhost.iteritems():
-                        build_command = BuildCommand(build_refs)
-                        build_host = Host.from_hostname(build_hostname)
-                        (build_result,) = yield self.process_host(
-                            build_host, [build_command])
-
-                        for ref in build_refs:
-                            component, at, sync_token = ref.partition("@")
-                            assert at == "@"
-                            try:
-                                deploy_ref = (component + "@" +
-                                              build_result.result[ref])
-                            except KeyError:
-                                raise ComponentNotBuiltError(component)
-                            deploy_command.add_argument(deploy_ref)
+                    # a deploy token. the builds run concurrently and the
+                    # first failure fails the deploy. builds that haven't
+                    # started yet are cancelled, running ones are abandoned.
+                    build_limiter = DeferredSemaphore(
+                        tokens=self.build_parallel or len(by_buildhost) or 1)
+                    builds = [
+                        build_limiter.run(self.build_on_host, build_hostname,
+                                          sorted(by_buildhost[build_hostname]))
+                        for build_hostname in sorted(by_buildhost)
+                    ]
+                    build_results = yield gather_fail_fast(builds)
+                    for built_refs in build_results:
+                        deploy_refs.extend(built_refs)
+
+                    if self.build_cache:
+                        self.build_cache.save()
+
+                    # this is where we build up the final deploy command
+                    # resulting from all our syncing and building. the refs
+                    # are sorted so the command is the same no matter which
+                    # order the builds finished in.
+                    deploy_command = DeployCommand()
+                    for deploy_ref in sorted(deploy_refs):
+                        deploy_command.add_argument(deploy_ref)
 
                     # Wait until components report ready IF:
                     # * we are actually restarting a component
@@ -222,33 +895,86 @@ class Deployer(object):
                     # the command list for each host
                     commands = [deploy_command] + commands
 
+                deploy_tokens = deploy_command.args
+                yield self.event_bus.trigger(
+                    "build.tokens", tokens=deploy_tokens)
                 yield self.event_bus.trigger("build.end")
 
-            parallelism_limiter = DeferredSemaphore(tokens=self.parallel)
+            if self.completed_hosts:
+                hosts = yield self.skip_completed_hosts(hosts, deploy_tokens)
+                self.close_preconnections(keep=hosts)
+
+            if self.reachability_parallel:
+                unreachable_hosts = yield reachability_scan
+                hosts = yield self.skip_unreachable_hosts(
+                    hosts, unreachable_hosts)
+                self.close_preconnections(keep=hosts)
+
+            if components and self.skip_up_to_date:
+                hosts = yield self.skip_hosts_up_to_date(
+                    hosts, deploy_command)
+                self.close_preconnections(keep=hosts)
+
+            if components and self.prefetch_parallel:
+                hosts, host_commands = yield self.prefetch(
+                    hosts, deploy_command, commands[1:])
+                self.close_preconnections(keep=hosts)
+
+            if self.max_parallel > self.parallel:
+                parallelism_limiter = ResizableSemaphore(tokens=self.parallel)
+                enable_adaptive_parallelism(
+                    parallelism_limiter, self.event_bus, hosts,
+                    self.min_parallel, self.max_parallel)
+            else:
+                parallelism_limiter = DeferredSemaphore(tokens=self.parallel)
+            if self.error_budget or self.terminated_error_budget:
+                self.breaker = enable_circuit_breaker(
+                    self.event_bus, hosts, self.error_budget,
+                    self.terminated_error_budget, self.error_budget_window)
+            pacer = self.make_pacer()
+            scheduler = PoolScheduler(hosts, self.pool_limits)
             host_deploys = []
-            first_host = True
-            for host in hosts:
-                if not first_host:
-                    for i in xrange(self.sleeptime, 0, -1):
-                        yield self.event_bus.trigger(
-                            "deploy.sleep", host=host, count=i)
-                        yield sleep(1)
-                else:
-                    first_host = False
-
-                deferred = parallelism_limiter.run(
-                    self.process_host, host, commands,
-                    timeout=self.execution_timeout)
+            while True:
+                host = yield scheduler.next_host()
+                if host is None:
+                    break
+
+                delay = pacer.reserve() if pacer else 0
+                if delay:
+                    yield self.event_bus.trigger(
+                        "deploy.sleep", host=host, until=time.time() + delay)
+                    yield sleep(delay)
+
+                if self.breaker and self.breaker.tripped:
+                    # stop issuing hosts, but let the ones in flight finish
+                    break
+
+                deferred = self.process_host_in_slot(
+                    parallelism_limiter, host,
+                    host_commands.get(host, commands))
+                deferred.addErrback(self.record_host_failure)
                 deferred.addErrback(self.on_host_error)
+                deferred.addBoth(self._on_host_done, scheduler, host)
                 host_deploys.append(deferred)
 
                 yield self.event_bus.trigger(
                     "deploy.enqueue", host=host, deferred=deferred)
             yield DeferredList(host_deploys)
+
+            if self.breaker and self.breaker.tripped:
+                yield self.event_bus.trigger(
+                    "deploy.skip", hosts=self.breaker_skipped,
+                    reason="error budget exceeded")
+                raise DeployError(self.breaker.reason)
+
+            if self.retries:
+                yield self.retry_failed_hosts(host_commands, commands)
         except (DeployError, AbortDeploy, TransportError) as e:
             yield self.abort(str(e))
         else:
             yield self.event_bus.trigger("deploy.end")
+        finally:
+            self.close_preconnections()
 
     @inlineCallbacks
     def abort(self, reason):
@@ -0,0 +1,136 @@
+"""Abort a rollout early once too many hosts have failed.
+
+Failures on hosts that should be alive and on hosts that may have been
+terminated are budgeted separately, since the latter usually say more about
+the autoscaler than about the code being deployed.
+
+"""
+import collections
+import logging
+
+
+class ErrorBudget(object):
+    """How many host failures a rollout can take before it's stopped.
+
+    The budget is either a number of failures over the whole rollout or a
+    percentage of the hosts in a sliding window of the most recently finished
+    hosts.
+
+    """
+
+    def __init__(self, count=None, percent=None):
+        assert (count is None) != (percent is None)
+        self.count = count
+        self.percent = percent
+
+    @classmethod
+    def parse(cls, value):
+        """Parse either a number of failures or a percentage like "10%"."""
+        value = value.strip()
+        if value.endswith("%"):
+            percent = float(value[:-1])
+            if not 0 <= percent < 100:
+                raise ValueError("percentage must be between 0 and 100")
+            return cls(percent=percent)
+
+        count = int(value)
+        if count < 0:
+            raise ValueError("budget can't be negative")
+        return cls(count=count)
+
+    def __str__(self):
+        if self.count is not None:
+            return _failures(self.count)
+        return "%g%% failures" % self.percent
+
+
+def _failures(count):
+    return "%d failure%s" % (count, "" if count == 1 else "s")
+
+
+def parse_error_budget(value):
+    """Config coercer for error budgets. An empty value means no budget."""
+    if not value.strip():
+        return None
+    return ErrorBudget.parse(value)
+
+
+class CircuitBreaker(object):
+    """Keep track of failures against the error budgets of a rollout."""
+
+    def __init__(self, hosts, budget, terminated_budget, window):
+        """
+        :param list hosts: the hosts being rolled out to
+        :param ErrorBudget budget: budget for failures on hosts that should
+            be alive, None for no limit
+        :param ErrorBudget terminated_budget: budget for failures on hosts
+            that may have been terminated, None for no limit
+        :param int window: how many of the most recently finished hosts
+            percentage budgets apply to
+
+        """
+        self.log = logging.getLogger(__name__)
+        self.hosts = set(hosts)
+        self.window = window
+        self.budgets = {True: budget, False: terminated_budget}
+        self.failures = collections.Counter()
+        self.recent = {
+            True: collections.deque(maxlen=window),
+            False: collections.deque(maxlen=window),
+        }
+        self.reason = None
+
+    @property
+    def tripped(self):
+        return self.reason is not None
+
+    def _record(self, failed_kind):
+        for kind, recent in self.recent.iteritems():
+            recent.append(kind == failed_kind)
+
+    def _check(self, kind):
+        budget = self.budgets[kind]
+        if not budget or self.tripped:
+            return
+
+        which = ("hosts that should be alive" if kind
+                 else "possibly terminated hosts")
+        if budget.count is not None:
+            if self.failures[kind] > budget.count:
+                self.reason = (
+                    "error budget exceeded: %s on %s, the budget is %d" % (
+                        _failures(self.failures[kind]), which, budget.count))
+        else:
+            # compare against the whole window even while it's filling up, so
+            # that a rollout where every host fails is stopped right away
+            recent = self.recent[kind]
+            failed = sum(recent)
+            if failed > budget.percent * self.window / 100.:
+                self.reason = (
+                    "error budget exceeded: %d of the last %d hosts failed "
+                    "(%s), the budget is %g%%" % (
+                        failed, len(recent), which, budget.percent))
+
+        if self.tripped:
+            self.log.error("%s", self.reason)
+
+    def on_host_end(self, host, results):
+        if host in self.hosts:
+            self._record(None)
+
+    def on_host_abort(self, host, error, should_be_alive):
+        if host in self.hosts:
+            kind = bool(should_be_alive)
+            self.failures[kind] += 1
+            self._record(kind)
+            self._check(kind)
+
+
+def enable_circuit_breaker(event_bus, hosts, budget, terminated_budget,
+                           window):
+    breaker = CircuitBreaker(hosts, budget, terminated_budget, window)
+    event_bus.register({
+        "host.end": breaker.on_host_end,
+        "host.abort": breaker.on_host_abort,
+    })
+    return breaker
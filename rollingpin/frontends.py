@@ -19,6 +19,7 @@ from twisted.internet.protocol import Protocol
 from twisted.internet.stdio import StandardIO
 
 from .deploy import AbortDeploy
+from .progress import format_duration
 from .status import fetch_deploy_status
 
 
@@ -59,7 +60,9 @@ class HostFormatter(logging.Formatter):
         formatted = logging.Formatter.format(self, record).decode("utf8")
 
         if hasattr(record, "host"):
-            formatted = (self.hostname_format % record.host) + formatted
+            prefix = self.hostname_format % record.host
+            formatted = "\n".join(
+                prefix + line for line in formatted.split("\n"))
 
         color = COLOR_BY_LOGLEVEL[record.levelno]
         return colorize(formatted, color)
@@ -85,7 +88,22 @@ def generate_component_report(host_results):
     return report
 
 
+def deployable_hosts(hosts):
+    """Leave out the hosts that were skipped rather than deployed to.
+
+    Skipped hosts were never restarted, so they don't count towards the
+    deploy strategies' canaries and percentages.
+
+    """
+    return {host: state for host, state in hosts.iteritems()
+            if state["status"] != "skipped"}
+
+
 def calculate_percent_complete(hosts):
+    hosts = deployable_hosts(hosts)
+    if not hosts:
+        return 100
+
     completed = sum(1 for state in hosts.itervalues()
                     if state["status"] == "complete")
     return int((completed / len(hosts)) * 100)
@@ -115,14 +133,23 @@ class HeadlessFrontend(object):
 
         self.hosts = {host: {"status": "pending"} for host in hosts}
         self.start_time = None
+        self.skipped_count = 0
 
         event_bus.register({
             "deploy.begin": self.on_deploy_begin,
             "deploy.end": self.on_deploy_end,
             "deploy.abort": self.on_deploy_abort,
             "deploy.enqueue": self.on_enqueue,
+            "deploy.parallelism": self.on_parallelism,
+            "deploy.skip": self.on_skip,
+            "deploy.retry": self.on_retry,
+            "deploy.progress": self.on_progress,
+            "prefetch.begin": self.on_prefetch_begin,
+            "prefetch.end": self.on_prefetch_end,
+            "host.begin": self.on_host_begin,
             "host.end": self.on_host_end,
             "host.abort": self.on_host_abort,
+            "host.straggler": self.on_straggler,
         })
 
     def enable_verbose_logging(self):
@@ -145,9 +172,48 @@ class HeadlessFrontend(object):
         self.hosts[host]["status"] = "deploying"
         self.hosts[host]["deferred"] = deferred
 
-    def on_host_end(self, host, results):
+    def on_skip(self, hosts, reason):
+        self.skipped_count += len(hosts)
+        for host in hosts:
+            # hosts that have already been deployed to, like failed ones that
+            # won't be retried, stay done
+            if host in self.hosts and self.hosts[host]["status"] != "complete":
+                self.hosts[host]["status"] = "skipped"
+                self.hosts[host].pop("deferred", None)
+        if hosts:
+            print colorize("*** skipping %d hosts: %s" % (len(hosts), reason),
+                           Color.BOLD(Color.GREEN))
+
+    def on_retry(self, hosts, attempt, delay):
+        print colorize(
+            "*** retrying %d failed hosts in %d seconds (retry #%d)" % (
+                len(hosts), delay, attempt), Color.BOLD(Color.YELLOW))
+
+    def on_prefetch_begin(self, hosts):
+        print colorize("*** deploying to %d hosts ahead of the rollout" %
+                       len(hosts), Color.BOLD(Color.GREEN))
+
+    def on_prefetch_end(self, remaining, unchanged, failed):
+        print colorize(
+            "*** deploy done: %d hosts unchanged, %d failed, rolling out "
+            "to %d" % (unchanged, failed, remaining), Color.BOLD(Color.GREEN))
+
+    def on_parallelism(self, parallel, reason):
+        print colorize("*** now working on %d hosts at a time (%s)" % (
+            parallel, reason), Color.BLUE)
+
+    def on_host_begin(self, host):
+        # a retried host isn't a straggler until it's flagged again
         if host in self.hosts:
+            self.hosts[host].pop("straggler", None)
+
+    def _mark_complete(self, host):
+        if self.hosts[host]["status"] != "skipped":
             self.hosts[host]["status"] = "complete"
+
+    def on_host_end(self, host, results):
+        if host in self.hosts:
+            self._mark_complete(host)
             self.hosts[host]["result"] = "success"
             self.hosts[host]["output"] = results
             try:
@@ -158,7 +224,7 @@ class HeadlessFrontend(object):
 
     def on_host_abort(self, host, error, should_be_alive):
         if host in self.hosts:
-            self.hosts[host]["status"] = "complete"
+            self._mark_complete(host)
             self.hosts[host]["result"] = "aborted"
             self.hosts[host]["should_be_alive"] = should_be_alive
             try:
@@ -167,6 +233,19 @@ class HeadlessFrontend(object):
                 pass
             self._print_percent_complete()
 
+    def on_straggler(self, host, command, elapsed, median):
+        if host in self.hosts:
+            self.hosts[host]["straggler"] = True
+            print colorize(
+                "*** %s is straggling: %s has been running for %d seconds, "
+                "usually it takes %d" % (host.name, command, elapsed, median),
+                Color.BOLD(Color.YELLOW))
+
+    def on_progress(self, completed, total, hosts_per_minute, eta):
+        if hosts_per_minute and completed < total:
+            print colorize("*** %.1f hosts/min, about %s left" % (
+                hosts_per_minute, format_duration(eta)), Color.GREEN)
+
     def _print_percent_complete(self):
         percent_complete = calculate_percent_complete(self.hosts)
         print colorize("*** %d%% done" % percent_complete, Color.GREEN)
@@ -179,6 +258,8 @@ class HeadlessFrontend(object):
         print colorize("*** deploy complete!", Color.BOLD(Color.GREEN))
         elapsed = time.time() - self.start_time
         print "*** elapsed time: %d seconds" % elapsed
+        if self.skipped_count:
+            print "*** skipped hosts: %d" % self.skipped_count
 
         report = generate_component_report(self.hosts)
         if report:
@@ -322,6 +403,7 @@ class CanaryDeployStrategy(DeployStrategy):
         self.enqueued_pools = set()
 
     def is_complete(self, hosts):
+        hosts = deployable_hosts(hosts)
         all_pools = {host.pool for host in hosts.iterkeys()}
         pools_deployed_to = {host.pool for host, status in hosts.iteritems()
                              if status["status"] in ("complete", "deploying")}
@@ -362,6 +444,7 @@ def round_to_next_target(hosts, raw_target):
 
 @inlineCallbacks
 def get_next_regular_strategy(console_input, hosts):
+    hosts = deployable_hosts(hosts)
     options = [
         "something's wrong, [a]bort the deploy!",
     ]
@@ -419,6 +502,10 @@ class PercentDeployStrategy(DeployStrategy):
         self.target_percent = target_percent
 
     def is_complete(self, hosts):
+        hosts = deployable_hosts(hosts)
+        if not hosts:
+            return True
+
         completed = sum(1 for state in hosts.itervalues()
                         if state["status"] in ("complete", "deploying"))
         percent_done_or_in_flight = int((completed / len(hosts)) * 100)
@@ -453,6 +540,8 @@ class HeadfulFrontend(HeadlessFrontend):
         })
 
         self.config = config
+        self.straggler_policy = config["deploy"]["straggler-policy"]
+        self.straggler_flagged = None
 
         pools = set(host.pool for host in hosts)
         if len(pools) > 1:
@@ -460,8 +549,52 @@ class HeadfulFrontend(HeadlessFrontend):
         else:
             self.deploy_strategy = CanaryDeployStrategy(self.console_input)
 
-    def on_sleep(self, host, count):
-        print colorize("*** sleeping %d..." % count, Color.BOLD(Color.BLUE))
+    def on_sleep(self, host, until):
+        remaining = max(0, until - time.time())
+        print colorize("*** sleeping %d seconds before %s..." % (
+            math.ceil(remaining), host.name), Color.BOLD(Color.BLUE))
+
+    def on_straggler(self, host, command, elapsed, median):
+        super(HeadfulFrontend, self).on_straggler(
+            host, command, elapsed, median)
+
+        if self.straggler_flagged:
+            waiter, self.straggler_flagged = self.straggler_flagged, None
+            waiter.callback(None)
+
+    def _is_blocking(self, state):
+        if state["status"] != "deploying":
+            return False
+        return not (self.straggler_policy == "continue" and
+                    state.get("straggler"))
+
+    @inlineCallbacks
+    def wait_for_hosts_in_flight(self):
+        """Wait until the hosts in flight are done.
+
+        With the "continue" straggler policy, hosts that are flagged as
+        stragglers, even while waiting, are not waited on.
+
+        """
+        while True:
+            deferreds = [state["deferred"]
+                         for state in self.hosts.itervalues()
+                         if self._is_blocking(state)]
+            if not deferreds:
+                return
+
+            in_flight_done = DeferredList(deferreds, consumeErrors=True)
+            if self.straggler_policy != "continue":
+                yield in_flight_done
+                return
+
+            # wake up to look again whenever another host starts straggling
+            self.straggler_flagged = Deferred()
+            yield DeferredList([in_flight_done, self.straggler_flagged],
+                               fireOnOneCallback=True)
+            self.straggler_flagged = None
+            if in_flight_done.called:
+                return
 
     @inlineCallbacks
     def on_precheck(self):
@@ -505,9 +638,7 @@ class HeadfulFrontend(HeadlessFrontend):
             return
 
         if self.deploy_strategy.is_complete(self.hosts):
-            deferreds = [state["deferred"] for state in self.hosts.itervalues()
-                         if state["status"] == "deploying"]
-            yield DeferredList(deferreds, consumeErrors=True)
+            yield self.wait_for_hosts_in_flight()
 
             self.deploy_strategy = yield self.deploy_strategy.get_next_strategy(
                 self.hosts)
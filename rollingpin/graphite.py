@@ -14,25 +14,40 @@ class OneShotMessageWriter(Protocol):
         self.transport.loseConnection()
 
 
+# the least number of seconds between reports of a gauge
+GAUGE_INTERVAL = 60
+
+
 class GraphiteNotifier(object):
 
     def __init__(self, config, components):
         self.endpoint_config = config["graphite"]["endpoint"]
         self.components = components
+        self.last_timers_report = 0
+
+    def send(self, message):
+        protocol = OneShotMessageWriter(message)
+
+        endpoint = endpoints.clientFromString(reactor, self.endpoint_config)
+        endpoints.connectProtocol(endpoint, protocol)
 
     def on_deploy_start(self):
         now = int(time.time())
         events = ("events.deploy.%s %d %d\r\n" % (component, 1, now)
                   for component in self.components)
-        message = "".join(events)
-        protocol = OneShotMessageWriter(message)
+        self.send("".join(events))
 
-        endpoint = endpoints.clientFromString(reactor, self.endpoint_config)
-        endpoints.connectProtocol(endpoint, protocol)
+    def on_transport_timers(self, live):
+        now = int(time.time())
+        if now - self.last_timers_report < GAUGE_INTERVAL:
+            return
+        self.last_timers_report = now
+        self.send("rollingpin.transport.live_timers %d %d\r\n" % (live, now))
 
 
 def enable_graphite_notifications(config, event_bus, components):
     notifier = GraphiteNotifier(config, components)
     event_bus.register({
         "deploy.begin": notifier.on_deploy_start,
+        "transport.timers": notifier.on_transport_timers,
     })
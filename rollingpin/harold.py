@@ -88,6 +88,8 @@ class HaroldNotifier(object):
         self.total_hosts = len(hosts)
         self.completed_hosts = 0
         self.failed_hosts = []
+        self.hosts_per_minute = None
+        self.eta = None
 
         event_bus.register({
             "deploy.begin": self.on_deploy_begin,
@@ -95,6 +97,7 @@ class HaroldNotifier(object):
             "deploy.end": self.on_deploy_end,
             "host.end": self.on_host_end,
             "host.abort": self.on_host_abort,
+            "deploy.progress": self.on_progress,
         })
 
     @inlineCallbacks
@@ -127,20 +130,33 @@ class HaroldNotifier(object):
                 "failed_hosts": ",".join(host.name for host in self.failed_hosts),
             })
 
+    def on_progress(self, completed, total, hosts_per_minute, eta):
+        self.hosts_per_minute = hosts_per_minute
+        self.eta = eta
+
     @inlineCallbacks
     def on_host_end(self, host, results):
         self.completed_hosts += 1
+        if host in self.failed_hosts:
+            # the host succeeded when it was retried
+            self.failed_hosts.remove(host)
+
+        progress = {
+            "salon": self.salon,
+            "id": self.word,
+            "host": host,
+            "index": self.completed_hosts,
+        }
+        if self.eta is not None:
+            progress["hosts_per_minute"] = "%.1f" % self.hosts_per_minute
+            progress["eta"] = int(self.eta)
 
         with swallow_exceptions("harold", self.log):
-            yield self.harold.make_request("deploy/progress", {
-                "salon": self.salon,
-                "id": self.word,
-                "host": host,
-                "index": self.completed_hosts,
-            })
+            yield self.harold.make_request("deploy/progress", progress)
 
     def on_host_abort(self, host, error, should_be_alive):
-        if should_be_alive:
+        # retried hosts can fail more than once
+        if should_be_alive and host not in self.failed_hosts:
             self.failed_hosts.append(host)
 
 
@@ -0,0 +1,374 @@
+"""A local database of past deploys and how long each part of them took.
+
+Every deploy is recorded in an SQLite database in the log directory along with
+the tokens it deployed and, for every host, how long connecting, each command
+and the host as a whole took.
+
+"""
+import collections
+import getpass
+import logging
+import math
+import os
+import sqlite3
+import time
+
+
+HISTORY_FILENAME = "history.db"
+
+# how many of the most recent deploys to average host durations over
+DURATION_HISTORY = 10
+
+# how many of the most recent runs of a command to take percentiles over, and
+# how many there have to be for the percentile to mean anything
+COMMAND_HISTORY = 1000
+MIN_COMMAND_SAMPLES = 20
+
+# the shortest timeout adaptive timeouts will set, in seconds
+MIN_ADAPTIVE_TIMEOUT = 10
+
+# how much history to keep: the most recent deploys, and of those the most
+# recent runs of each host. runs of each command are kept up to
+# COMMAND_HISTORY.
+DEPLOY_RETENTION = 500
+HOST_RETENTION = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deploys (
+    id TEXT PRIMARY KEY,
+    profile TEXT,
+    user TEXT,
+    command_line TEXT,
+    started REAL,
+    build_duration REAL,
+    finished REAL,
+    result TEXT,
+    reason TEXT
+);
+
+CREATE INDEX IF NOT EXISTS deploys_started ON deploys (started);
+
+CREATE TABLE IF NOT EXISTS deploy_components (
+    deploy_id TEXT REFERENCES deploys (id),
+    component TEXT,
+    token TEXT
+);
+
+CREATE INDEX IF NOT EXISTS deploy_components_component
+    ON deploy_components (component);
+
+CREATE TABLE IF NOT EXISTS hosts (
+    deploy_id TEXT REFERENCES deploys (id),
+    host TEXT,
+    pool TEXT,
+    result TEXT,
+    should_be_alive INTEGER,
+    error TEXT,
+    started REAL,
+    connect_duration REAL,
+    total_duration REAL
+);
+
+CREATE INDEX IF NOT EXISTS hosts_host ON hosts (host, started);
+CREATE INDEX IF NOT EXISTS hosts_pool ON hosts (pool);
+
+CREATE TABLE IF NOT EXISTS commands (
+    deploy_id TEXT REFERENCES deploys (id),
+    host TEXT,
+    command TEXT,
+    duration REAL
+);
+
+CREATE INDEX IF NOT EXISTS commands_host ON commands (host);
+CREATE INDEX IF NOT EXISTS commands_command ON commands (command);
+"""
+
+
+class HostTimings(object):
+    """What one host has been up to so far in the current deploy."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.connect_duration = None
+        self.command_durations = []
+
+    def on_connected(self):
+        self.connect_duration = time.time() - self.started
+
+
+class DeployHistory(object):
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        # hosts are recorded as they finish, from the reactor thread. with a
+        # write-ahead log, commits don't wait on an fsync, only checkpoints do.
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def host_durations(self, history=DURATION_HISTORY):
+        """Find out how long hosts took to deploy to in recent deploys.
+
+        :returns: a mapping of host names to the average number of seconds they
+            took over the last `history` deploys they were successfully
+            deployed to
+
+        """
+        durations = {}
+        rows = self.db.execute("""
+            SELECT host, total_duration FROM hosts
+            WHERE result = 'success' ORDER BY host, started DESC
+        """)
+        for host, duration in rows:
+            recent = durations.setdefault(host, [])
+            if len(recent) < history:
+                recent.append(duration)
+        return {host: sum(recent) / len(recent)
+                for host, recent in durations.iteritems()}
+
+    def _rows_past(self, query, keep):
+        """Return the rowids past the first `keep` rows of each group.
+
+        :param str query: selects rowid and the group, newest rows of each
+            group first
+        """
+        seen = collections.Counter()
+        old = []
+        for rowid, group in self.db.execute(query):
+            seen[group] += 1
+            if seen[group] > keep:
+                old.append((rowid,))
+        return old
+
+    def prune(self, deploys=DEPLOY_RETENTION, runs_per_host=HOST_RETENTION,
+              runs_per_command=COMMAND_HISTORY):
+        """Drop everything but the most recent history."""
+        with self.db:
+            self.db.execute("""
+                DELETE FROM deploys WHERE id NOT IN (
+                    SELECT id FROM deploys ORDER BY started DESC LIMIT ?)
+            """, (deploys,))
+            for table in ("deploy_components", "hosts", "commands"):
+                self.db.execute(
+                    "DELETE FROM %s WHERE deploy_id NOT IN "
+                    "(SELECT id FROM deploys)" % table)
+
+            self.db.executemany(
+                "DELETE FROM hosts WHERE rowid = ?", self._rows_past(
+                    "SELECT rowid, host FROM hosts "
+                    "ORDER BY host, started DESC", runs_per_host))
+            self.db.executemany(
+                "DELETE FROM commands WHERE rowid = ?", self._rows_past(
+                    "SELECT rowid, command FROM commands "
+                    "ORDER BY command, rowid DESC", runs_per_command))
+
+    def average_host_duration(self, profile, history=DURATION_HISTORY):
+        """Return how long hosts took on average in recent deploys.
+
+        Only the last `history` deploys of the given profile are considered.
+        Returns None if there are none.
+
+        """
+        (duration,) = self.db.execute("""
+            SELECT AVG(hosts.total_duration) FROM hosts
+            WHERE hosts.result = 'success' AND hosts.deploy_id IN (
+                SELECT id FROM deploys WHERE profile = ?
+                ORDER BY started DESC LIMIT ?)
+        """, (profile, history)).fetchone()
+        return duration
+
+    def command_percentiles(self, percentile, history=COMMAND_HISTORY):
+        """Return a percentile of each command's duration in recent deploys.
+
+        Failed runs of a command aren't recorded, so these are percentiles of
+        how long the command takes when it works. Commands with fewer than
+        MIN_COMMAND_SAMPLES recorded runs are left out.
+
+        :param float percentile: which percentile, e.g. 99
+        :returns: a mapping of command names to durations in seconds
+
+        """
+        percentiles = {}
+        names = [name for (name,) in self.db.execute(
+            "SELECT DISTINCT command FROM commands")]
+        for name in names:
+            durations = [duration for (duration,) in self.db.execute("""
+                SELECT duration FROM commands WHERE command = ?
+                ORDER BY rowid DESC LIMIT ?
+            """, (name, history))]
+            if len(durations) < MIN_COMMAND_SAMPLES:
+                continue
+
+            durations.sort()
+            index = int(math.ceil(len(durations) * percentile / 100.)) - 1
+            percentiles[name] = durations[max(0, index)]
+        return percentiles
+
+
+def adaptive_command_timeouts(history, factor, maximum):
+    """Pick timeouts for commands from how long they usually take.
+
+    Each command's timeout is `factor` times its 99th percentile duration, but
+    no longer than `maximum` seconds, if set, and no shorter than
+    MIN_ADAPTIVE_TIMEOUT.
+
+    :returns: a mapping of command names to timeouts in seconds
+
+    """
+    timeouts = {}
+    for name, p99 in history.command_percentiles(99).iteritems():
+        timeout = max(MIN_ADAPTIVE_TIMEOUT, int(math.ceil(p99 * factor)))
+        if maximum:
+            timeout = min(timeout, maximum)
+        timeouts[name] = timeout
+    return timeouts
+
+
+class DeployRecorder(object):
+    """Record the progress of a deploy into the deploy history."""
+
+    def __init__(self, history, word, profile, hosts, command_line):
+        self.log = logging.getLogger(__name__)
+        self.history = history
+        self.db = history.db
+        self.word = word
+        self.profile = profile
+        self.hosts = set(hosts)
+        self.command_line = command_line
+
+        self.build_started = None
+        self.timings = {}
+        self.recording = False
+
+    def _write(self, query, args):
+        try:
+            with self.db:
+                self.db.execute(query, args)
+        except sqlite3.Error as e:
+            self.log.warning("could not record deploy history: %s", e)
+
+    def _prune(self):
+        """Drop old history now that this deploy has been recorded."""
+        if not self.recording:
+            return
+
+        try:
+            self.history.prune()
+        except sqlite3.Error as e:
+            self.log.warning("could not prune deploy history: %s", e)
+
+    def on_deploy_begin(self):
+        self.recording = True
+        self._write(
+            "INSERT INTO deploys (id, profile, user, command_line, started, "
+            "result) VALUES (?, ?, ?, ?, ?, 'running')",
+            (self.word, self.profile, getpass.getuser(), self.command_line,
+             time.time()))
+
+    def on_build_begin(self):
+        self.build_started = time.time()
+
+    def on_build_end(self):
+        if self.build_started:
+            self._write(
+                "UPDATE deploys SET build_duration = ? WHERE id = ?",
+                (time.time() - self.build_started, self.word))
+
+    def on_build_tokens(self, tokens):
+        rows = []
+        for ref in tokens:
+            component, at, token = ref.partition("@")
+            rows.append((self.word, component, token))
+
+        try:
+            with self.db:
+                self.db.executemany(
+                    "INSERT INTO deploy_components (deploy_id, component, "
+                    "token) VALUES (?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            self.log.warning("could not record deploy history: %s", e)
+
+    def on_host_begin(self, host):
+        if host in self.hosts:
+            self.timings[host] = HostTimings()
+
+    def on_host_connected(self, host):
+        timings = self.timings.get(host)
+        if timings:
+            timings.on_connected()
+
+    def on_host_command_end(self, host, command, duration):
+        timings = self.timings.get(host)
+        if timings:
+            timings.command_durations.append((command, duration))
+
+    def _finish_host(self, host, result, should_be_alive=None, error=None):
+        timings = self.timings.pop(host, None)
+        if not timings:
+            # skipped hosts never began and have nothing to record
+            return
+
+        try:
+            with self.db:
+                self.db.execute(
+                    "INSERT INTO hosts (deploy_id, host, pool, result, "
+                    "should_be_alive, error, started, connect_duration, "
+                    "total_duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self.word, host.name, host.pool, result, should_be_alive,
+                     error, timings.started, timings.connect_duration,
+                     time.time() - timings.started))
+                self.db.executemany(
+                    "INSERT INTO commands (deploy_id, host, command, "
+                    "duration) VALUES (?, ?, ?, ?)",
+                    [(self.word, host.name, command, duration)
+                     for command, duration in timings.command_durations])
+        except sqlite3.Error as e:
+            self.log.warning("could not record deploy history: %s", e)
+
+    def on_host_end(self, host, results):
+        self._finish_host(host, "success")
+
+    def on_host_abort(self, host, error, should_be_alive):
+        self._finish_host(host, "failed", should_be_alive, str(error))
+
+    def on_deploy_end(self):
+        self._write(
+            "UPDATE deploys SET finished = ?, result = 'complete' "
+            "WHERE id = ?", (time.time(), self.word))
+        self._prune()
+
+    def on_deploy_abort(self, reason):
+        self._write(
+            "UPDATE deploys SET finished = ?, result = 'aborted', reason = ? "
+            "WHERE id = ?", (time.time(), str(reason), self.word))
+        self._prune()
+
+
+def open_deploy_history(config):
+    """Return the deploy history or None if it couldn't be opened."""
+    path = os.path.join(config["deploy"]["log-directory"], HISTORY_FILENAME)
+    try:
+        return DeployHistory(path)
+    except sqlite3.Error as e:
+        logging.getLogger(__name__).warning(
+            "could not open deploy history %s: %s", path, e)
+        return None
+
+
+def enable_deploy_history(history, word, profile, event_bus, hosts,
+                          command_line):
+    recorder = DeployRecorder(history, word, profile, hosts, command_line)
+    event_bus.register({
+        "deploy.begin": recorder.on_deploy_begin,
+        "deploy.end": recorder.on_deploy_end,
+        "deploy.abort": recorder.on_deploy_abort,
+        "build.begin": recorder.on_build_begin,
+        "build.end": recorder.on_build_end,
+        "build.tokens": recorder.on_build_tokens,
+        "host.begin": recorder.on_host_begin,
+        "host.connected": recorder.on_host_connected,
+        "host.command_end": recorder.on_host_command_end,
+        "host.end": recorder.on_host_end,
+        "host.abort": recorder.on_host_abort,
+    })
+    return recorder
@@ -2,6 +2,9 @@ import fnmatch
 import collections
 
 
+HOST_ORDERS = ("id", "longest-first")
+
+
 ALIAS_SECTION = "aliases"
 
 
@@ -103,3 +106,28 @@ def select_canaries(hosts):
         canary_for_pool = sorted(hosts, key=lambda h: h.id)[0]
         canaries.append(canary_for_pool)
     return canaries
+
+
+def parse_host_order(value):
+    if value not in HOST_ORDERS:
+        raise ValueError("expected one of %s, got %r" % (
+            ", ".join(HOST_ORDERS), value))
+    return value
+
+
+def sort_by_duration(hosts, durations):
+    """Sort hosts by how long they took to deploy to, quickest first.
+
+    Hosts with no recorded duration are assumed to take the median of the
+    known durations. The sort is stable so hosts that took equally long stay
+    in the order they were given in.
+
+    :param dict durations: mapping of host names to seconds
+
+    """
+    known = sorted(durations[host.name] for host in hosts
+                   if host.name in durations)
+    if not known:
+        return list(hosts)
+    median = known[len(known) // 2]
+    return sorted(hosts, key=lambda host: durations.get(host.name, median))
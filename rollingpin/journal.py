@@ -0,0 +1,170 @@
+"""A durable record of deploy progress used to resume interrupted deploys.
+
+The journal is a file of JSON records, one per line, written next to the
+deploy's log file. It records the host order of the deploy, the deploy tokens
+once the build is done, and every host that finished or failed along with how
+long it took.
+
+"""
+import glob
+import json
+import logging
+import os
+import time
+
+from twisted.internet import reactor
+
+
+# how long to let records sit in the OS's buffers before forcing them to disk
+FSYNC_INTERVAL = 1
+
+
+class JournalError(Exception):
+    pass
+
+
+class DeployJournal(object):
+
+    def __init__(self, path, word, hosts, components):
+        self.log = logging.getLogger(__name__)
+        self.path = path
+        self.hosts = {host.name for host in hosts}
+        self.tokens = []
+        self.start_times = {}
+        self.pending_sync = None
+
+        self.file = open(path, "a")
+        self._write({
+            "event": "journal.begin",
+            "word": word,
+            "hosts": [host.name for host in hosts],
+            "components": components,
+        })
+
+    def _write(self, record):
+        record["time"] = time.time()
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+        if not self.pending_sync:
+            self.pending_sync = reactor.callLater(FSYNC_INTERVAL, self.sync)
+
+    def sync(self):
+        if self.pending_sync and self.pending_sync.active():
+            self.pending_sync.cancel()
+        self.pending_sync = None
+
+        try:
+            os.fsync(self.file.fileno())
+        except OSError as e:
+            self.log.warning("could not sync deploy journal: %s", e)
+
+    def on_build_tokens(self, tokens):
+        self.tokens = tokens
+        self._write({"event": "build.tokens", "tokens": tokens})
+
+    def on_host_begin(self, host):
+        self.start_times[host] = time.time()
+
+    def on_host_end(self, host, results):
+        start_time = self.start_times.pop(host, None)
+        if host.name in self.hosts:
+            record = {
+                "event": "host.end",
+                "host": host.name,
+                "tokens": self.tokens,
+            }
+            # hosts that were skipped never began
+            if start_time is not None:
+                record["duration"] = time.time() - start_time
+            self._write(record)
+
+    def on_host_abort(self, host, error, should_be_alive):
+        self.start_times.pop(host, None)
+        if host.name in self.hosts:
+            self._write({
+                "event": "host.abort",
+                "host": host.name,
+                "error": str(error),
+                "stderr_tail": list(error.stderr_tail),
+            })
+
+    def on_deploy_end(self):
+        self._write({"event": "deploy.end"})
+        self.sync()
+
+    def on_deploy_abort(self, reason):
+        self._write({"event": "deploy.abort", "reason": str(reason)})
+        self.sync()
+
+
+class ResumeState(object):
+    """What a previous deploy got done, as recorded in its journal."""
+
+    def __init__(self, word, host_names, completed):
+        """
+        :param str word: the name of the deploy being resumed
+        :param list host_names: the names of the hosts in deploy order
+        :param dict completed: mapping of names of hosts that finished to the
+            deploy tokens they finished with
+
+        """
+        self.word = word
+        self.host_names = host_names
+        self.completed = completed
+
+    def restore_host_order(self, hosts):
+        """Put hosts back in the order of the original deploy.
+
+        Hosts that weren't part of the original deploy go at the end.
+
+        """
+        position = {name: i for i, name in enumerate(self.host_names)}
+        return sorted(
+            hosts, key=lambda host: position.get(host.name, len(position)))
+
+
+def journal_path_for_log(log_path):
+    base, ext = os.path.splitext(log_path)
+    return base + ".journal"
+
+
+def load_journal(log_directory, word):
+    pattern = os.path.join(log_directory, "*-%s.journal" % word)
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise JournalError("no journal found for deploy %r" % word)
+
+    host_names = []
+    completed = {}
+    with open(paths[-1]) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line may be partial if we crashed mid-write
+                continue
+
+            event = record.get("event")
+            if event == "journal.begin":
+                host_names = record["hosts"]
+            elif event == "host.end":
+                completed[record["host"]] = record["tokens"]
+            elif event == "host.abort":
+                completed.pop(record["host"], None)
+
+    return ResumeState(word, host_names, completed)
+
+
+def enable_journal(log_path, word, event_bus, hosts, components):
+    journal = DeployJournal(
+        journal_path_for_log(log_path), word, hosts, components)
+    event_bus.register({
+        "build.tokens": journal.on_build_tokens,
+        "host.begin": journal.on_host_begin,
+        "host.end": journal.on_host_end,
+        "host.abort": journal.on_host_abort,
+        "deploy.end": journal.on_deploy_end,
+        "deploy.abort": journal.on_deploy_abort,
+    })
+    return journal
@@ -10,12 +10,12 @@ class LogFormatter(logging.Formatter):
     def format(self, record):
         formatted = logging.Formatter.format(self, record).decode("utf8")
 
+        prefix = self.formatTime(record) + "  "
         if hasattr(record, "host"):
-            formatted = ("[%10s]  " % record.host) + formatted
+            prefix += "[%10s]  " % record.host
 
-        formatted = self.formatTime(record) + "  " + formatted
-
-        return formatted
+        # prefix every line so multi-line messages stay attributable
+        return "\n".join(prefix + line for line in formatted.split("\n"))
 
 
 def log_to_file(config, word):
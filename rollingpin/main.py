@@ -14,27 +14,46 @@ from .args import (
     make_profile_parser,
     build_action_summary,
 )
+from .buildcache import load_build_cache
 from .config import (
     coerce_and_validate_config,
     ConfigurationError,
     Option,
     OptionalSection,
+    parse_bool,
 )
 from .deploy import Deployer, DeployError
+from .errorbudget import parse_error_budget
 from .eventbus import EventBus
 from .frontends import HeadlessFrontend, HeadfulFrontend
 from .harold import enable_harold_notifications
 from .hostlist import (
     HostlistError,
     parse_aliases,
+    parse_host_order,
     resolve_hostlist,
     select_canaries,
+    sort_by_duration,
 )
 from .hostsources import HostSourceError
+from .history import (
+    adaptive_command_timeouts,
+    enable_deploy_history,
+    open_deploy_history,
+)
+from .journal import enable_journal, load_journal, JournalError
 from .graphite import enable_graphite_notifications
 from .log import log_to_file
+from .progress import enable_progress_estimates
 from .providers import get_provider, UnknownProviderError
-from .utils import interleaved, b36encode
+from .scheduling import (
+    parse_command_dependencies,
+    parse_command_limits,
+    parse_command_timeouts,
+    parse_pool_limits,
+)
+from .stragglers import enable_straggler_detection, parse_straggler_policy
+from .utils import interleaved, b36encode, MAX_PARALLELISM
 from .wavefront import enable_wavefront_notifications
 
 
@@ -45,8 +64,37 @@ CONFIG_SPEC = {
         "wordlist": Option(str),
         "code-host": Option(str),
         "default-sleeptime": Option(int),
+        "default-rate": Option(float, default=0),
+        "default-burst": Option(int, default=1),
         "default-parallel": Option(int),
+        "default-min-parallel": Option(int, default=1),
+        "default-max-parallel": Option(int, default=0),
+        "default-ready-parallel": Option(int, default=0),
+        "default-prefetch-parallel": Option(int, default=0),
+        "command-parallel": Option(parse_command_limits, default={}),
+        "command-timeouts": Option(parse_command_timeouts, default={}),
+        "command-dependencies": Option(
+            parse_command_dependencies, default={}),
+        "batch-mode": Option(parse_bool, default=False),
+        "adaptive-timeout-factor": Option(float, default=0),
+        "preflight-parallel": Option(int, default=MAX_PARALLELISM),
+        "reachability-parallel": Option(int, default=200),
+        "reachability-timeout": Option(int, default=3),
+        "reachability-port": Option(int, default=22),
         "execution-timeout": Option(int, default=0),
+        "straggler-factor": Option(float, default=0),
+        "straggler-policy": Option(parse_straggler_policy, default="wait"),
+        "error-budget": Option(parse_error_budget, default=None),
+        "terminated-error-budget": Option(parse_error_budget, default=None),
+        "error-budget-window": Option(int, default=20),
+        "default-retries": Option(int, default=0),
+        "retry-backoff": Option(int, default=30),
+        "retry-parallel": Option(int, default=5),
+        "build-parallel": Option(int, default=0),
+        "build-cache-directory": Option(str, default=None),
+        "build-cache-ttl": Option(int, default=0),
+        "build-cache-size": Option(int, default=1000),
+        "default-order": Option(parse_host_order, default="id"),
         "default-hosts": Option(str, default=[]),
         "default-components": Option(str, default=[]),
         "default-restart": Option(str, default=[]),
@@ -119,6 +167,7 @@ def _load_configuration(profile_name, profile_directory=PROFILE_DIRECTORY):
         config = coerce_and_validate_config(config_parser, CONFIG_SPEC)
         config["hostsource"] = load_provider("hostsource", config_parser)
         config["transport"] = load_provider("transport", config_parser)
+        config["pool-limits"] = parse_pool_limits(config_parser)
     except ConfigurationError as e:
         print_error("configuration invalid")
         for error in e.errors:
@@ -139,7 +188,7 @@ def _parse_args(config, raw_args, initial_parser):
 
 
 @inlineCallbacks
-def _select_hosts(config, args):
+def _select_hosts(config, args, history):
     # get the list of hosts from the host source
     try:
         all_hosts = yield config["hostsource"].get_hosts()
@@ -160,6 +209,13 @@ def _select_hosts(config, args):
     # sort the list for repeatability across multiple deploys.
     sorted_hostlist = sorted(hostlist, key=lambda h: h.id, reverse=True)
 
+    if args.order == "longest-first" and history:
+        # the hosts are reversed below, so this puts the hosts that took the
+        # longest last time at the front of each pool. starting them early
+        # keeps them from stretching out the end of the deploy.
+        durations = history.host_durations()
+        sorted_hostlist = sort_by_duration(sorted_hostlist, durations)
+
     # interleave hosts by pool to spread pools out as evenly as possible
     rest_of_hosts = interleaved(sorted_hostlist, key=lambda h: h.pool)
 
@@ -193,7 +249,18 @@ def _main(reactor, *raw_args):
     if args.test:
         sys.exit(0)
 
-    hosts = yield _select_hosts(config, args)
+    history = open_deploy_history(config)
+    hosts = yield _select_hosts(config, args, history)
+
+    resume_state = None
+    if args.resume:
+        try:
+            resume_state = load_journal(
+                config["deploy"]["log-directory"], args.resume)
+        except JournalError as e:
+            print_error("{}", e)
+            sys.exit(1)
+        hosts = resume_state.restore_host_order(hosts)
 
     # set up event listeners
     event_bus = EventBus()
@@ -201,6 +268,19 @@ def _main(reactor, *raw_args):
     word = b36encode(simpleflake.simpleflake())
     log_path = log_to_file(config, word)
 
+    if not args.list_hosts:
+        enable_journal(log_path, word, event_bus, hosts, args.components)
+
+        if history:
+            enable_deploy_history(
+                history, word, profile, event_bus, hosts, args.original)
+
+    if history:
+        seed_duration = history.average_host_duration(profile)
+    else:
+        seed_duration = None
+    enable_progress_estimates(event_bus, hosts, seed_duration)
+
     if args.notify_harold:
         enable_harold_notifications(
             word, config, event_bus, hosts,
@@ -217,6 +297,10 @@ def _main(reactor, *raw_args):
         enable_wavefront_notifications(
             config, event_bus, args.components, hosts, args.original, word, profile)
 
+    if config["deploy"]["straggler-factor"]:
+        enable_straggler_detection(
+            event_bus, config["deploy"]["straggler-factor"])
+
     if not args.dangerously_fast and os.isatty(sys.stdout.fileno()):
         HeadfulFrontend(event_bus, hosts, args.verbose_logging, config)
     else:
@@ -227,6 +311,19 @@ def _main(reactor, *raw_args):
         for host in hosts:
             print host.name, host.address
     else:
+        if args.use_build_cache:
+            build_cache = load_build_cache(config)
+        else:
+            build_cache = None
+
+        command_timeouts = {}
+        adaptive_timeout_factor = config["deploy"]["adaptive-timeout-factor"]
+        if adaptive_timeout_factor and history:
+            command_timeouts.update(adaptive_command_timeouts(
+                history, adaptive_timeout_factor, args.timeout))
+        # timeouts set explicitly in the config win over adaptive ones
+        command_timeouts.update(config["deploy"]["command-timeouts"])
+
         deployer = Deployer(
             config,
             event_bus,
@@ -234,6 +331,33 @@ def _main(reactor, *raw_args):
             args.sleeptime,
             args.timeout,
             args.dangerously_fast,
+            build_parallel=config["deploy"]["build-parallel"],
+            build_cache=build_cache,
+            min_parallel=args.min_parallel,
+            max_parallel=args.max_parallel,
+            rate=args.rate,
+            burst=args.burst,
+            pool_limits=config["pool-limits"],
+            ready_parallel=args.ready_parallel,
+            command_parallel=config["deploy"]["command-parallel"],
+            prefetch_parallel=args.prefetch_parallel,
+            skip_up_to_date=args.skip_up_to_date,
+            preflight_parallel=config["deploy"]["preflight-parallel"],
+            completed_hosts=resume_state.completed if resume_state else None,
+            retries=args.retries,
+            retry_backoff=config["deploy"]["retry-backoff"],
+            retry_parallel=config["deploy"]["retry-parallel"],
+            error_budget=config["deploy"]["error-budget"],
+            terminated_error_budget=config["deploy"]["terminated-error-budget"],
+            error_budget_window=config["deploy"]["error-budget-window"],
+            command_timeouts=command_timeouts,
+            reachability_parallel=(
+                config["deploy"]["reachability-parallel"]
+                if args.check_reachable else 0),
+            reachability_timeout=config["deploy"]["reachability-timeout"],
+            reachability_port=config["deploy"]["reachability-port"],
+            command_dependencies=config["deploy"]["command-dependencies"],
+            batch_mode=config["deploy"]["batch-mode"],
         )
 
         try:
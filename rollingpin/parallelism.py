@@ -0,0 +1,141 @@
+"""Adaptive control of how many hosts are deployed to at once.
+
+The controller follows the additive-increase/multiplicative-decrease scheme
+used for TCP congestion control: each full window of healthy host
+completions allows one more host in flight, while a failure or a latency
+spike halves the limit. The limit only grows while every slot is in use, so
+it doesn't creep up when something else is holding the deploy back.
+
+"""
+import logging
+import time
+
+
+# how much slower than the running average a host has to be for its
+# duration to count as a latency spike
+LATENCY_SPIKE_FACTOR = 2.0
+
+# the weight of each new duration in the running average
+LATENCY_SMOOTHING = 0.2
+
+# how many durations to average before looking for spikes
+MIN_LATENCY_SAMPLES = 5
+
+DECREASE_FACTOR = 0.5
+
+
+class AdaptiveParallelism(object):
+
+    def __init__(self, limiter, event_bus, hosts, minimum, maximum):
+        """
+        :param ResizableSemaphore limiter: the semaphore to resize
+        :param EventBus event_bus:
+        :param list hosts: the hosts being deployed to
+        :param int minimum: the lowest parallelism to back off to
+        :param int maximum: the highest parallelism to grow to
+
+        """
+        self.log = logging.getLogger(__name__)
+        self.limiter = limiter
+        self.event_bus = event_bus
+        self.hosts = set(hosts)
+        self.minimum = minimum
+        self.maximum = maximum
+
+        self.start_times = {}
+        self.average_duration = None
+        self.samples = 0
+
+        # healthy completions count for 1/limit each, the limit grows once
+        # this adds up to a whole host
+        self.growth = 0.0
+
+        # the time of the last backoff. hosts that started before then were
+        # already in flight when we reacted, so they don't get to cause
+        # another backoff.
+        self.last_decrease = 0
+
+    @property
+    def parallel(self):
+        return self.limiter.limit
+
+    def _resize(self, parallel, reason):
+        parallel = max(self.minimum, min(self.maximum, parallel))
+        if parallel == self.limiter.limit:
+            return None
+
+        self.log.info("parallelism %d -> %d: %s",
+                      self.limiter.limit, parallel, reason)
+        self.limiter.resize(parallel)
+        return self.event_bus.trigger(
+            "deploy.parallelism", parallel=parallel, reason=reason)
+
+    def _increase(self, reason):
+        if self.limiter.in_use < self.limiter.limit:
+            return None
+
+        self.growth += 1.0 / self.parallel
+        if self.growth < 1:
+            return None
+
+        self.growth = 0.0
+        return self._resize(self.parallel + 1, reason)
+
+    def _decrease(self, reason):
+        self.last_decrease = time.time()
+        self.growth = 0.0
+        return self._resize(int(self.parallel * DECREASE_FACTOR), reason)
+
+    def on_host_begin(self, host):
+        if host in self.hosts:
+            self.start_times[host] = time.time()
+
+    def on_host_end(self, host, results):
+        start_time = self.start_times.pop(host, None)
+        if start_time is None:
+            return None
+
+        duration = time.time() - start_time
+        is_spike = (self.samples >= MIN_LATENCY_SAMPLES and
+                    duration > self.average_duration * LATENCY_SPIKE_FACTOR)
+
+        if self.average_duration is None:
+            self.average_duration = duration
+        else:
+            self.average_duration += (
+                (duration - self.average_duration) * LATENCY_SMOOTHING)
+        self.samples += 1
+
+        if is_spike:
+            if start_time >= self.last_decrease:
+                return self._decrease(
+                    "%s took %.1fs, more than %.1fx the average of %.1fs" % (
+                        host.name, duration, LATENCY_SPIKE_FACTOR,
+                        self.average_duration))
+            return None
+
+        return self._increase("%s completed in %.1fs" % (host.name, duration))
+
+    def on_host_abort(self, host, error, should_be_alive):
+        start_time = self.start_times.pop(host, None)
+        if start_time is None:
+            return None
+
+        # terminated hosts fail for reasons unrelated to the deploy
+        if not should_be_alive:
+            return None
+
+        if start_time >= self.last_decrease:
+            return self._decrease("%s failed: %s" % (host.name, error))
+        return None
+
+
+def enable_adaptive_parallelism(limiter, event_bus, hosts, minimum, maximum):
+    controller = AdaptiveParallelism(
+        limiter, event_bus, hosts, minimum, maximum)
+    event_bus.register({
+        "host.begin": controller.on_host_begin,
+        "host.end": controller.on_host_end,
+        "host.abort": controller.on_host_abort,
+    })
+    return controller
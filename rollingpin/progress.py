@@ -0,0 +1,110 @@
+"""Estimate how fast a rollout is going and when it will be done."""
+import time
+
+
+# the weight of each new sample in the running averages
+SMOOTHING = 0.2
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return "%ds" % seconds
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return "%dm%02ds" % (minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return "%dh%02dm" % (hours, minutes)
+
+
+class ProgressEstimator(object):
+    """Keep running estimates of the rollout's throughput and ETA.
+
+    Throughput is the number of hosts worked on at once divided by how long a
+    host takes, both averaged over recently completed hosts. Until the first
+    host completes, the duration can be seeded from previous deploys.
+
+    """
+
+    def __init__(self, event_bus, hosts, seed_duration=None):
+        """
+        :param EventBus event_bus:
+        :param list hosts: the hosts being rolled out to
+        :param float seed_duration: how long hosts took in previous deploys,
+            None if unknown
+
+        """
+        self.event_bus = event_bus
+        self.hosts = set(hosts)
+        # retried hosts finish more than once but only count once
+        self.finished = set()
+
+        self.start_times = {}
+        self.average_duration = seed_duration
+        self.average_concurrency = None
+
+    def _update(self, average, sample):
+        if average is None:
+            return float(sample)
+        return average + (sample - average) * SMOOTHING
+
+    @property
+    def hosts_per_minute(self):
+        # before any host has completed, go by how many are in flight now
+        concurrency = self.average_concurrency or len(self.start_times)
+        if not (self.average_duration and concurrency):
+            return None
+        return concurrency * 60. / self.average_duration
+
+    @property
+    def eta(self):
+        """Seconds until the rollout is done, None if there's no estimate."""
+        hosts_per_minute = self.hosts_per_minute
+        if not hosts_per_minute:
+            return None
+        remaining = len(self.hosts) - len(self.finished)
+        return remaining / hosts_per_minute * 60
+
+    def on_host_begin(self, host):
+        if host in self.hosts:
+            self.start_times[host] = time.time()
+
+    def _on_host_done(self, host, succeeded):
+        if host not in self.hosts:
+            return None
+
+        # the host itself was in flight too
+        concurrency = len(self.start_times)
+        start_time = self.start_times.pop(host, None)
+        self.finished.add(host)
+
+        if start_time is not None:
+            self.average_concurrency = self._update(
+                self.average_concurrency, concurrency)
+            if succeeded:
+                self.average_duration = self._update(
+                    self.average_duration, time.time() - start_time)
+
+        return self.event_bus.trigger(
+            "deploy.progress",
+            completed=len(self.finished),
+            total=len(self.hosts),
+            hosts_per_minute=self.hosts_per_minute,
+            eta=self.eta,
+        )
+
+    def on_host_end(self, host, results):
+        return self._on_host_done(host, succeeded=True)
+
+    def on_host_abort(self, host, error, should_be_alive):
+        return self._on_host_done(host, succeeded=False)
+
+
+def enable_progress_estimates(event_bus, hosts, seed_duration=None):
+    estimator = ProgressEstimator(event_bus, hosts, seed_duration)
+    event_bus.register({
+        "host.begin": estimator.on_host_begin,
+        "host.end": estimator.on_host_end,
+        "host.abort": estimator.on_host_abort,
+    })
+    return estimator
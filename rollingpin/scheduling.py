@@ -0,0 +1,309 @@
+"""Decide when and which host in a rollout may be started next."""
+import collections
+import fnmatch
+import math
+import time
+
+from twisted.internet.defer import (
+    Deferred,
+    inlineCallbacks,
+    succeed,
+)
+
+from .config import CoercionError, ConfigurationError
+
+
+POOL_LIMITS_SECTION = "pool-limits"
+
+
+class HostPacer(object):
+    """Pace hosts to a steady rate while allowing short bursts.
+
+    This is a token bucket: it holds up to `burst` hosts' worth of allowance
+    and refills at `rate` hosts per second. Starting a host spends one.
+
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param float rate: hosts per second
+        :param int burst: how many hosts may be started back to back
+
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+
+        self.rate = rate
+        self.burst = burst
+        self.allowance = float(burst)
+        self.last_update = time.time()
+
+    @classmethod
+    def from_hosts_per_minute(cls, hosts_per_minute, burst=1):
+        return cls(hosts_per_minute / 60., burst)
+
+    @classmethod
+    def from_sleeptime(cls, sleeptime):
+        return cls(1. / sleeptime, burst=1)
+
+    def reserve(self):
+        """Claim the next start and return how long to wait before it.
+
+        :returns: the number of seconds until the host may be started, 0 if
+            it may be started immediately.
+
+        """
+        now = time.time()
+        refill = (now - self.last_update) * self.rate
+        self.allowance = min(self.burst, self.allowance + refill)
+        self.last_update = now
+
+        self.allowance -= 1
+        if self.allowance >= 0:
+            return 0
+        return -self.allowance / self.rate
+
+
+class Slot(object):
+    """A token held from a concurrency limiter on behalf of one host.
+
+    The slot can be moved to another limiter part way through the host, e.g.
+    to stop counting against the rollout's parallelism while the host is
+    only waiting on something.
+
+    """
+
+    def __init__(self, limiter):
+        self.home = limiter
+        self.limiter = limiter
+        self.held = False
+
+    @inlineCallbacks
+    def acquire(self):
+        assert not self.held
+        yield self.limiter.acquire()
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.limiter.release()
+
+    @inlineCallbacks
+    def move_to(self, limiter):
+        """Release the current token and wait for one from `limiter`."""
+        if limiter is self.limiter:
+            return
+        self.release()
+        self.limiter = limiter
+        yield self.acquire()
+
+
+def _parse_command_values(value, what):
+    values = {}
+    for item in value.split():
+        name, sep, count = item.partition(":")
+        if not (name and sep):
+            raise ValueError("expected COMMAND:%s, got %r" % (
+                what.upper(), item))
+
+        count = int(count)
+        if count < 1:
+            raise ValueError("%s for %r must be at least 1" % (what, name))
+        values[name] = count
+    return values
+
+
+def parse_command_limits(value):
+    """Parse per-command parallelism limits like "deploy:200 restart:20".
+
+    This is used as a config coercer and raises ValueError on bad input.
+
+    """
+    return _parse_command_values(value, "limit")
+
+
+def parse_command_timeouts(value):
+    """Parse per-command timeouts in seconds like "deploy:300 restart:60".
+
+    This is used as a config coercer and raises ValueError on bad input.
+
+    """
+    return _parse_command_values(value, "timeout")
+
+
+def parse_command_dependencies(value):
+    """Parse which commands others depend on like "restart:deploy check:".
+
+    Each item names a command and, after the colon, the comma separated
+    commands it has to wait for. Commands that aren't listed wait for every
+    command before them. This is used as a config coercer and raises
+    ValueError on bad input.
+
+    """
+    dependencies = {}
+    for item in value.split():
+        name, sep, needs = item.partition(":")
+        if not (name and sep):
+            raise ValueError("expected COMMAND:DEPENDENCIES, got %r" % item)
+        dependencies[name] = frozenset(need for need in needs.split(",")
+                                       if need)
+    return dependencies
+
+
+def batch_commands(commands, dependencies):
+    """Group a host's commands into batches that may run at the same time.
+
+    Commands stay in order. A command joins the batch before it unless it
+    depends on something in that batch, and commands without an entry in
+    `dependencies` depend on every command before them, so without any
+    dependencies every command is in a batch of its own.
+
+    :param list commands: the commands to run on the host
+    :param dict dependencies: mapping of command names to the names of the
+        commands they depend on
+    :returns: a list of lists of commands
+
+    """
+    batches = []
+    for command in commands:
+        needs = dependencies.get(command.name)
+        if (batches and needs is not None and
+                not any(other.name in needs for other in batches[-1])):
+            batches[-1].append(command)
+        else:
+            batches.append([command])
+    return batches
+
+
+class PoolLimit(object):
+    """The most hosts of a pool that may be in flight at once."""
+
+    def __init__(self, count=None, percent=None):
+        assert (count is None) != (percent is None)
+        self.count = count
+        self.percent = percent
+
+    @classmethod
+    def parse(cls, value):
+        """Parse either a number of hosts or a percentage like "25%"."""
+        value = value.strip()
+        if value.endswith("%"):
+            percent = float(value[:-1])
+            if not 0 < percent <= 100:
+                raise ValueError("percentage must be between 0 and 100")
+            return cls(percent=percent)
+
+        count = int(value)
+        if count < 1:
+            raise ValueError("limit must be at least 1")
+        return cls(count=count)
+
+    def for_pool_size(self, size):
+        if self.count is not None:
+            return self.count
+        return max(1, int(math.floor(size * self.percent / 100)))
+
+
+def parse_pool_limits(config_parser):
+    """Read per-pool limits from the profile's [pool-limits] section.
+
+    Each key is a glob matched against pool names, in file order. Since
+    ConfigParser lowercases keys, the globs match case-insensitively.
+
+    """
+    if not config_parser.has_section(POOL_LIMITS_SECTION):
+        return []
+
+    defaults = config_parser.defaults()
+    pool_limits = []
+    errors = []
+    for glob, value in config_parser.items(POOL_LIMITS_SECTION):
+        # items() mixes in the [DEFAULT] section, which names no pools
+        if glob in defaults:
+            continue
+
+        try:
+            pool_limits.append((glob, PoolLimit.parse(value)))
+        except ValueError as e:
+            errors.append(CoercionError(POOL_LIMITS_SECTION, glob, e))
+
+    if errors:
+        raise ConfigurationError(errors)
+    return pool_limits
+
+
+def _find_pool_limit(pool_limits, pool):
+    for glob, limit in pool_limits:
+        if fnmatch.fnmatchcase(pool.lower(), glob.lower()):
+            return limit
+    return None
+
+
+class PoolScheduler(object):
+    """Hand out hosts in order, skipping those whose pool is at its limit.
+
+    Hosts count against their pool's limit from the time they're handed out
+    until :meth:`host_done` is called for them.
+
+    """
+
+    def __init__(self, hosts, pool_limits):
+        """
+        :param list hosts: the hosts to deploy to, in preferred order
+        :param list pool_limits: (glob, PoolLimit) pairs. limits given as a
+            percentage are relative to the number of the pool's hosts in
+            `hosts`.
+
+        """
+        self.pending = list(hosts)
+        self.in_flight = collections.Counter()
+        self.waiter = None
+
+        pool_sizes = collections.Counter(host.pool for host in hosts)
+        self.limits = {}
+        for pool, size in pool_sizes.iteritems():
+            limit = _find_pool_limit(pool_limits, pool)
+            if limit:
+                self.limits[pool] = limit.for_pool_size(size)
+
+    def _is_eligible(self, host):
+        limit = self.limits.get(host.pool)
+        return limit is None or self.in_flight[host.pool] < limit
+
+    def _pop_eligible(self):
+        for i, host in enumerate(self.pending):
+            if self._is_eligible(host):
+                del self.pending[i]
+                self.in_flight[host.pool] += 1
+                return host
+        return None
+
+    def next_host(self):
+        """Return a deferred that fires with the next host to start.
+
+        The deferred fires with None once all hosts have been handed out.
+
+        """
+        assert not self.waiter, "only one caller may wait for a host"
+
+        if not self.pending:
+            return succeed(None)
+
+        host = self._pop_eligible()
+        if host:
+            return succeed(host)
+
+        self.waiter = Deferred()
+        return self.waiter
+
+    def host_done(self, host):
+        self.in_flight[host.pool] -= 1
+
+        if self.waiter:
+            host = self._pop_eligible()
+            if host:
+                waiter, self.waiter = self.waiter, None
+                waiter.callback(host)
@@ -0,0 +1,227 @@
+"""Spot hosts that take much longer than their peers during a rollout.
+
+The duration of every command is fed into a running estimate of that
+command's median duration. Hosts that have been running a command for more
+than a configurable multiple of its median are reported as stragglers.
+
+"""
+import bisect
+import logging
+import time
+
+from twisted.internet.task import LoopingCall
+
+
+# how often to look for stragglers, in seconds
+CHECK_INTERVAL = 1
+
+# how many times a command has to have completed before its median is
+# trusted enough to call anything a straggler
+MIN_SAMPLES = 5
+
+# how far behind the median, in seconds, a host has to be as well, so that
+# quick commands don't turn every hiccup into a straggler
+MIN_STRAGGLER_DELAY = 10
+
+STRAGGLER_POLICIES = ("wait", "continue")
+
+
+def parse_straggler_policy(value):
+    """Check a straggler policy from the config file.
+
+    "wait" keeps waiting on stragglers before moving on to the next stage of
+    the deploy strategy. "continue" moves on without them.
+
+    """
+    if value not in STRAGGLER_POLICIES:
+        raise ValueError("expected one of %s, got %r" % (
+            ", ".join(STRAGGLER_POLICIES), value))
+    return value
+
+
+class P2Quantile(object):
+    """Estimate a quantile of a stream of numbers in constant memory.
+
+    This is the P-square algorithm from Jain and Chlamtac's "The P2 Algorithm
+    for Dynamic Calculation of Quantiles and Histograms Without Storing
+    Observations". It keeps five markers whose heights approximate the
+    minimum, the quantile, the maximum and the points halfway in between.
+
+    """
+
+    def __init__(self, quantile=0.5):
+        self.quantile = quantile
+        self.count = 0
+        self.heights = []
+        self.positions = [1., 2., 3., 4., 5.]
+        self.desired_positions = [
+            1., 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5.]
+        self.increments = [0., quantile / 2, quantile, (1 + quantile) / 2, 1.]
+
+    def add(self, value):
+        self.count += 1
+        if self.count <= 5:
+            bisect.insort(self.heights, value)
+            return
+
+        heights = self.heights
+        positions = self.positions
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = bisect.bisect_right(heights, value) - 1
+
+        for i in xrange(cell + 1, 5):
+            positions[i] += 1
+        for i in xrange(5):
+            self.desired_positions[i] += self.increments[i]
+
+        for i in xrange(1, 4):
+            offset = self.desired_positions[i] - positions[i]
+            if ((offset >= 1 and positions[i + 1] - positions[i] > 1) or
+                    (offset <= -1 and positions[i - 1] - positions[i] < -1)):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, step)
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        q = self.heights
+        n = self.positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def _linear(self, i, step):
+        q = self.heights
+        n = self.positions
+        return q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+
+    def value(self):
+        """Return the current estimate, or None if nothing was added yet."""
+        if not self.count:
+            return None
+        if self.count <= 5:
+            index = int(round((len(self.heights) - 1) * self.quantile))
+            return self.heights[index]
+        return self.heights[2]
+
+
+class _RunningCommand(object):
+
+    def __init__(self, command):
+        self.command = command
+        self.start_time = time.time()
+        self.flagged = False
+
+
+class StragglerDetector(object):
+
+    def __init__(self, event_bus, factor, min_samples=MIN_SAMPLES):
+        """
+        :param EventBus event_bus:
+        :param float factor: how many times the median duration of a command
+            a host may take before it is a straggler
+        :param int min_samples: how many durations of a command to collect
+            before judging hosts running it
+
+        """
+        self.log = logging.getLogger(__name__)
+        self.event_bus = event_bus
+        self.factor = factor
+        self.min_samples = min_samples
+
+        self.medians = {}
+        # only hosts being rolled out to are judged, not ones that are merely
+        # queried before the rollout, e.g. by --skip-up-to-date
+        self.in_flight = set()
+        # hosts may run several commands at once
+        self.running = {}
+        self.checker = LoopingCall(self.check)
+
+    def on_deploy_begin(self):
+        self.checker.start(CHECK_INTERVAL, now=False)
+
+    def on_deploy_end(self):
+        if self.checker.running:
+            self.checker.stop()
+
+    def on_deploy_abort(self, reason):
+        self.on_deploy_end()
+
+    def on_host_begin(self, host):
+        self.in_flight.add(host)
+
+    def on_host_command(self, host, command):
+        if host in self.in_flight:
+            self.running.setdefault(host, []).append(_RunningCommand(command))
+
+    def on_host_command_end(self, host, command, duration):
+        running = self.running.get(host, [])
+        for running_command in running:
+            if running_command.command == command:
+                running.remove(running_command)
+                break
+        else:
+            return
+
+        median = self.medians.setdefault(command, P2Quantile())
+        median.add(duration)
+
+    def _on_host_done(self, host):
+        # failed commands never end, and how long they took says nothing
+        # about healthy hosts anyway
+        self.in_flight.discard(host)
+        self.running.pop(host, None)
+
+    def on_host_end(self, host, results):
+        self._on_host_done(host)
+
+    def on_host_abort(self, host, error, should_be_alive):
+        self._on_host_done(host)
+
+    def check(self):
+        now = time.time()
+        for host, running in self.running.items():
+            for running_command in running:
+                if running_command.flagged:
+                    continue
+
+                command = running_command.command
+                median = self.medians.get(command)
+                if not median or median.count < self.min_samples:
+                    continue
+
+                elapsed = now - running_command.start_time
+                median_duration = median.value()
+                if (elapsed > median_duration * self.factor and
+                        elapsed - median_duration > MIN_STRAGGLER_DELAY):
+                    running_command.flagged = True
+                    self.log.warning(
+                        "%s has been running %s for %.1fs, the median is "
+                        "%.1fs", host.name, command, elapsed, median_duration)
+                    self.event_bus.trigger(
+                        "host.straggler", host=host, command=command,
+                        elapsed=elapsed, median=median_duration)
+
+
+def enable_straggler_detection(event_bus, factor):
+    detector = StragglerDetector(event_bus, factor)
+    event_bus.register({
+        "deploy.begin": detector.on_deploy_begin,
+        "deploy.end": detector.on_deploy_end,
+        "deploy.abort": detector.on_deploy_abort,
+        "host.begin": detector.on_host_begin,
+        "host.command": detector.on_host_command,
+        "host.command_end": detector.on_host_command_end,
+        "host.end": detector.on_host_end,
+        "host.abort": detector.on_host_abort,
+    })
+    return detector
@@ -1,5 +1,6 @@
 class TransportError(Exception):
-    pass
+    # the last lines the remote command wrote to stderr, if it got that far
+    stderr_tail = ()
 
 
 class ConnectionError(TransportError):
@@ -23,6 +24,11 @@ class Transport(object):
     def connect_to(self, host):
         raise NotImplementedError
 
+    @property
+    def live_timers(self):
+        """How many execution timeouts are scheduled on the reactor."""
+        return 0
+
 
 class CommandFailed(TransportError):
     pass
@@ -32,5 +38,27 @@ class TransportConnection(object):
     def execute(self, log, command):
         raise NotImplementedError
 
+    def execute_batch(self, log, commands, on_event, timeout=0):
+        """Run a list of commands with a single remote invocation.
+
+        :param list commands: the commands as described by Command.to_batch
+        :param on_event: called with each event the host reports as it
+            arrives. events are dicts with the "event", either "begin" or
+            "end", the "index" of the command in `commands` and, for "end"
+            events, the command's "result".
+        :returns: a Deferred that fires once all commands have run
+
+        """
+        raise NotImplementedError
+
+    def check_alive(self, timeout):
+        """Check that the host still answers on this connection.
+
+        :returns: a Deferred that fires with True if the host answered within
+            `timeout` seconds and False otherwise
+
+        """
+        raise NotImplementedError
+
     def disconnect(self):
         raise NotImplementedError
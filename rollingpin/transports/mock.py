@@ -2,6 +2,7 @@ import random
 
 from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 
+from ..commands import DeployCommand
 from ..transports import (
     Transport,
     TransportConnection,
@@ -49,6 +50,22 @@ class MockTransportConnection(TransportConnection):
         result = yield f(log, command, args)
         returnValue(result)
 
+    @inlineCallbacks
+    def execute_batch(self, log, commands, on_event, timeout=0):
+        skipping = False
+        for index, command in enumerate(commands):
+            if skipping and not command["explicit"]:
+                continue
+
+            on_event({"event": "begin", "index": index})
+            result = yield self.execute(
+                log, [command["name"]] + command["args"], timeout)
+            on_event({"event": "end", "index": index, "result": result})
+
+            if command["skip_remaining_unless_changed"] and result:
+                skipping = not any(value == DeployCommand.REPO_CHANGED
+                                   for value in result.itervalues())
+
     def _synchronize(self, log, command, args):
         log.debug("MOCK: git fetch")
         return succeed({
@@ -95,6 +112,9 @@ class MockTransportConnection(TransportConnection):
         }
         return succeed(result)
 
+    def check_alive(self, timeout):
+        return succeed(True)
+
     def disconnect(self):
         return succeed(None)
 
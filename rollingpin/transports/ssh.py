@@ -1,8 +1,10 @@
-import cStringIO as StringIO
+import collections
 import getpass
 import json
 import pipes
+import socket
 import struct
+import tempfile
 
 from twisted.conch.ssh.channel import SSHChannel
 from twisted.conch.ssh.common import NS
@@ -13,12 +15,15 @@ from twisted.conch.ssh.userauth import SSHUserAuthClient
 from twisted.internet import reactor
 from twisted.internet.defer import (
     Deferred,
+    DeferredSemaphore,
     inlineCallbacks,
     returnValue,
     succeed,
 )
 from twisted.internet.error import ConnectError, DNSLookupError
 from twisted.internet.protocol import ClientFactory
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 
 from ..config import Option
 from ..transports import (
@@ -38,9 +43,21 @@ CONFIG_SPEC = {
         "port": Option(int, default=22),
         "timeout": Option(int, default=10),
         "command": Option(str),
+        "keepalive-interval": Option(int, default=0),
+        "keepalive-count": Option(int, default=3),
+        "max-output-size": Option(int, default=1024 * 1024),
+        "stderr-tail-lines": Option(int, default=20),
+        "max-sessions": Option(int, default=10),
     },
 }
 
+# lines longer than this are split up rather than buffered indefinitely
+MAX_LINE_LENGTH = 8192
+
+# the keepalive request OpenSSH uses. servers that don't know it still have to
+# reply, which is all we want to know.
+KEEPALIVE_REQUEST = "keepalive@openssh.com"
+
 
 class _ConnectionService(SSHConnection):
     def serviceStarted(self):
@@ -124,11 +141,62 @@ def _load_key(filename):
         raise BadKeyPassphraseError()
 
 
+def _enable_tcp_keepalive(tcp_transport, interval, count):
+    """Have the kernel probe an idle connection and drop it if it's dead."""
+    tcp_transport.setTcpKeepAlive(True)
+
+    # these are linux specific, elsewhere we get the system defaults
+    sock = tcp_transport.getHandle()
+    for option, value in (("TCP_KEEPIDLE", interval),
+                          ("TCP_KEEPINTVL", interval),
+                          ("TCP_KEEPCNT", count)):
+        if hasattr(socket, option):
+            sock.setsockopt(
+                socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+class TimeoutManager(object):
+    """Keep track of pending execution timeouts.
+
+    Timeouts are cancelled as soon as the command they guard is done, so the
+    reactor doesn't have to carry a timer for every command ever run until
+    the full timeout has passed.
+
+    """
+
+    def __init__(self, clock=reactor):
+        self.clock = clock
+        self.timers = set()
+
+    @property
+    def live_timers(self):
+        return len(self.timers)
+
+    def schedule(self, seconds, function, *args):
+        def fire():
+            self.timers.discard(timer)
+            function(*args)
+
+        timer = self.clock.callLater(seconds, fire)
+        self.timers.add(timer)
+        return timer
+
+    def cancel(self, timer):
+        if timer in self.timers:
+            self.timers.discard(timer)
+            timer.cancel()
+
+
 class SshTransport(Transport):
     config_spec = CONFIG_SPEC
 
     def __init__(self, config):
         self.config = config
+        self.timeouts = TimeoutManager()
+
+    @property
+    def live_timers(self):
+        return self.timeouts.live_timers
 
     def initialize(self):
         filename = self.config["transport"]["key"]
@@ -149,12 +217,32 @@ class SshTransport(Transport):
         except (ConnectError, DNSLookupError) as e:
             raise ConnectionError(str(e))
 
+        keepalive_interval = self.config["transport"]["keepalive-interval"]
+        keepalive_count = self.config["transport"]["keepalive-count"]
+        if keepalive_interval:
+            _enable_tcp_keepalive(
+                connector.transport, keepalive_interval, keepalive_count)
+
         command_binary = self.config["transport"]["command"]
+        max_output_size = self.config["transport"]["max-output-size"]
+        stderr_tail_lines = self.config["transport"]["stderr-tail-lines"]
+        max_sessions = self.config["transport"]["max-sessions"]
         transport_connection = SshTransportConnection(
-            command_binary, connector, connection)
+            command_binary, connector, connection,
+            keepalive_interval, keepalive_count, self.timeouts,
+            max_output_size, stderr_tail_lines, max_sessions)
         returnValue(transport_connection)
 
 
+class KeepaliveTimeout(ConnectionError):
+    def __init__(self, missed):
+        self.missed = missed
+        super(KeepaliveTimeout, self).__init__()
+
+    def __str__(self):
+        return "host stopped responding (%d keepalives missed)" % self.missed
+
+
 class ChannelError(CommandFailed):
     def __init__(self, reason):
         self.reason = reason
@@ -182,43 +270,107 @@ class SignalError(CommandFailed):
         return "remote command was terminated by signal %d" % self.signal
 
 
+class _LineAssembler(object):
+    """Put a remote command's stderr back together into lines and log them.
+
+    Lines that arrive together are logged together in a single record. The
+    last few lines are kept around so they can be shown if the command fails.
+
+    """
+
+    def __init__(self, log, tail_lines):
+        self.log = log
+        self.partial = ""
+        self.tail = collections.deque(maxlen=tail_lines)
+
+    def feed(self, data):
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        if len(self.partial) > MAX_LINE_LENGTH:
+            lines.append(self.partial)
+            self.partial = ""
+        self._emit(lines)
+
+    def flush(self):
+        if self.partial:
+            self._emit([self.partial])
+            self.partial = ""
+
+    def _emit(self, lines):
+        lines = [line.rstrip("\r") for line in lines]
+        if lines:
+            self.tail.extend(lines)
+            self.log.debug("%s", "\n".join(lines))
+
+
 class _CommandChannel(SSHChannel):
     name = "session"
 
-    def __init__(self, log, command, timeout, *args, **kwargs):
+    def __init__(self, log, command, timeout, timeouts, max_output_size,
+                 stderr_tail_lines, *args, **kwargs):
         """
         :param timeout: command timeout in seconds.  0 for no timeout
+        :param TimeoutManager timeouts: where to schedule the timeout
+        :param max_output_size: how many bytes of output to keep in memory
+            before spilling it to a temporary file.  0 for no limit
+        :param stderr_tail_lines: how many lines of stderr to attach to
+            errors if the command fails
         """
         self.log = log
+        self.stderr = _LineAssembler(log, stderr_tail_lines)
         self.command = command
         self.finished = Deferred()
-        self.result = StringIO.StringIO()
+        self.max_output_size = max_output_size
+        self.output_size = 0
+        self.result = tempfile.SpooledTemporaryFile(max_size=max_output_size)
         self.reason = None
         self.timeout = timeout
+        self.timeouts = timeouts
+        self.timer = None
+        self.opened = False
 
         SSHChannel.__init__(self, *args, **kwargs)
 
     def _execution_timeout(self):
+        self.stderr.flush()
+        error = ExecutionTimeout(self.command)
+        error.stderr_tail = list(self.stderr.tail)
+        self.fail(error)
+
+    def _cancel_timeout(self):
+        if self.timer:
+            self.timeouts.cancel(self.timer)
+            self.timer = None
+
+    def fail(self, error):
+        self._cancel_timeout()
         if not self.finished.called:
-            self.finished.errback(ExecutionTimeout(self.command))
+            self.finished.errback(error)
+
+    def terminate(self):
+        """Ask the host to stop the command and give up on it."""
+        if self.opened:
+            self.conn.sendRequest(self, "signal", NS("TERM"))
+        self.fail(ConnectionError("disconnected while running"))
 
     def channelOpen(self, data):
+        self.opened = True
         if self.timeout:
-            reactor.callLater(self.timeout, self._execution_timeout)
+            self.timer = self.timeouts.schedule(
+                self.timeout, self._execution_timeout)
         command = self.command.encode("utf-8")
-        self.conn.sendRequest(self, "exec", NS(command), wantReply=1)
+        return self.conn.sendRequest(self, "exec", NS(command), wantReply=1)
 
     def openFailed(self, reason):
-        self.conn.errback(ChannelError(reason.desc))
+        self.fail(ChannelError(reason.desc))
 
     def dataReceived(self, data):
+        self.output_size += len(data)
         self.result.write(data)
 
     def extReceived(self, dataType, data):
         if dataType == EXTENDED_DATA_STDERR:
-            # TODO: proper line buffering
-            for line in data.splitlines():
-                self.log.debug(line)
+            self.stderr.feed(data)
 
     def request_exit_status(self, data):
         (status,) = struct.unpack(">L", data)
@@ -230,41 +382,206 @@ class _CommandChannel(SSHChannel):
         self.reason = SignalError(signal)
 
     def closed(self):
+        self._cancel_timeout()
+        self.stderr.flush()
 
         # The `finished` callback may have been already called if there was a
         # timeout issue.  If we try to call it again, it will fail loudly with
         # a twisted `AlreadyCalledError` exception.
         if self.finished.called:
+            self.result.close()
             return
 
-        if not self.reason:
+        if self.reason:
+            self.result.close()
+            self.reason.stderr_tail = list(self.stderr.tail)
+            self.finished.errback(self.reason)
+        elif self.max_output_size and self.output_size > self.max_output_size:
+            # large outputs are decoded in a thread so the reactor can keep
+            # servicing the other channels in the meantime
+            decoding = deferToThread(self._decode_output)
+            decoding.addCallbacks(self._succeed, self.fail)
+        else:
+            self._succeed(self._decode_output())
+
+    def _decode_output(self):
+        try:
             self.result.seek(0)
+            return json.load(self.result)
+        except ValueError:
+            return {}
+        finally:
+            self.result.close()
+
+    def _succeed(self, decoded):
+        # the command may have timed out or lost its connection while its
+        # output was being decoded
+        if not self.finished.called:
+            self.finished.callback(decoded)
+
+
+class _BatchChannel(_CommandChannel):
+    """Run a batch of commands and pass on its events as they arrive.
+
+    The batch document is sent on the command's stdin and the command answers
+    with a line of JSON for each event.
+
+    """
+
+    def __init__(self, log, command, document, on_event, *args, **kwargs):
+        self.document = document
+        self.on_event = on_event
+        self.partial = ""
+        _CommandChannel.__init__(self, log, command, *args, **kwargs)
+
+    def channelOpen(self, data):
+        requested = _CommandChannel.channelOpen(self, data)
+        requested.addCallbacks(self._send_document, self._exec_refused)
+
+    def _send_document(self, reply):
+        self.write(self.document)
+        self.conn.sendEOF(self)
+
+    def _exec_refused(self, reason):
+        self.fail(ChannelError(reason.getErrorMessage()))
+
+    def dataReceived(self, data):
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            if not line.strip():
+                continue
+
             try:
-                decoded = json.load(self.result)
+                event = json.loads(line)
             except ValueError:
-                decoded = {}
-            self.finished.callback(decoded)
-        else:
-            self.finished.errback(self.reason)
+                self.log.warning("unexpected output from batch: %s", line)
+                continue
+            self.on_event(event)
 
 
 class SshTransportConnection(TransportConnection):
-    def __init__(self, command_binary, connector, connection):
+    def __init__(self, command_binary, connector, connection,
+                 keepalive_interval=0, keepalive_count=0, timeouts=None,
+                 max_output_size=0, stderr_tail_lines=0, max_sessions=1):
+        """
+        :param int keepalive_interval: seconds between keepalive requests, 0
+            to not send any
+        :param int keepalive_count: how many keepalive requests in a row may
+            go unanswered before the connection is considered dead
+        :param TimeoutManager timeouts: where to schedule execution timeouts
+        :param int max_output_size: bytes of command output to keep in memory
+            before spilling it to disk, 0 for no limit
+        :param int stderr_tail_lines: how many lines of a failed command's
+            stderr to attach to its error
+        :param int max_sessions: how many commands may run at the same time,
+            each in its own channel. sshd refuses more than its MaxSessions.
+        """
         self.command_binary = command_binary
         self.connector = connector
         self.connection = connection
+        self.channels = set()
+        self.error = None
+        self.timeouts = timeouts or TimeoutManager()
+        self.max_output_size = max_output_size
+        self.stderr_tail_lines = stderr_tail_lines
+        self.sessions = DeferredSemaphore(tokens=max_sessions)
+
+        self.keepalive_count = keepalive_count
+        self.unanswered_keepalives = 0
+        self.keepalive = LoopingCall(self._send_keepalive)
+        if keepalive_interval:
+            self.keepalive.start(keepalive_interval, now=False)
+
+    def _send_keepalive(self):
+        if self.unanswered_keepalives >= self.keepalive_count:
+            self._fail(KeepaliveTimeout(self.unanswered_keepalives))
+            return
+
+        self.unanswered_keepalives += 1
+        reply = self.connection.sendGlobalRequest(
+            KEEPALIVE_REQUEST, "", wantReply=1)
+        reply.addBoth(self._on_keepalive_reply)
+
+    def _on_keepalive_reply(self, result):
+        # success or failure, any reply means the host is still there
+        self.unanswered_keepalives = 0
+
+    def check_alive(self, timeout):
+        if self.error:
+            return succeed(False)
+
+        alive = Deferred()
+        timer = self.timeouts.schedule(timeout, alive.callback, False)
+
+        def on_reply(result):
+            # success or failure, any reply means the host is still there
+            self.timeouts.cancel(timer)
+            if not alive.called:
+                alive.callback(True)
+
+        reply = self.connection.sendGlobalRequest(
+            KEEPALIVE_REQUEST, "", wantReply=1)
+        reply.addBoth(on_reply)
+        return alive
+
+    def _fail(self, error):
+        """Fail all commands in flight and give up on the connection."""
+        self.error = error
+        for channel in list(self.channels):
+            channel.fail(error)
+        self.disconnect()
 
     @inlineCallbacks
     def execute(self, log, command, timeout=0):
+        if self.error:
+            raise self.error
+
         args = " ".join(pipes.quote(part) for part in command)
         command = "sudo %s %s" % (self.command_binary, args)
 
         channel = _CommandChannel(
-            log, command, conn=self.connection, timeout=timeout)
-        self.connection.openChannel(channel)
-        result = yield channel.finished
+            log, command, timeout, self.timeouts, self.max_output_size,
+            self.stderr_tail_lines, conn=self.connection)
+        result = yield self._run_channel(channel)
+        returnValue(result)
+
+    @inlineCallbacks
+    def execute_batch(self, log, commands, on_event, timeout=0):
+        if self.error:
+            raise self.error
+
+        command = "sudo %s batch" % self.command_binary
+        document = json.dumps({"commands": commands})
+
+        channel = _BatchChannel(
+            log, command, document, on_event, timeout, self.timeouts,
+            self.max_output_size, self.stderr_tail_lines,
+            conn=self.connection)
+        yield self._run_channel(channel)
+
+    @inlineCallbacks
+    def _run_channel(self, channel):
+        yield self.sessions.acquire()
+        try:
+            # the connection may have died while waiting for a session
+            if self.error:
+                raise self.error
+
+            self.channels.add(channel)
+            try:
+                self.connection.openChannel(channel)
+                result = yield channel.finished
+            finally:
+                self.channels.discard(channel)
+        finally:
+            self.sessions.release()
         returnValue(result)
 
     def disconnect(self):
+        if self.keepalive.running:
+            self.keepalive.stop()
+        for channel in list(self.channels):
+            channel.terminate()
         self.connector.disconnect()
         return succeed(None)
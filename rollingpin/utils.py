@@ -4,6 +4,7 @@ import math
 import re
 
 from twisted.internet import reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
 from twisted.internet.defer import (
     Deferred,
     DeferredSemaphore,
@@ -12,6 +13,7 @@ from twisted.internet.defer import (
     returnValue,
     succeed,
 )
+from twisted.internet.protocol import Protocol
 from twisted.web.iweb import IBodyProducer
 from zope.interface import implements
 
@@ -36,6 +38,57 @@ def sleep(seconds):
     return deferred
 
 
+def probe_tcp(address, port, timeout):
+    """Return a Deferred that fires with whether `address` accepts TCP
+    connections on `port` within `timeout` seconds."""
+    def on_connect(protocol):
+        protocol.transport.loseConnection()
+        return True
+
+    endpoint = TCP4ClientEndpoint(reactor, address, port, timeout=timeout)
+    deferred = connectProtocol(endpoint, Protocol())
+    deferred.addCallbacks(on_connect, lambda reason: False)
+    return deferred
+
+
+class ResizableSemaphore(DeferredSemaphore):
+    """A DeferredSemaphore whose limit can be changed while it is in use.
+
+    Shrinking the limit below the number of tokens currently held does not
+    take anything away from the holders, it just delays new acquisitions
+    until enough tokens have been released.
+
+    """
+
+    @property
+    def in_use(self):
+        return self.limit - self.tokens
+
+    def _wake_waiters(self):
+        while self.tokens > 0 and self.waiting:
+            self.tokens -= 1
+            waiter = self.waiting.pop(0)
+            waiter.callback(self)
+
+    def acquire(self):
+        deferred = Deferred(canceller=self._cancelAcquire)
+        self.waiting.append(deferred)
+        self._wake_waiters()
+        return deferred
+
+    def release(self):
+        assert self.in_use > 0, "released more tokens than were acquired"
+        self.tokens += 1
+        self._wake_waiters()
+
+    def resize(self, limit):
+        if limit < 1:
+            raise ValueError("ResizableSemaphore requires limit >= 1")
+        self.tokens += limit - self.limit
+        self.limit = limit
+        self._wake_waiters()
+
+
 valid_push_word = re.compile("^[a-z:]{5,}$")
 
 
@@ -50,6 +103,27 @@ def parallel_map(iterable, fn, *args, **kwargs):
     returnValue(results)
 
 
+def gather_fail_fast(deferreds):
+    """Gather the results of deferreds, failing on the first error.
+
+    Like :func:`gatherResults`, but as soon as any of the deferreds fails the
+    original failure is passed on rather than a :class:`FirstError` wrapping
+    it. The other deferreds are cancelled, which only stops work that
+    supports cancellation, such as waiting on a semaphore. Work started by
+    an inlineCallbacks function keeps going and is merely abandoned.
+
+    """
+    def cancel_remaining(failure):
+        for deferred in deferreds:
+            if not deferred.called:
+                deferred.cancel()
+        return failure.value.subFailure
+
+    gathered = gatherResults(deferreds, consumeErrors=True)
+    gathered.addErrback(cancel_remaining)
+    return gathered
+
+
 def _distribute_into(master, additions):
     assert len(master) >= len(additions)
 
@@ -9,9 +9,14 @@ from twisted.internet import reactor
 from twisted.internet.defer import inlineCallbacks
 from twisted.web.client import Agent, readBody
 from twisted.web.http_headers import Headers
+from .progress import format_duration
 from .utils import JSONBodyProducer, swallow_exceptions
 
 
+# the least number of seconds between updates of the deploy's progress
+PROGRESS_INTERVAL = 60
+
+
 class WavefrontNotifier(object):
     def __init__(self, config, components, hosts, command_line, word, profile):
         self.logger = logging.getLogger(__name__)
@@ -24,6 +29,7 @@ class WavefrontNotifier(object):
         self.components = components
         self.deploy_event_id = None
         self.deploy_start_time = None
+        self.last_progress_update = 0
         self.deploy_event = {
             "name": "%s Deploy" % self.profile,
             "annotations": {
@@ -83,6 +89,17 @@ class WavefrontNotifier(object):
         self.deploy_event['endTime'] = timestamp_in_milliseconds
         return self.deploy_event
 
+    def deploy_progress_event(self, completed, total, hosts_per_minute, eta):
+        """ Return Wavefront-conformant JSON to update event
+        with the progress of the deploy.
+        """
+        progress = "%d/%d hosts" % (completed, total)
+        if eta is not None:
+            progress += ", %.1f hosts/min, %s left" % (
+                hosts_per_minute, format_duration(eta))
+        self.deploy_event['annotations']['progress'] = progress
+        return self.deploy_event
+
     def deploy_end_event(self):
         """ Return Wavefront-conformant JSON to update event
         indicating deploy was completed.
@@ -105,6 +122,16 @@ class WavefrontNotifier(object):
     def on_deploy_abort(self, reason):
         yield self.update_deploy_event(self.deploy_abort_event(reason))
 
+    @inlineCallbacks
+    def on_progress(self, completed, total, hosts_per_minute, eta):
+        now = time.time()
+        if (not self.deploy_event_id or
+                now - self.last_progress_update < PROGRESS_INTERVAL):
+            return
+        self.last_progress_update = now
+        yield self.update_deploy_event(self.deploy_progress_event(
+            completed, total, hosts_per_minute, eta))
+
     @inlineCallbacks
     def on_deploy_end(self):
         yield self.update_deploy_event(self.deploy_end_event())
@@ -119,4 +146,5 @@ def enable_wavefront_notifications(config, event_bus, components, hosts,
         "deploy.begin": notifier.on_deploy_start,
         "deploy.abort": notifier.on_deploy_abort,
         "deploy.end": notifier.on_deploy_end,
+        "deploy.progress": notifier.on_progress,
     })
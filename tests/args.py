@@ -2,6 +2,7 @@ import unittest
 import mock
 
 from rollingpin.args import (
+    build_action_summary,
     parse_args,
     make_profile_parser,
     construct_canonical_commandline,
@@ -46,6 +47,18 @@ class TestArgumentParsing(unittest.TestCase):
         args = parse_args(self.config, ["-h", "a", "--parallel", "3"])
         self.assertEqual(args.parallel, 3)
 
+    # --min-parallel / --max-parallel
+    def test_adaptive_parallel_default(self):
+        args = parse_args(self.config, ["-h", "a"])
+        self.assertEqual(args.min_parallel, 1)
+        self.assertEqual(args.max_parallel, 0)
+
+    def test_adaptive_parallel_override(self):
+        args = parse_args(self.config, ["-h", "a", "--min-parallel", "2",
+                                        "--max-parallel", "20"])
+        self.assertEqual(args.min_parallel, 2)
+        self.assertEqual(args.max_parallel, 20)
+
     # --sleeptime
     def test_sleeptime_default(self):
         args = parse_args(self.config, ["-h", "a"])
@@ -55,6 +68,45 @@ class TestArgumentParsing(unittest.TestCase):
         args = parse_args(self.config, ["-h", "a", "--sleeptime", "1"])
         self.assertEqual(args.sleeptime, 1)
 
+    # --ready-parallel
+    def test_ready_parallel_default(self):
+        args = parse_args(self.config, ["-h", "a"])
+        self.assertEqual(args.ready_parallel, 0)
+
+    def test_ready_parallel_override(self):
+        args = parse_args(self.config, ["-h", "a", "--ready-parallel", "50"])
+        self.assertEqual(args.ready_parallel, 50)
+
+    # --rate / --burst
+    def test_rate_default(self):
+        args = parse_args(self.config, ["-h", "a"])
+        self.assertEqual(args.rate, 0)
+        self.assertEqual(args.burst, 1)
+
+    def test_rate_override(self):
+        args = parse_args(self.config, ["-h", "a", "--rate", "30",
+                                        "--burst", "5"])
+        self.assertEqual(args.rate, 30)
+        self.assertEqual(args.burst, 5)
+
+    # --order
+    def test_order_default(self):
+        args = parse_args(self.config, ["-h", "a"])
+        self.assertEqual(args.order, "id")
+
+    def test_order_override(self):
+        args = parse_args(self.config, ["-h", "a", "--order", "longest-first"])
+        self.assertEqual(args.order, "longest-first")
+
+    # --retries
+    def test_retries_default(self):
+        args = parse_args(self.config, ["-h", "a"])
+        self.assertEqual(args.retries, 0)
+
+    def test_retries_override(self):
+        args = parse_args(self.config, ["-h", "a", "--retries", "2"])
+        self.assertEqual(args.retries, 2)
+
     # --list
     def test_list_default(self):
         args = parse_args(self.config, ["-h", "a"])
@@ -95,6 +147,33 @@ class TestArgumentParsing(unittest.TestCase):
         args = parse_args(self.config, ["-h", "a", "--dangerously-fast"])
         self.assertTrue(args.dangerously_fast)
 
+    # --skip-up-to-date
+    def test_skip_up_to_date_default(self):
+        args = parse_args(self.config, ["-h", "a"])
+        self.assertFalse(args.skip_up_to_date)
+
+    def test_skip_up_to_date_flagged(self):
+        args = parse_args(self.config, ["-h", "a", "--skip-up-to-date"])
+        self.assertTrue(args.skip_up_to_date)
+
+    # --check-reachable
+    def test_check_reachable_default(self):
+        args = parse_args(self.config, ["-h", "a"])
+        self.assertFalse(args.check_reachable)
+
+    def test_check_reachable_flagged(self):
+        args = parse_args(self.config, ["-h", "a", "--check-reachable"])
+        self.assertTrue(args.check_reachable)
+
+    # --no-build-cache
+    def test_build_cache_default(self):
+        args = parse_args(self.config, ["-h", "a"])
+        self.assertTrue(args.use_build_cache)
+
+    def test_build_cache_disabled(self):
+        args = parse_args(self.config, ["-h", "a", "--no-build-cache"])
+        self.assertFalse(args.use_build_cache)
+
     # -d
     def test_empty_deploys(self):
         args = parse_args(self.config, ["-h", "a"])
@@ -282,6 +361,12 @@ class TestArgumentReconstruction(unittest.TestCase):
         self.assertEqual(
             "-h host --parallel=5 --timeout=60 -c cmd1 -c cmd2", canonical)
 
+    def test_retries(self):
+        args = parse_args(self.config, ["-h", "host", "--retries", "3"])
+        canonical = construct_canonical_commandline(self.config, args)
+        self.assertEqual(
+            "-h host --parallel=5 --timeout=60 --retries=3", canonical)
+
     def test_verbose(self):
         args = parse_args(self.config, ["-h", "host", "-v"])
         canonical = construct_canonical_commandline(self.config, args)
@@ -289,6 +374,30 @@ class TestArgumentReconstruction(unittest.TestCase):
             "-h host --parallel=5 --timeout=60 --verbose", canonical)
 
 
+class TestActionSummary(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {
+            "deploy": {
+                "default-parallel": 5,
+                "default-sleeptime": 2,
+                "execution-timeout": 60,
+                "command-parallel": {"restart": 2, "deploy": 20},
+            },
+
+            "harold": {
+                "base-url": "http://example.com",
+                "secret": None,
+            },
+        }
+
+    def test_command_parallel(self):
+        args = parse_args(self.config, ["-h", "host", "-r", "all"])
+        summary = build_action_summary(self.config, args)
+        self.assertIn("at most 20 running `deploy` at a time, "
+                      "at most 2 running `restart` at a time", summary)
+
+
 # Helper
 def cmdline(cmds):
     return [cmd.cmdline() for cmd in cmds]
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from rollingpin.buildcache import BuildCache
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "build-cache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_miss(self):
+        cache = BuildCache(self.path, ttl=60, max_entries=10)
+        self.assertIsNone(cache.get("foo@abc"))
+
+    def test_round_trip(self):
+        cache = BuildCache(self.path, ttl=60, max_entries=10)
+        cache.put("foo@abc", "build-1")
+        cache.save()
+
+        reloaded = BuildCache(self.path, ttl=60, max_entries=10)
+        self.assertEqual(reloaded.get("foo@abc"), "build-1")
+
+    @mock.patch("rollingpin.buildcache.time.time")
+    def test_expiry(self, time):
+        cache = BuildCache(self.path, ttl=60, max_entries=10)
+        time.return_value = 1000
+        cache.put("foo@abc", "build-1")
+
+        time.return_value = 1061
+        self.assertIsNone(cache.get("foo@abc"))
+
+    @mock.patch("rollingpin.buildcache.time.time")
+    def test_least_recently_used_evicted(self, time):
+        cache = BuildCache(self.path, ttl=600, max_entries=2)
+        time.return_value = 1000
+        cache.put("foo@abc", "build-1")
+        time.return_value = 1001
+        cache.put("bar@def", "build-2")
+        time.return_value = 1002
+        cache.get("foo@abc")
+        time.return_value = 1003
+        cache.put("baz@123", "build-3")
+        cache.save()
+
+        self.assertEqual(sorted(cache.entries), ["baz@123", "foo@abc"])
+
+    def test_corrupt_cache_ignored(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        cache = BuildCache(self.path, ttl=60, max_entries=10)
+        self.assertIsNone(cache.get("foo@abc"))
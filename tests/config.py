@@ -91,6 +91,17 @@ class TestConfiguration(unittest.TestCase):
         self.assertIsInstance(errors[0], rollingpin.config.CoercionError)
 
 
+class TestParseBool(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertTrue(rollingpin.config.parse_bool("Yes"))
+        self.assertFalse(rollingpin.config.parse_bool("off"))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            rollingpin.config.parse_bool("maybe")
+
+
 class TestOptionalSections(unittest.TestCase):
 
     def test_bad_optional_section(self):
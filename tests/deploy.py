@@ -1,6 +1,53 @@
+import collections
 import unittest
 
-from rollingpin.deploy import Deployer
+import mock
+from twisted.internet.defer import Deferred, fail, succeed
+
+from rollingpin.commands import DeployCommand, RestartCommand
+from rollingpin.deploy import (
+    PRECONNECTION_MAX_AGE,
+    Deployer,
+    is_up_to_date,
+)
+from rollingpin.errorbudget import ErrorBudget
+from rollingpin.eventbus import EventBus
+from rollingpin.hostsources import Host
+from rollingpin.transports import CommandFailed, ConnectionError
+
+
+def make_connection():
+    connection = mock.Mock()
+    connection.check_alive.return_value = succeed(True)
+    connection.disconnect.return_value = succeed(None)
+    return connection
+
+
+def make_transport(connection):
+    transport = mock.Mock()
+    transport.connect_to.return_value = succeed(connection)
+    return transport
+
+
+def make_deployer(event_bus=None, transport=None, host_source=None,
+                  **kwargs):
+    """Make a Deployer that works on one host at a time without sleeping.
+
+    Any other keyword arguments are passed on to the Deployer.
+
+    """
+    config = {
+        'hostsource': host_source or mock.Mock(),
+        'transport': transport or mock.Mock(),
+        'deploy': {
+            'code-host': 'code-01',
+        }
+    }
+    kwargs.setdefault('parallel', 1)
+    kwargs.setdefault('timeout', 0)
+    kwargs.setdefault('sleeptime', 0)
+    kwargs.setdefault('dangerously_fast', False)
+    return Deployer(config, event_bus or mock.Mock(), **kwargs)
 
 
 class TestDeployer(unittest.TestCase):
@@ -27,3 +74,407 @@ class TestDeployer(unittest.TestCase):
         self.assertEquals(deployer.execution_timeout, 11)
         self.assertEquals(deployer.sleeptime, 12)
         self.assertEquals(deployer.dangerously_fast, True)
+
+
+class TestPreconnect(unittest.TestCase):
+    def setUp(self):
+        self.connection = make_connection()
+        self.transport = make_transport(self.connection)
+        self.deployer = make_deployer(transport=self.transport)
+        self.host = Host.from_hostname('app-01')
+
+    def test_preconnection_used(self):
+        self.deployer.preconnect([self.host])
+        connections = []
+        self.deployer.connect_to_host(self.host).addCallback(
+            connections.append)
+        self.assertEqual(connections, [self.connection])
+        self.assertEqual(self.transport.connect_to.call_count, 1)
+
+    def test_failed_preconnection_retried(self):
+        self.transport.connect_to.return_value = fail(
+            ConnectionError("unable to connect"))
+        self.deployer.preconnect([self.host])
+
+        self.transport.connect_to.return_value = succeed(self.connection)
+        connections = []
+        self.deployer.connect_to_host(self.host).addCallback(
+            connections.append)
+        self.assertEqual(connections, [self.connection])
+        self.assertEqual(self.transport.connect_to.call_count, 2)
+
+    def connect_fresh(self):
+        fresh_connection = mock.Mock()
+        self.transport.connect_to.return_value = succeed(fresh_connection)
+        connections = []
+        self.deployer.connect_to_host(self.host).addCallback(
+            connections.append)
+        self.assertEqual(connections, [fresh_connection])
+        self.connection.disconnect.assert_called_once_with()
+
+    @mock.patch('rollingpin.deploy.time.time')
+    def test_old_preconnection_replaced(self, time):
+        time.return_value = 1000
+        self.deployer.preconnect([self.host])
+
+        time.return_value += PRECONNECTION_MAX_AGE
+        self.connect_fresh()
+
+    def test_dead_preconnection_replaced(self):
+        self.connection.check_alive.return_value = succeed(False)
+        self.deployer.preconnect([self.host])
+        self.connect_fresh()
+
+    def test_unused_preconnections_closed(self):
+        self.deployer.preconnect([self.host])
+        self.deployer.close_preconnections()
+        self.connection.disconnect.assert_called_once_with()
+        self.assertEqual(self.deployer.preconnections, {})
+
+    def test_preconnections_to_dropped_hosts_closed(self):
+        other_host = Host.from_hostname('app-02')
+        self.deployer.preconnect([self.host, other_host])
+        self.deployer.close_preconnections(keep=[other_host])
+        self.connection.disconnect.assert_called_once_with()
+        self.assertEqual(self.deployer.preconnections.keys(), [other_host])
+
+
+class TestCommandTimeouts(unittest.TestCase):
+    def setUp(self):
+        self.connection = make_connection()
+        self.connection.execute.return_value = succeed({})
+        self.deployer = make_deployer(
+            transport=make_transport(self.connection),
+            command_timeouts={'restart': 30})
+        self.host = Host.from_hostname('app-01')
+
+    def test_timeout_overridden_per_command(self):
+        log = mock.Mock()
+        restart = RestartCommand(['all'])
+        deploy = DeployCommand(['foo@abc'])
+
+        self.deployer.run_commands(log, self.host, [deploy, restart], 60)
+        self.assertEqual(self.connection.execute.call_args_list, [
+            mock.call(log, deploy.cmdline(), 60),
+            mock.call(log, restart.cmdline(), 30),
+        ])
+
+
+class TestCommandDependencies(unittest.TestCase):
+    def setUp(self):
+        self.executions = {}
+
+        def execute(log, cmdline, timeout):
+            self.executions[tuple(cmdline)] = Deferred()
+            return self.executions[tuple(cmdline)]
+
+        self.connection = make_connection()
+        self.connection.execute.side_effect = execute
+        self.event_bus = EventBus()
+        self.ended = []
+        self.event_bus.register({
+            'host.command_end': lambda host, command, duration:
+                self.ended.append(command),
+        })
+        self.deployer = make_deployer(
+            self.event_bus, transport=make_transport(self.connection),
+            command_dependencies={'restart': {'deploy'}})
+        self.host = Host.from_hostname('app-01')
+
+    def test_independent_commands_run_concurrently(self):
+        deploy = DeployCommand(['foo@abc'])
+        restarts = [RestartCommand(['a']), RestartCommand(['b'])]
+
+        results = []
+        self.deployer.run_commands(
+            mock.Mock(), self.host, [deploy] + restarts).addCallback(
+                results.append)
+        self.assertEqual(self.executions.keys(), [tuple(deploy.cmdline())])
+
+        self.executions[tuple(deploy.cmdline())].callback({})
+        self.assertEqual(len(self.executions), 3)
+
+        self.executions[('restart', 'b')].callback({})
+        self.assertEqual(self.ended, ['deploy', 'restart'])
+        self.executions[('restart', 'a')].callback({})
+        self.assertEqual(self.ended, ['deploy', 'restart', 'restart'])
+        self.assertEqual([result.command for result in results[0]],
+                         ['deploy', 'restart', 'restart'])
+
+    def test_failed_command_stops_the_others(self):
+        restarts = [RestartCommand(['a']), RestartCommand(['b'])]
+
+        results = []
+        self.deployer.run_commands(
+            mock.Mock(), self.host, restarts).addErrback(results.append)
+        self.executions[('restart', 'a')].errback(CommandFailed('oops'))
+        self.connection.disconnect.assert_called_once_with()
+
+        # the host isn't done until the other restart has stopped
+        self.assertEqual(results, [])
+        self.executions[('restart', 'b')].errback(
+            ConnectionError('disconnected'))
+        self.assertTrue(results[0].check(CommandFailed))
+
+
+class TestBatchMode(unittest.TestCase):
+    def setUp(self):
+        self.connection = make_connection()
+        self.deployer = make_deployer(
+            transport=make_transport(self.connection),
+            command_timeouts={'restart': 30},
+            batch_mode=True)
+        self.host = Host.from_hostname('app-01')
+
+    def test_commands_sent_in_one_batch(self):
+        deploy = DeployCommand(['foo@abc'])
+        restart = RestartCommand(['all'], explicit=False)
+
+        def execute_batch(log, commands, on_event, timeout):
+            on_event({'event': 'begin', 'index': 0})
+            on_event({'event': 'end', 'index': 0,
+                      'result': {'foo@abc': DeployCommand.REPO_UNCHANGED}})
+            on_event({'event': 'end', 'index': 5})
+            return succeed(None)
+        self.connection.execute_batch.side_effect = execute_batch
+
+        results = []
+        self.deployer.run_commands(
+            mock.Mock(), self.host, [deploy, restart], 60).addCallback(
+                results.append)
+
+        self.assertFalse(self.connection.execute.called)
+        commands, on_event, timeout = (
+            self.connection.execute_batch.call_args[0][1:])
+        self.assertEqual(commands, [deploy.to_batch(), restart.to_batch()])
+        self.assertTrue(commands[0]['skip_remaining_unless_changed'])
+        self.assertEqual(timeout, 90)
+        self.assertEqual([result.command for result in results[0]],
+                         ['deploy'])
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.changed = Host.from_hostname('app-01')
+        self.unchanged = Host.from_hostname('app-02')
+
+        def connect_to(address):
+            connection = make_connection()
+            status = (DeployCommand.REPO_UNCHANGED
+                      if address == self.unchanged.address
+                      else DeployCommand.REPO_CHANGED)
+            connection.execute.return_value = succeed({'foo@abc': status})
+            return succeed(connection)
+
+        transport = mock.Mock()
+        transport.connect_to.side_effect = connect_to
+        self.event_bus = EventBus()
+        self.ended = []
+        self.event_bus.register({
+            'host.end': lambda host, results: self.ended.append(host),
+        })
+        self.deployer = make_deployer(
+            self.event_bus, transport=transport, prefetch_parallel=10)
+        self.deploy_command = DeployCommand(['foo@abc'])
+
+    def prefetch(self, commands):
+        outcome = []
+        self.deployer.prefetch(
+            [self.changed, self.unchanged], self.deploy_command,
+            commands).addCallback(outcome.append)
+        return outcome[0]
+
+    def test_unchanged_hosts_skip_rollout(self):
+        restart = RestartCommand(['all'], explicit=False)
+        hosts, host_commands = self.prefetch([restart])
+        self.assertEqual(hosts, [self.changed])
+        self.assertEqual(host_commands, {self.changed: [restart]})
+        self.assertEqual(self.ended, [self.unchanged])
+
+    def test_unchanged_hosts_run_explicit_commands(self):
+        restart = RestartCommand(['all'], explicit=True)
+        hosts, host_commands = self.prefetch([restart])
+        self.assertEqual(hosts, [self.changed, self.unchanged])
+        self.assertEqual(self.ended, [])
+
+
+class TestIsUpToDate(unittest.TestCase):
+    def setUp(self):
+        self.deploy_command = DeployCommand(['foo@abc', 'bar@def'])
+
+    def test_up_to_date(self):
+        result = {'components': {
+            'foo': {'abc': 3},
+            'bar': {'def': 1},
+        }}
+        self.assertTrue(is_up_to_date(result, self.deploy_command))
+
+    def test_old_process_still_running(self):
+        result = {'components': {
+            'foo': {'abc': 3, '123': 1},
+            'bar': {'def': 1},
+        }}
+        self.assertFalse(is_up_to_date(result, self.deploy_command))
+
+    def test_component_not_running(self):
+        result = {'components': {'foo': {'abc': 3}}}
+        self.assertFalse(is_up_to_date(result, self.deploy_command))
+
+    def test_empty_result(self):
+        self.assertFalse(is_up_to_date({}, self.deploy_command))
+
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self.event_bus = EventBus()
+        self.ended = []
+        self.event_bus.register({
+            'host.end': lambda host, results: self.ended.append(host),
+        })
+        self.deployer = make_deployer(self.event_bus, completed_hosts={
+            'app-01': ['foo@abc'],
+            'app-02': ['foo@old'],
+        })
+        self.hosts = [Host.from_hostname(name)
+                      for name in ('app-01', 'app-02', 'app-03')]
+
+    def test_skips_hosts_completed_with_same_tokens(self):
+        remaining = []
+        self.deployer.skip_completed_hosts(
+            self.hosts, ['foo@abc']).addCallback(remaining.append)
+        self.assertEqual(remaining, [self.hosts[1:]])
+        self.assertEqual(self.ended, [self.hosts[0]])
+
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        self.flaky = Host.from_hostname('app-01')
+        self.broken = Host.from_hostname('app-02')
+        self.terminated = Host.from_hostname('app-03')
+        self.attempts = collections.Counter()
+
+        def connect_to(address):
+            self.attempts[address] += 1
+            if address == self.flaky.address and self.attempts[address] > 1:
+                connection = make_connection()
+                connection.execute.return_value = succeed({})
+                return succeed(connection)
+            return fail(ConnectionError('connection refused'))
+
+        transport = mock.Mock()
+        transport.connect_to.side_effect = connect_to
+        host_source = mock.Mock()
+        host_source.should_be_alive.side_effect = (
+            lambda host: succeed(host != self.terminated))
+        self.event_bus = EventBus()
+        self.ended = []
+        self.retried = []
+        self.event_bus.register({
+            'host.end': lambda host, results: self.ended.append(host),
+            'deploy.retry': lambda hosts, attempt, delay:
+                self.retried.append((hosts, attempt, delay)),
+        })
+        self.deployer = make_deployer(
+            self.event_bus, transport=transport, host_source=host_source,
+            retries=2, retry_backoff=0, retry_parallel=2)
+
+        # pretend they all failed during the rollout
+        self.deployer.failed_hosts = [
+            self.flaky, self.broken, self.terminated]
+        self.attempts.update(
+            host.address for host in self.deployer.failed_hosts)
+
+    def test_retries_until_out_of_attempts(self):
+        self.deployer.retry_failed_hosts({}, [RestartCommand(['all'])])
+        self.assertEqual(self.ended, [self.flaky])
+        self.assertEqual(self.retried, [
+            ([self.flaky, self.broken], 1, 0),
+            ([self.broken], 2, 0),
+        ])
+        self.assertEqual(self.deployer.failed_hosts, [self.broken])
+
+    def test_terminated_hosts_not_retried(self):
+        self.deployer.retry_failed_hosts({}, [RestartCommand(['all'])])
+        self.assertEqual(self.attempts[self.terminated.address], 1)
+
+
+class TestErrorBudget(unittest.TestCase):
+    def setUp(self):
+        self.connects = []
+
+        def connect_to(address):
+            self.connects.append(Deferred())
+            return self.connects[-1]
+
+        transport = mock.Mock()
+        transport.connect_to.side_effect = connect_to
+        host_source = mock.Mock()
+        host_source.should_be_alive.return_value = succeed(True)
+        for target in ('rollingpin.deploy.reactor',
+                       'rollingpin.deploy.signal.signal'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.event_bus = EventBus()
+        self.aborted = []
+        self.skipped = []
+        self.event_bus.register({
+            'deploy.abort': lambda reason: self.aborted.append(reason),
+            'deploy.skip': lambda hosts, reason: self.skipped.append(hosts),
+        })
+        self.deployer = make_deployer(
+            self.event_bus, transport=transport, host_source=host_source,
+            error_budget=ErrorBudget(count=0))
+
+    def test_queued_hosts_skipped_once_budget_exceeded(self):
+        hosts = [Host.from_hostname('app-%02d' % i) for i in range(20)]
+        self.deployer.run_deploy(hosts, [], [RestartCommand(['all'])])
+        self.assertEqual(len(self.connects), 1)
+
+        self.connects[0].errback(ConnectionError('connection refused'))
+        self.assertEqual(len(self.connects), 1)
+        self.assertEqual(self.skipped, [hosts[1:]])
+        self.assertEqual(len(self.aborted), 1)
+        self.assertIn('1 failure on', self.aborted[0])
+
+
+class TestReachability(unittest.TestCase):
+    def setUp(self):
+        self.hosts = [Host.from_hostname(name)
+                      for name in ('app-01', 'app-02', 'app-03')]
+        self.unreachable = {'app-02', 'app-03'}
+        patcher = mock.patch(
+            'rollingpin.deploy.probe_tcp',
+            side_effect=lambda address, port, timeout: succeed(
+                address not in self.unreachable))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        host_source = mock.Mock()
+        host_source.should_be_alive.side_effect = (
+            lambda host: succeed(host.name != 'app-03'))
+        self.event_bus = EventBus()
+        self.aborted = []
+        self.skipped = []
+        self.event_bus.register({
+            'host.abort': lambda host, error, should_be_alive:
+                self.aborted.append((host.name, should_be_alive)),
+            'deploy.skip': lambda hosts, reason: self.skipped.extend(hosts),
+        })
+        self.deployer = make_deployer(
+            self.event_bus, host_source=host_source, reachability_parallel=10)
+
+    def test_unreachable_hosts_left_out(self):
+        unreachable = []
+        self.deployer.find_unreachable_hosts(self.hosts).addCallback(
+            unreachable.append)
+        self.assertEqual(unreachable, [self.hosts[1:]])
+
+        remaining = []
+        self.deployer.skip_unreachable_hosts(
+            self.hosts, unreachable[0]).addCallback(remaining.append)
+        self.assertEqual(remaining, [self.hosts[:1]])
+        self.assertEqual(self.skipped, self.hosts[1:])
+        self.assertEqual(self.aborted, [('app-02', True), ('app-03', False)])
+        self.assertEqual(self.deployer.failed_hosts, self.hosts[1:])
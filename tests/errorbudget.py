@@ -0,0 +1,99 @@
+import unittest
+
+from rollingpin.errorbudget import (
+    CircuitBreaker,
+    ErrorBudget,
+    parse_error_budget,
+)
+from rollingpin.hostsources import Host
+from rollingpin.transports import CommandFailed
+
+
+class TestErrorBudget(unittest.TestCase):
+
+    def test_count(self):
+        budget = ErrorBudget.parse("5")
+        self.assertEqual(budget.count, 5)
+        self.assertIsNone(budget.percent)
+        self.assertEqual(str(budget), "5 failures")
+        self.assertEqual(str(ErrorBudget.parse("1")), "1 failure")
+
+    def test_percent(self):
+        budget = ErrorBudget.parse("10%")
+        self.assertEqual(budget.percent, 10)
+        self.assertIsNone(budget.count)
+
+    def test_invalid(self):
+        for value in ("-1", "100%", "lots"):
+            with self.assertRaises(ValueError):
+                ErrorBudget.parse(value)
+
+    def test_empty_means_no_budget(self):
+        self.assertIsNone(parse_error_budget(""))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = [Host.from_hostname("app-%02d" % i) for i in range(20)]
+        self.remaining = iter(self.hosts)
+
+    def make_breaker(self, budget=None, terminated_budget=None, window=10):
+        return CircuitBreaker(self.hosts, budget, terminated_budget, window)
+
+    def succeed(self, breaker, count=1):
+        for _ in range(count):
+            breaker.on_host_end(next(self.remaining), [])
+
+    def fail(self, breaker, count=1, should_be_alive=True):
+        for _ in range(count):
+            breaker.on_host_abort(
+                next(self.remaining), CommandFailed("oops"), should_be_alive)
+
+    def test_count_budget(self):
+        breaker = self.make_breaker(budget=ErrorBudget(count=2))
+        self.fail(breaker, 2)
+        self.succeed(breaker, 5)
+        self.assertFalse(breaker.tripped)
+
+        self.fail(breaker)
+        self.assertTrue(breaker.tripped)
+        self.assertIn("3 failures on hosts that should be alive",
+                      breaker.reason)
+
+    def test_percent_budget_slides(self):
+        breaker = self.make_breaker(budget=ErrorBudget(percent=20))
+        self.fail(breaker, 2)
+        self.succeed(breaker, 10)
+        self.fail(breaker, 2)
+        self.assertFalse(breaker.tripped)
+
+        self.fail(breaker)
+        self.assertTrue(breaker.tripped)
+        self.assertIn("3 of the last 10 hosts failed", breaker.reason)
+
+    def test_percent_budget_trips_before_window_fills(self):
+        breaker = self.make_breaker(budget=ErrorBudget(percent=20))
+        self.fail(breaker, 3)
+        self.assertTrue(breaker.tripped)
+
+    def test_terminated_hosts_budgeted_separately(self):
+        breaker = self.make_breaker(budget=ErrorBudget(count=0),
+                                    terminated_budget=ErrorBudget(count=2))
+        self.fail(breaker, 2, should_be_alive=False)
+        self.assertFalse(breaker.tripped)
+
+        self.fail(breaker, should_be_alive=False)
+        self.assertTrue(breaker.tripped)
+        self.assertIn("possibly terminated hosts", breaker.reason)
+
+    def test_no_budget_for_kind(self):
+        breaker = self.make_breaker(terminated_budget=ErrorBudget(count=0))
+        self.fail(breaker, 5)
+        self.assertFalse(breaker.tripped)
+
+    def test_other_hosts_ignored(self):
+        breaker = self.make_breaker(budget=ErrorBudget(count=0))
+        breaker.on_host_abort(
+            Host.from_hostname("build-01"), CommandFailed("oops"), True)
+        self.assertFalse(breaker.tripped)
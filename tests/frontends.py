@@ -1,7 +1,15 @@
+import logging
 import unittest
 
+import mock
+
 from rollingpin.deploy import DeployResult
-from rollingpin.frontends import generate_component_report
+from rollingpin.frontends import (
+    CanaryDeployStrategy,
+    HeadlessFrontend,
+    PercentDeployStrategy,
+    generate_component_report,
+)
 from rollingpin.hostsources import Host
 
 
@@ -95,3 +103,51 @@ class TestFrontends(unittest.TestCase):
         # Verify
         expected_report = {'foo': {'abcdef': 2}}
         self.assertEqual(report, expected_report)
+
+
+class TestSkippedHosts(unittest.TestCase):
+
+    def make_hosts(self, statuses):
+        return {Host(name, name, name, name.split("-")[0]): {"status": status}
+                for name, status in statuses}
+
+    def test_canary_needs_a_deployed_host_in_each_pool(self):
+        hosts = self.make_hosts([
+            ("web-01", "skipped"),
+            ("web-02", "pending"),
+            ("api-01", "complete"),
+        ])
+        strategy = CanaryDeployStrategy(mock.Mock())
+        self.assertFalse(strategy.is_complete(hosts))
+
+    def test_canary_ignores_fully_skipped_pools(self):
+        hosts = self.make_hosts([
+            ("web-01", "skipped"),
+            ("api-01", "complete"),
+            ("api-02", "pending"),
+        ])
+        strategy = CanaryDeployStrategy(mock.Mock())
+        self.assertTrue(strategy.is_complete(hosts))
+
+    def test_percent_of_deployable_hosts(self):
+        hosts = self.make_hosts([
+            ("app-01", "skipped"),
+            ("app-02", "skipped"),
+            ("app-03", "complete"),
+            ("app-04", "pending"),
+        ])
+        self.assertFalse(
+            PercentDeployStrategy(mock.Mock(), 75).is_complete(hosts))
+        self.assertTrue(
+            PercentDeployStrategy(mock.Mock(), 50).is_complete(hosts))
+
+    @mock.patch("sys.stdout")
+    def test_skipped_hosts_stay_skipped(self, stdout):
+        host = Host.from_hostname("app-01")
+        frontend = HeadlessFrontend(mock.Mock(), [host], False)
+        self.addCleanup(
+            logging.getLogger().removeHandler, frontend.log_handler)
+
+        frontend.on_skip([host], "already up to date")
+        frontend.on_host_end(host, [])
+        self.assertEqual(frontend.hosts[host]["status"], "skipped")
@@ -0,0 +1,32 @@
+import unittest
+
+import mock
+
+from rollingpin.graphite import GAUGE_INTERVAL, GraphiteNotifier
+
+
+@mock.patch('rollingpin.graphite.time.time')
+class TestGraphiteNotifier(unittest.TestCase):
+
+    def setUp(self):
+        config = {"graphite": {"endpoint": "tcp:graphite:2003"}}
+        self.notifier = GraphiteNotifier(config, ["service-1"])
+        self.notifier.send = mock.Mock()
+
+    def test_deploy_start(self, time):
+        time.return_value = 1000
+        self.notifier.on_deploy_start()
+        self.notifier.send.assert_called_once_with(
+            "events.deploy.service-1 1 1000\r\n")
+
+    def test_live_timers_throttled(self, time):
+        time.return_value = 1000
+        self.notifier.on_transport_timers(live=3)
+        self.notifier.on_transport_timers(live=4)
+        time.return_value += GAUGE_INTERVAL
+        self.notifier.on_transport_timers(live=5)
+
+        self.assertEqual(self.notifier.send.call_args_list, [
+            mock.call("rollingpin.transport.live_timers 3 1000\r\n"),
+            mock.call("rollingpin.transport.live_timers 5 1060\r\n"),
+        ])
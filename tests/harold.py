@@ -0,0 +1,41 @@
+import unittest
+
+import mock
+from twisted.internet.defer import succeed
+
+from rollingpin.eventbus import EventBus
+from rollingpin.harold import HaroldNotifier
+from rollingpin.hostsources import Host
+from rollingpin.transports import CommandFailed
+
+
+class TestHaroldNotifier(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = [Host.from_hostname("app-%02d" % i) for i in range(2)]
+        self.harold = mock.Mock()
+        self.harold.make_request.return_value = succeed(None)
+        self.event_bus = EventBus()
+        self.notifier = HaroldNotifier(
+            self.harold, self.event_bus, "salon", "abcde", self.hosts,
+            "-h app -r all", "/var/log/rollingpin/abcde.log")
+
+    def abort(self, host):
+        self.event_bus.trigger(
+            "host.abort", host=host, error=CommandFailed("oops"),
+            should_be_alive=True)
+
+    def test_retried_host_that_succeeds_not_failed(self):
+        flaky, broken = self.hosts
+        self.abort(flaky)
+        self.abort(broken)
+        self.abort(flaky)
+        self.abort(broken)
+        self.event_bus.trigger("host.end", host=flaky, results=[])
+        self.event_bus.trigger("deploy.end")
+
+        self.harold.make_request.assert_called_with("deploy/end", {
+            "salon": "salon",
+            "id": "abcde",
+            "failed_hosts": "app-01",
+        })
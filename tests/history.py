@@ -0,0 +1,143 @@
+import unittest
+
+import mock
+
+from rollingpin.history import (
+    DeployHistory,
+    DeployRecorder,
+    adaptive_command_timeouts,
+)
+from rollingpin.hostsources import Host
+from rollingpin.transports import CommandFailed
+
+
+class TestDeployHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = DeployHistory(":memory:")
+        self.hosts = [Host.from_hostname("app-%02d" % i) for i in range(3)]
+
+        self.now = 1000.0
+        patcher = mock.patch("rollingpin.history.time.time",
+                             side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record_deploy(self, word, durations):
+        recorder = DeployRecorder(
+            self.history, word, "app", self.hosts, "-h app -r all")
+        recorder.on_deploy_begin()
+        recorder.on_build_tokens(["foo@abc"])
+        for host, duration in zip(self.hosts, durations):
+            recorder.on_host_begin(host)
+            self.now += 1
+            recorder.on_host_connected(host)
+            if duration:
+                self.now += duration - 1
+                recorder.on_host_command_end(host, "restart", duration - 1)
+                recorder.on_host_end(host, [])
+            else:
+                # the host fails right after connecting
+                recorder.on_host_abort(host, CommandFailed("oops"), True)
+        recorder.on_deploy_end()
+        return recorder
+
+    def test_deploy_recorded(self):
+        self.record_deploy("abcde", [10, 0])
+        deploy = self.history.db.execute(
+            "SELECT profile, result FROM deploys WHERE id = 'abcde'"
+        ).fetchone()
+        self.assertEqual(deploy, ("app", "complete"))
+
+        components = self.history.db.execute(
+            "SELECT component, token FROM deploy_components").fetchall()
+        self.assertEqual(components, [("foo", "abc")])
+
+    def test_host_timings(self):
+        self.record_deploy("abcde", [10, 0])
+        hosts = self.history.db.execute(
+            "SELECT host, result, connect_duration, total_duration "
+            "FROM hosts ORDER BY host").fetchall()
+        self.assertEqual(hosts, [
+            ("app-00", "success", 1, 10),
+            ("app-01", "failed", 1, 1),
+        ])
+
+        commands = self.history.db.execute(
+            "SELECT host, command, duration FROM commands").fetchall()
+        self.assertEqual(commands, [("app-00", "restart", 9)])
+
+    def test_host_durations(self):
+        self.record_deploy("first", [100, 10])
+        self.record_deploy("second", [20, 0])
+        self.record_deploy("third", [30, 20])
+
+        self.assertEqual(self.history.host_durations(), {
+            "app-00": 50,
+            "app-01": 15,
+        })
+        self.assertEqual(self.history.host_durations(history=2), {
+            "app-00": 25,
+            "app-01": 15,
+        })
+
+    def test_prune(self):
+        for word, duration in (("first", 10), ("second", 20), ("third", 30)):
+            self.record_deploy(word, [duration, duration])
+        self.history.prune(deploys=2, runs_per_host=1, runs_per_command=3)
+
+        deploys = self.history.db.execute(
+            "SELECT id FROM deploys ORDER BY started").fetchall()
+        self.assertEqual(deploys, [("second",), ("third",)])
+        components = self.history.db.execute(
+            "SELECT deploy_id FROM deploy_components").fetchall()
+        self.assertEqual(sorted(components), [("second",), ("third",)])
+        self.assertEqual(self.history.host_durations(), {
+            "app-00": 30,
+            "app-01": 30,
+        })
+        commands = self.history.db.execute(
+            "SELECT deploy_id, duration FROM commands").fetchall()
+        self.assertEqual(sorted(commands), [
+            ("second", 19), ("third", 29), ("third", 29)])
+
+    def test_pruned_once_deploy_recorded(self):
+        with mock.patch.object(self.history, "prune") as prune:
+            recorder = DeployRecorder(
+                self.history, "abcde", "app", self.hosts, "-h app -r all")
+            recorder.on_deploy_abort("precheck failed")
+            self.assertFalse(prune.called)
+
+            recorder.on_deploy_begin()
+            recorder.on_deploy_end()
+            prune.assert_called_once_with()
+
+    def test_average_host_duration(self):
+        self.assertIsNone(self.history.average_host_duration("app"))
+
+        self.record_deploy("first", [10, 20])
+        self.record_deploy("second", [30, 0])
+        self.assertEqual(self.history.average_host_duration("app"), 20)
+        self.assertEqual(
+            self.history.average_host_duration("app", history=1), 30)
+        self.assertIsNone(self.history.average_host_duration("other"))
+
+    def record_commands(self, command, durations):
+        self.history.db.executemany(
+            "INSERT INTO commands (deploy_id, host, command, duration) "
+            "VALUES ('abcde', 'app-00', ?, ?)",
+            [(command, duration) for duration in durations])
+
+    def test_command_percentiles(self):
+        self.record_commands("deploy", range(1, 101))
+        self.record_commands("restart", range(5))
+        self.assertEqual(self.history.command_percentiles(99), {"deploy": 99})
+        self.assertEqual(self.history.command_percentiles(50), {"deploy": 50})
+
+    def test_adaptive_command_timeouts(self):
+        self.record_commands("deploy", range(1, 101))
+        self.record_commands("restart", [1] * 50)
+        self.assertEqual(adaptive_command_timeouts(self.history, 2, 0),
+                         {"deploy": 198, "restart": 10})
+        self.assertEqual(adaptive_command_timeouts(self.history, 2, 60),
+                         {"deploy": 60, "restart": 10})
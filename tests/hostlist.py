@@ -6,6 +6,7 @@ from rollingpin.hostlist import (
     parse_aliases,
     resolve_alias,
     resolve_hostlist,
+    sort_by_duration,
     UnresolvableAliasError,
     UnresolvableHostRefError,
 )
@@ -90,3 +91,20 @@ class TestHostListResolution(unittest.TestCase):
             "bad_alias": "d",
         })
         self.assertEqual(hostlist, [a])
+
+
+class TestSortByDuration(unittest.TestCase):
+
+    def test_quickest_first(self):
+        a, b, c = MockHost("a"), MockHost("b"), MockHost("c")
+        hosts = sort_by_duration([a, b, c], {"a": 30, "b": 10, "c": 20})
+        self.assertEqual(hosts, [b, c, a])
+
+    def test_unknown_hosts_take_median(self):
+        a, b, c, d = MockHost("a"), MockHost("b"), MockHost("c"), MockHost("d")
+        hosts = sort_by_duration([a, b, c, d], {"a": 30, "b": 10, "c": 20})
+        self.assertEqual(hosts, [b, c, d, a])
+
+    def test_no_history_keeps_order(self):
+        a, b = MockHost("a"), MockHost("b")
+        self.assertEqual(sort_by_duration([b, a], {}), [b, a])
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from rollingpin.hostsources import Host
+from rollingpin.journal import (
+    DeployJournal,
+    JournalError,
+    journal_path_for_log,
+    load_journal,
+)
+from rollingpin.transports import CommandFailed
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(
+            self.directory, "2017-01-01_00:00:00-abcde.journal")
+        self.hosts = [Host.from_hostname(name)
+                      for name in ("app-01", "app-02", "app-03")]
+
+        patcher = mock.patch("rollingpin.journal.reactor")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_journal(self):
+        return DeployJournal(self.path, "abcde", self.hosts, ["foo"])
+
+    def test_journal_path(self):
+        self.assertEqual(
+            journal_path_for_log("/var/log/rollingpin/x-abcde.log"),
+            "/var/log/rollingpin/x-abcde.journal")
+
+    def test_missing_journal(self):
+        with self.assertRaises(JournalError):
+            load_journal(self.directory, "nope")
+
+    def test_resume_state(self):
+        journal = self.make_journal()
+        journal.on_build_tokens(["foo@abc"])
+        journal.on_host_end(self.hosts[1], [])
+        journal.on_host_abort(self.hosts[2], CommandFailed("oops"), True)
+        journal.on_host_end(Host.from_hostname("build-01"), [])
+        journal.on_deploy_abort("received SIGINT")
+
+        state = load_journal(self.directory, "abcde")
+        self.assertEqual(state.host_names, ["app-01", "app-02", "app-03"])
+        self.assertEqual(state.completed, {"app-02": ["foo@abc"]})
+
+    def test_partial_last_line_ignored(self):
+        journal = self.make_journal()
+        journal.on_host_end(self.hosts[0], [])
+        journal.file.write('{"event": "host.e')
+        journal.file.flush()
+
+        state = load_journal(self.directory, "abcde")
+        self.assertEqual(state.completed, {"app-01": []})
+
+    def test_restore_host_order(self):
+        self.make_journal()
+        state = load_journal(self.directory, "abcde")
+        new_host = Host.from_hostname("app-04")
+        hosts = [self.hosts[2], new_host, self.hosts[0], self.hosts[1]]
+        self.assertEqual(state.restore_host_order(hosts),
+                         self.hosts + [new_host])
@@ -0,0 +1,93 @@
+import unittest
+
+import mock
+
+from rollingpin.eventbus import EventBus
+from rollingpin.hostsources import Host
+from rollingpin.parallelism import AdaptiveParallelism
+from rollingpin.transports import CommandFailed
+from rollingpin.utils import ResizableSemaphore
+
+
+class TestAdaptiveParallelism(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = [Host.from_hostname("app-%02d" % i) for i in range(20)]
+        self.limiter = ResizableSemaphore(4)
+        self.event_bus = EventBus()
+        self.changes = []
+        self.event_bus.register({
+            "deploy.parallelism": lambda parallel, reason: (
+                self.changes.append(parallel)),
+        })
+        self.controller = AdaptiveParallelism(
+            self.limiter, self.event_bus, self.hosts, minimum=2, maximum=6)
+
+        self.now = 1000.0
+        patcher = mock.patch("rollingpin.parallelism.time.time",
+                             side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_host(self, host, duration, fail=False, should_be_alive=True):
+        self.controller.on_host_begin(host)
+        self.now += duration
+        if fail:
+            self.controller.on_host_abort(
+                host, CommandFailed("oops"), should_be_alive)
+        else:
+            self.controller.on_host_end(host, [])
+
+    def saturate(self):
+        while self.limiter.in_use < self.limiter.limit:
+            self.limiter.acquire()
+
+    def test_grows_by_one_per_window(self):
+        self.saturate()
+        for host in self.hosts[:3]:
+            self.run_host(host, 10)
+        self.assertEqual(self.changes, [])
+
+        self.run_host(self.hosts[3], 10)
+        self.assertEqual(self.changes, [5])
+
+        self.saturate()
+        for host in self.hosts[4:9]:
+            self.run_host(host, 10)
+        self.assertEqual(self.limiter.limit, 6)
+        self.assertEqual(self.changes, [5, 6])
+
+    def test_no_growth_while_not_saturated(self):
+        for host in self.hosts[:10]:
+            self.run_host(host, 10)
+        self.assertEqual(self.limiter.limit, 4)
+
+    def test_halves_on_failure(self):
+        self.run_host(self.hosts[0], 10, fail=True)
+        self.assertEqual(self.limiter.limit, 2)
+        self.assertEqual(self.changes, [2])
+
+    def test_ignores_terminated_hosts(self):
+        self.run_host(self.hosts[0], 10, fail=True, should_be_alive=False)
+        self.assertEqual(self.limiter.limit, 4)
+
+    def test_halves_on_latency_spike(self):
+        self.saturate()
+        for host in self.hosts[:5]:
+            self.run_host(host, 10)
+        self.run_host(self.hosts[5], 60)
+        self.assertEqual(self.limiter.limit, 2)
+
+    def test_only_one_backoff_per_wave(self):
+        first, second = self.hosts[:2]
+        self.controller.on_host_begin(first)
+        self.controller.on_host_begin(second)
+        self.now += 1
+        self.controller.on_host_abort(first, CommandFailed("oops"), True)
+        self.controller.on_host_abort(second, CommandFailed("oops"), True)
+        self.assertEqual(self.limiter.limit, 2)
+        self.assertEqual(self.changes, [2])
+
+    def test_ignores_other_hosts(self):
+        self.run_host(Host.from_hostname("build-01"), 10, fail=True)
+        self.assertEqual(self.limiter.limit, 4)
@@ -0,0 +1,85 @@
+import unittest
+
+import mock
+
+from rollingpin.eventbus import EventBus
+from rollingpin.hostsources import Host
+from rollingpin.progress import ProgressEstimator, format_duration
+from rollingpin.transports import CommandFailed
+
+
+class TestFormatDuration(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(format_duration(42.4), "42s")
+
+    def test_minutes(self):
+        self.assertEqual(format_duration(252), "4m12s")
+
+    def test_hours(self):
+        self.assertEqual(format_duration(3725), "1h02m")
+
+
+class TestProgressEstimator(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = [Host.from_hostname("app-%02d" % i) for i in range(10)]
+        self.event_bus = EventBus()
+        self.progress = []
+        self.event_bus.register({
+            "deploy.progress": lambda **kwargs: self.progress.append(kwargs),
+        })
+
+        self.now = 1000.0
+        patcher = mock.patch("rollingpin.progress.time.time",
+                             side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_estimator(self, seed_duration=None):
+        return ProgressEstimator(self.event_bus, self.hosts, seed_duration)
+
+    def test_no_estimate_without_data(self):
+        estimator = self.make_estimator()
+        self.assertIsNone(estimator.eta)
+
+    def test_seeded_estimate(self):
+        estimator = self.make_estimator(seed_duration=30)
+        estimator.on_host_begin(self.hosts[0])
+        estimator.on_host_begin(self.hosts[1])
+        self.assertEqual(estimator.hosts_per_minute, 4)
+        self.assertEqual(estimator.eta, 150)
+
+    def test_estimate_from_completed_hosts(self):
+        estimator = self.make_estimator()
+        estimator.on_host_begin(self.hosts[0])
+        estimator.on_host_begin(self.hosts[1])
+        self.now += 20
+        estimator.on_host_end(self.hosts[0], [])
+
+        self.assertEqual(self.progress, [{
+            "completed": 1,
+            "total": 10,
+            "hosts_per_minute": 6,
+            "eta": 90,
+        }])
+
+    def test_failures_count_as_done(self):
+        estimator = self.make_estimator(seed_duration=10)
+        estimator.on_host_begin(self.hosts[0])
+        self.now += 1
+        estimator.on_host_abort(self.hosts[0], CommandFailed("oops"), True)
+        self.assertEqual(self.progress[-1]["completed"], 1)
+        # a quick failure says nothing about how long hosts take
+        self.assertEqual(estimator.average_duration, 10)
+
+    def test_retried_hosts_count_once(self):
+        estimator = self.make_estimator()
+        estimator.on_host_abort(self.hosts[0], CommandFailed("oops"), True)
+        estimator.on_host_end(self.hosts[0], [])
+        self.assertEqual(self.progress[-1]["completed"], 1)
+
+    def test_other_hosts_ignored(self):
+        estimator = self.make_estimator()
+        estimator.on_host_end(Host.from_hostname("build-01"), [])
+        self.assertEqual(self.progress, [])
@@ -0,0 +1,240 @@
+import unittest
+
+import mock
+from twisted.internet.defer import DeferredSemaphore
+
+from rollingpin.commands import (
+    DeployCommand,
+    GenericCommand,
+    RestartCommand,
+    WaitUntilComponentsReadyCommand,
+)
+from rollingpin.config import ConfigurationError
+from rollingpin.hostsources import Host
+from rollingpin.scheduling import (
+    HostPacer,
+    PoolLimit,
+    PoolScheduler,
+    Slot,
+    batch_commands,
+    parse_command_dependencies,
+    parse_command_limits,
+    parse_command_timeouts,
+    parse_pool_limits,
+)
+
+from tests import make_configparser
+
+
+class TestHostPacer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("rollingpin.scheduling.time.time",
+                             side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_host_immediate(self):
+        pacer = HostPacer.from_sleeptime(5)
+        self.assertEqual(pacer.reserve(), 0)
+
+    def test_sleeptime_spacing(self):
+        pacer = HostPacer.from_sleeptime(5)
+        pacer.reserve()
+        self.assertAlmostEqual(pacer.reserve(), 5)
+        self.assertAlmostEqual(pacer.reserve(), 10)
+
+    def test_burst(self):
+        pacer = HostPacer.from_hosts_per_minute(6, burst=3)
+        self.assertEqual([pacer.reserve() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(pacer.reserve(), 10)
+
+    def test_refills_over_time(self):
+        pacer = HostPacer.from_hosts_per_minute(6, burst=2)
+        pacer.reserve()
+        pacer.reserve()
+        self.now += 20
+        self.assertEqual([pacer.reserve() for _ in range(2)], [0, 0])
+
+    def test_refill_capped_at_burst(self):
+        pacer = HostPacer.from_hosts_per_minute(6, burst=2)
+        self.now += 3600
+        self.assertEqual([pacer.reserve() for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(pacer.reserve(), 10)
+
+
+def make_host(name):
+    return Host(name, name, name, name.split("-")[0])
+
+
+class TestPoolLimits(unittest.TestCase):
+
+    def test_count(self):
+        self.assertEqual(PoolLimit.parse("3").for_pool_size(100), 3)
+
+    def test_percent(self):
+        self.assertEqual(PoolLimit.parse("25%").for_pool_size(10), 2)
+
+    def test_percent_never_zero(self):
+        self.assertEqual(PoolLimit.parse("10%").for_pool_size(3), 1)
+
+    def test_invalid(self):
+        for value in ("0", "150%", "lots"):
+            with self.assertRaises(ValueError):
+                PoolLimit.parse(value)
+
+    def test_parse_section(self):
+        parser = make_configparser("""
+        [pool-limits]
+        rare = 1
+        * = 50%
+        """)
+        limits = parse_pool_limits(parser)
+        self.assertEqual([glob for glob, limit in limits], ["rare", "*"])
+
+    def test_parse_section_ignores_defaults(self):
+        parser = make_configparser("""
+        [DEFAULT]
+        user = deploy
+
+        [pool-limits]
+        rare = 1
+        """)
+        limits = parse_pool_limits(parser)
+        self.assertEqual([glob for glob, limit in limits], ["rare"])
+
+    def test_parse_section_errors(self):
+        parser = make_configparser("""
+        [pool-limits]
+        rare = none
+        """)
+        with self.assertRaises(ConfigurationError):
+            parse_pool_limits(parser)
+
+    def test_no_section(self):
+        self.assertEqual(parse_pool_limits(make_configparser("")), [])
+
+
+class TestPoolScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = [make_host(name) for name in
+                      ("rare-01", "rare-02", "common-01", "common-02")]
+
+    def next_host(self, scheduler):
+        hosts = []
+        scheduler.next_host().addCallback(hosts.append)
+        return hosts[0] if hosts else None
+
+    def test_unlimited_keeps_order(self):
+        scheduler = PoolScheduler(self.hosts, [])
+        started = [self.next_host(scheduler) for _ in range(5)]
+        self.assertEqual(started, self.hosts + [None])
+
+    def test_skips_pools_at_limit(self):
+        scheduler = PoolScheduler(self.hosts, [("rare", PoolLimit(count=1))])
+        started = [self.next_host(scheduler) for _ in range(3)]
+        self.assertEqual([host.name for host in started],
+                         ["rare-01", "common-01", "common-02"])
+
+    def test_mixed_case_pools(self):
+        parser = make_configparser("""
+        [pool-limits]
+        RarePool* = 1
+        """)
+        hosts = [make_host(name) for name in ("RarePool-01", "RarePool-02")]
+        scheduler = PoolScheduler(hosts, parse_pool_limits(parser))
+        started = [self.next_host(scheduler) for _ in range(2)]
+        self.assertEqual([host.name for host in started if host],
+                         ["RarePool-01"])
+
+    def test_waits_for_pool_to_free_up(self):
+        scheduler = PoolScheduler(self.hosts, [("*", PoolLimit(count=1))])
+        first = self.next_host(scheduler)
+        self.next_host(scheduler)
+
+        waiting = []
+        scheduler.next_host().addCallback(waiting.append)
+        self.assertEqual(waiting, [])
+
+        scheduler.host_done(first)
+        self.assertEqual([host.name for host in waiting], ["rare-02"])
+
+
+class TestCommandLimits(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_command_limits("deploy:200 restart:20"),
+                         {"deploy": 200, "restart": 20})
+
+    def test_parse_empty(self):
+        self.assertEqual(parse_command_limits(""), {})
+
+    def test_parse_invalid(self):
+        for value in ("deploy", "deploy:0", "deploy:lots", ":3"):
+            with self.assertRaises(ValueError):
+                parse_command_limits(value)
+
+    def test_parse_timeouts(self):
+        self.assertEqual(parse_command_timeouts("deploy:300 restart:60"),
+                         {"deploy": 300, "restart": 60})
+
+
+class TestCommandDependencies(unittest.TestCase):
+
+    def setUp(self):
+        self.deploy = DeployCommand(["foo@abc"])
+        self.restarts = [RestartCommand([target]) for target in ("a", "b")]
+        self.wait = WaitUntilComponentsReadyCommand()
+        self.commands = [self.deploy] + self.restarts + [self.wait]
+
+    def test_parse(self):
+        self.assertEqual(
+            parse_command_dependencies("restart:deploy check: x:a,b"),
+            {"restart": {"deploy"}, "check": set(), "x": {"a", "b"}})
+
+    def test_parse_invalid(self):
+        for value in ("restart", ":deploy"):
+            with self.assertRaises(ValueError):
+                parse_command_dependencies(value)
+
+    def test_linear_by_default(self):
+        self.assertEqual(batch_commands(self.commands, {}),
+                         [[command] for command in self.commands])
+
+    def test_independent_commands_batched(self):
+        batches = batch_commands(self.commands, {"restart": {"deploy"}})
+        self.assertEqual(batches, [[self.deploy], self.restarts, [self.wait]])
+
+    def test_dependency_within_batch(self):
+        check = GenericCommand("check")
+        batches = batch_commands(
+            [self.deploy, check, self.restarts[0]],
+            {"check": set(), "restart": {"check"}})
+        self.assertEqual(batches,
+                         [[self.deploy, check], [self.restarts[0]]])
+
+
+class TestSlot(unittest.TestCase):
+
+    def test_move_frees_home_limiter(self):
+        home, ready = DeferredSemaphore(1), DeferredSemaphore(5)
+        slot = Slot(home)
+        slot.acquire()
+        self.assertEqual(home.tokens, 0)
+
+        slot.move_to(ready)
+        self.assertEqual(home.tokens, 1)
+        self.assertEqual(ready.tokens, 4)
+
+        slot.release()
+        self.assertEqual(ready.tokens, 5)
+
+    def test_release_is_idempotent(self):
+        limiter = DeferredSemaphore(1)
+        slot = Slot(limiter)
+        slot.acquire()
+        slot.release()
+        slot.release()
+        self.assertEqual(limiter.tokens, 1)
@@ -0,0 +1,308 @@
+import json
+import struct
+import unittest
+
+import mock
+from twisted.conch.ssh.common import NS
+from twisted.conch.ssh.connection import EXTENDED_DATA_STDERR
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.internet.task import Clock
+
+from rollingpin.transports import ConnectionError, ExecutionTimeout
+from rollingpin.transports.ssh import (
+    KeepaliveTimeout,
+    SshTransportConnection,
+    MAX_LINE_LENGTH,
+    NonZeroStatusError,
+    TimeoutManager,
+    _BatchChannel,
+    _CommandChannel,
+    _LineAssembler,
+)
+
+
+class TestKeepalive(unittest.TestCase):
+
+    def setUp(self):
+        self.connector = mock.Mock()
+        self.connection = mock.Mock()
+        self.replies = []
+
+        def send_global_request(request, data, wantReply):
+            reply = Deferred()
+            self.replies.append(reply)
+            return reply
+        self.connection.sendGlobalRequest.side_effect = send_global_request
+
+        self.transport_connection = SshTransportConnection(
+            "/usr/bin/deploy", self.connector, self.connection,
+            keepalive_interval=0, keepalive_count=2)
+
+    def test_answered_keepalives(self):
+        for _ in range(5):
+            self.transport_connection._send_keepalive()
+            self.replies[-1].callback(None)
+        self.assertIsNone(self.transport_connection.error)
+
+    def test_refused_keepalive_counts_as_answer(self):
+        for _ in range(5):
+            self.transport_connection._send_keepalive()
+            self.replies[-1].errback(Exception("request failed"))
+        self.assertIsNone(self.transport_connection.error)
+
+    def test_missed_keepalives_fail_commands(self):
+        results = []
+        self.transport_connection.execute(
+            mock.Mock(), ["restart", "all"]).addErrback(results.append)
+
+        for _ in range(3):
+            self.transport_connection._send_keepalive()
+
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0].check(KeepaliveTimeout))
+        self.assertTrue(results[0].check(ConnectionError))
+        self.connector.disconnect.assert_called_once_with()
+
+        # and so does anything tried afterwards
+        self.transport_connection.execute(
+            mock.Mock(), ["restart", "all"]).addErrback(results.append)
+        self.assertTrue(results[1].check(KeepaliveTimeout))
+
+
+class TestCheckAlive(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.connection = mock.Mock()
+        self.reply = Deferred()
+        self.connection.sendGlobalRequest.return_value = self.reply
+        self.transport_connection = SshTransportConnection(
+            "/usr/bin/deploy", mock.Mock(), self.connection,
+            timeouts=TimeoutManager(self.clock))
+
+    def check_alive(self):
+        results = []
+        self.transport_connection.check_alive(5).addCallback(results.append)
+        return results
+
+    def test_answered(self):
+        results = self.check_alive()
+        self.reply.errback(Exception("request failed"))
+        self.assertEqual(results, [True])
+        self.assertEqual(self.transport_connection.timeouts.live_timers, 0)
+
+    def test_unanswered(self):
+        results = self.check_alive()
+        self.clock.advance(5)
+        self.assertEqual(results, [False])
+
+        # a late reply doesn't change the verdict
+        self.reply.callback(None)
+        self.assertEqual(results, [False])
+
+
+class TestExecutionTimeouts(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.timeouts = TimeoutManager(self.clock)
+
+    def make_channel(self, timeout=60):
+        channel = _CommandChannel(
+            mock.Mock(), u"sudo deploy restart all", timeout, self.timeouts,
+            0, 5, conn=mock.Mock())
+        channel.channelOpen(None)
+        return channel
+
+    def test_cancelled_when_channel_closes(self):
+        channels = [self.make_channel() for _ in range(100)]
+        self.assertEqual(self.timeouts.live_timers, 100)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 100)
+
+        for channel in channels:
+            channel.closed()
+        self.assertEqual(self.timeouts.live_timers, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_cancelled_when_channel_fails(self):
+        channel = self.make_channel()
+        channel.finished.addErrback(lambda failure: None)
+        channel.fail(ConnectionError("gone"))
+        self.assertEqual(self.timeouts.live_timers, 0)
+
+    def test_fired_timer_forgotten(self):
+        channel = self.make_channel(timeout=10)
+        results = []
+        channel.finished.addErrback(results.append)
+        self.clock.advance(10)
+        self.assertTrue(results[0].check(ExecutionTimeout))
+        self.assertEqual(self.timeouts.live_timers, 0)
+
+        # closing afterwards doesn't try to cancel it again
+        channel.closed()
+
+    def test_no_timeout(self):
+        self.make_channel(timeout=0)
+        self.assertEqual(self.timeouts.live_timers, 0)
+
+
+class TestCommandOutput(unittest.TestCase):
+
+    def make_channel(self, max_output_size):
+        return _CommandChannel(
+            mock.Mock(), u"sudo deploy components", 0, TimeoutManager(Clock()),
+            max_output_size, 5, conn=mock.Mock())
+
+    def receive(self, channel, output):
+        for i in xrange(0, len(output), 10):
+            channel.dataReceived(output[i:i + 10])
+        results = []
+        channel.finished.addBoth(results.append)
+        channel.closed()
+        return results
+
+    @mock.patch("rollingpin.transports.ssh.deferToThread")
+    def test_small_output_decoded_inline(self, deferToThread):
+        channel = self.make_channel(max_output_size=1024)
+        results = self.receive(channel, json.dumps({"status": "ok"}))
+        self.assertEqual(results, [{"status": "ok"}])
+        self.assertFalse(deferToThread.called)
+
+    @mock.patch("rollingpin.transports.ssh.deferToThread")
+    def test_large_output_spilled_and_decoded_in_thread(self, deferToThread):
+        deferToThread.side_effect = lambda function: maybeDeferred(function)
+        channel = self.make_channel(max_output_size=100)
+        components = [{"name": "app-%d" % i} for i in xrange(100)]
+        output = json.dumps({"components": components})
+
+        for i in xrange(0, len(output), 10):
+            channel.dataReceived(output[i:i + 10])
+        self.assertTrue(channel.result._rolled)
+
+        results = []
+        channel.finished.addBoth(results.append)
+        channel.closed()
+        self.assertEqual(results, [{"components": components}])
+        self.assertTrue(deferToThread.called)
+
+    def test_invalid_output(self):
+        channel = self.make_channel(max_output_size=0)
+        self.assertEqual(self.receive(channel, "Traceback"), [{}])
+
+    def test_decoded_after_failure(self):
+        channel = self.make_channel(max_output_size=0)
+        channel.finished.addErrback(lambda failure: None)
+        channel.fail(ConnectionError("gone"))
+        channel._succeed({})
+
+
+class TestStderr(unittest.TestCase):
+
+    def setUp(self):
+        self.log = mock.Mock()
+        self.lines = _LineAssembler(self.log, tail_lines=3)
+
+    def logged(self):
+        return [call[0][1] for call in self.log.debug.call_args_list]
+
+    def test_lines_torn_across_packets(self):
+        self.lines.feed("fetching ori")
+        self.lines.feed("gin\r\nchecking out")
+        self.lines.feed(" master\n")
+        self.assertEqual(self.logged(), ["fetching origin", "checking out master"])
+
+    def test_lines_logged_in_batches(self):
+        self.lines.feed("one\ntwo\nthree\nfour")
+        self.assertEqual(self.logged(), ["one\ntwo\nthree"])
+
+        self.lines.flush()
+        self.assertEqual(self.logged(), ["one\ntwo\nthree", "four"])
+
+    def test_tail_is_bounded(self):
+        for i in range(10):
+            self.lines.feed("line %d\n" % i)
+        self.assertEqual(list(self.lines.tail),
+                         ["line 7", "line 8", "line 9"])
+
+    def test_long_lines_not_buffered_forever(self):
+        self.lines.feed("x" * (MAX_LINE_LENGTH + 1))
+        self.assertEqual(self.lines.partial, "")
+        self.assertEqual(len(self.logged()), 1)
+
+    def test_tail_attached_to_failure(self):
+        channel = _CommandChannel(
+            mock.Mock(), u"sudo deploy restart all", 0, TimeoutManager(Clock()),
+            0, 2, conn=mock.Mock())
+        channel.extReceived(EXTENDED_DATA_STDERR, "restarting\nTraceback\n")
+        channel.extReceived(EXTENDED_DATA_STDERR, "KeyError: 'app'")
+        channel.request_exit_status(struct.pack(">L", 1))
+
+        results = []
+        channel.finished.addErrback(results.append)
+        channel.closed()
+
+        self.assertTrue(results[0].check(NonZeroStatusError))
+        self.assertEqual(results[0].value.stderr_tail,
+                         ["Traceback", "KeyError: 'app'"])
+
+
+class TestSessions(unittest.TestCase):
+
+    def test_concurrent_commands_limited(self):
+        connection = mock.Mock()
+        transport_connection = SshTransportConnection(
+            "/usr/bin/deploy", mock.Mock(), connection, max_sessions=2)
+
+        for target in ("a", "b", "c"):
+            transport_connection.execute(mock.Mock(), ["restart", target])
+        self.assertEqual(connection.openChannel.call_count, 2)
+
+        channel = connection.openChannel.call_args_list[0][0][0]
+        channel.closed()
+        self.assertEqual(connection.openChannel.call_count, 3)
+
+    def test_disconnect_stops_running_commands(self):
+        connection = mock.Mock()
+        transport_connection = SshTransportConnection(
+            "/usr/bin/deploy", mock.Mock(), connection, max_sessions=2)
+
+        results = []
+        for target in ("a", "b"):
+            transport_connection.execute(
+                mock.Mock(), ["restart", target]).addErrback(results.append)
+        opened = connection.openChannel.call_args_list[0][0][0]
+        opened.channelOpen(None)
+
+        transport_connection.disconnect()
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(result.check(ConnectionError)
+                            for result in results))
+        connection.sendRequest.assert_called_with(
+            opened, "signal", NS("TERM"))
+
+
+class TestBatchChannel(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.channel = _BatchChannel(
+            mock.Mock(), u"sudo deploy batch", '{"commands": []}',
+            self.events.append, 0, TimeoutManager(Clock()), 0, 5,
+            conn=mock.Mock())
+        self.channel.write = mock.Mock()
+
+    def test_document_sent_once_exec_accepted(self):
+        self.channel.conn.sendRequest.return_value = succeed(None)
+        self.channel.channelOpen(None)
+        self.channel.write.assert_called_once_with('{"commands": []}')
+        self.channel.conn.sendEOF.assert_called_once_with(self.channel)
+
+    def test_events_passed_on_as_lines_arrive(self):
+        self.channel.dataReceived('{"event": "begin", "index": 0}\n{"ev')
+        self.assertEqual(self.events, [{"event": "begin", "index": 0}])
+
+        self.channel.dataReceived('ent": "end", "index": 0}\n\ngarbage\n')
+        self.assertEqual(self.events, [
+            {"event": "begin", "index": 0},
+            {"event": "end", "index": 0},
+        ])
@@ -0,0 +1,158 @@
+import random
+import unittest
+
+import mock
+
+from rollingpin.eventbus import EventBus
+from rollingpin.hostsources import Host
+from rollingpin.stragglers import (
+    P2Quantile,
+    StragglerDetector,
+    parse_straggler_policy,
+)
+from rollingpin.transports import CommandFailed
+
+
+class TestP2Quantile(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(P2Quantile().value())
+
+    def test_few_samples_exact(self):
+        median = P2Quantile()
+        for value in (5, 1, 3):
+            median.add(value)
+        self.assertEqual(median.value(), 3)
+
+    def test_median_of_uniform_stream(self):
+        rng = random.Random(42)
+        median = P2Quantile()
+        for _ in xrange(10000):
+            median.add(rng.uniform(0, 100))
+        self.assertAlmostEqual(median.value(), 50, delta=2)
+
+    def test_high_quantile(self):
+        p90 = P2Quantile(0.9)
+        for value in xrange(1, 1001):
+            p90.add(value)
+        self.assertAlmostEqual(p90.value(), 900, delta=20)
+
+    def test_memory_is_bounded(self):
+        median = P2Quantile()
+        for value in xrange(1000):
+            median.add(value)
+        self.assertEqual(len(median.heights), 5)
+
+
+class TestStragglerPolicy(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertEqual(parse_straggler_policy("continue"), "continue")
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_straggler_policy("panic")
+
+
+class TestStragglerDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = [Host.from_hostname("app-%02d" % i) for i in range(10)]
+        self.event_bus = EventBus()
+        self.stragglers = []
+        self.event_bus.register({
+            "host.straggler": lambda host, command, elapsed, median: (
+                self.stragglers.append((host, command))),
+        })
+        self.detector = StragglerDetector(self.event_bus, factor=3)
+
+        self.now = 1000.0
+        patcher = mock.patch("rollingpin.stragglers.time.time",
+                             side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_command(self, host, command, duration):
+        self.detector.on_host_begin(host)
+        self.detector.on_host_command(host, command)
+        self.now += duration
+        self.detector.on_host_command_end(host, command, duration)
+        self.detector.on_host_end(host, [])
+
+    def test_not_enough_samples(self):
+        self.run_command(self.hosts[0], "deploy", 10)
+        self.detector.on_host_begin(self.hosts[1])
+        self.detector.on_host_command(self.hosts[1], "deploy")
+        self.now += 1000
+        self.detector.check()
+        self.assertEqual(self.stragglers, [])
+
+    def test_slow_host_flagged_once(self):
+        for host in self.hosts[:5]:
+            self.run_command(host, "deploy", 10)
+
+        self.detector.on_host_begin(self.hosts[5])
+        self.detector.on_host_command(self.hosts[5], "deploy")
+        self.now += 25
+        self.detector.check()
+        self.assertEqual(self.stragglers, [])
+
+        self.now += 10
+        self.detector.check()
+        self.detector.check()
+        self.assertEqual(self.stragglers, [(self.hosts[5], "deploy")])
+
+    def test_durations_are_per_command(self):
+        for host in self.hosts[:5]:
+            self.run_command(host, "deploy", 10)
+
+        self.detector.on_host_begin(self.hosts[5])
+        self.detector.on_host_command(self.hosts[5], "restart")
+        self.now += 100
+        self.detector.check()
+        self.assertEqual(self.stragglers, [])
+
+    def test_quick_commands_need_absolute_delay(self):
+        for host in self.hosts[:5]:
+            self.run_command(host, "deploy", 1)
+
+        self.detector.on_host_begin(self.hosts[5])
+        self.detector.on_host_command(self.hosts[5], "deploy")
+        self.now += 5
+        self.detector.check()
+        self.assertEqual(self.stragglers, [])
+
+    def test_failures_not_sampled(self):
+        for host in self.hosts[:5]:
+            self.detector.on_host_begin(host)
+            self.detector.on_host_command(host, "deploy")
+            self.now += 10
+            self.detector.on_host_abort(host, CommandFailed("oops"), True)
+        self.assertNotIn("deploy", self.detector.medians)
+
+    def test_hosts_outside_rollout_ignored(self):
+        for host in self.hosts[:5]:
+            self.run_command(host, "components", 1)
+
+        # e.g. --skip-up-to-date querying a host that hasn't started yet
+        self.detector.on_host_command(self.hosts[5], "components")
+        self.now += 20
+        self.detector.check()
+        self.assertEqual(self.stragglers, [])
+
+    def test_concurrent_commands(self):
+        for host in self.hosts[:5]:
+            self.run_command(host, "restart", 10)
+
+        host = self.hosts[5]
+        self.detector.on_host_begin(host)
+        self.detector.on_host_command(host, "restart")
+        self.detector.on_host_command(host, "restart")
+        self.now += 5
+        self.detector.on_host_command_end(host, "restart", 5)
+        self.assertEqual(self.detector.medians["restart"].count, 6)
+
+        # the other restart is still going
+        self.now += 30
+        self.detector.check()
+        self.assertEqual(self.stragglers, [(host, "restart")])
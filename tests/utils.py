@@ -2,8 +2,13 @@ import unittest
 
 import logging
 from mock import Mock
+from twisted.internet.defer import Deferred, succeed
 
-from rollingpin.utils import swallow_exceptions
+from rollingpin.utils import (
+    ResizableSemaphore,
+    gather_fail_fast,
+    swallow_exceptions,
+)
 
 
 class TestUtils(unittest.TestCase):
@@ -20,3 +25,54 @@ class TestUtils(unittest.TestCase):
         with swallow_exceptions("tester", logger):
             pass
         logger.warning.assert_not_called()
+
+
+class TestGatherFailFast(unittest.TestCase):
+
+    def test_results_in_order(self):
+        first, second = Deferred(), Deferred()
+        results = []
+        gather_fail_fast([first, second]).addCallback(results.append)
+        second.callback(2)
+        first.callback(1)
+        self.assertEqual(results, [[1, 2]])
+
+    def test_failure_cancels_remaining(self):
+        cancelled = []
+        failing, pending = Deferred(), Deferred(canceller=cancelled.append)
+        failures = []
+        gathered = gather_fail_fast([succeed(1), failing, pending])
+        gathered.addErrback(failures.append)
+        failing.errback(ValueError("build broke"))
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].check(ValueError))
+        self.assertEqual(cancelled, [pending])
+
+
+class TestResizableSemaphore(unittest.TestCase):
+
+    def test_grow_wakes_waiters(self):
+        semaphore = ResizableSemaphore(1)
+        acquired = []
+        for _ in range(3):
+            semaphore.acquire().addCallback(acquired.append)
+        self.assertEqual(len(acquired), 1)
+
+        semaphore.resize(3)
+        self.assertEqual(len(acquired), 3)
+        self.assertEqual(semaphore.in_use, 3)
+
+    def test_shrink_waits_for_releases(self):
+        semaphore = ResizableSemaphore(3)
+        for _ in range(3):
+            semaphore.acquire()
+        semaphore.resize(1)
+
+        acquired = []
+        semaphore.acquire().addCallback(acquired.append)
+        semaphore.release()
+        semaphore.release()
+        self.assertEqual(acquired, [])
+        semaphore.release()
+        self.assertEqual(len(acquired), 1)
+        self.assertEqual(semaphore.in_use, 1)
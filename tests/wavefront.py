@@ -70,6 +70,13 @@ class TestWavefrontNotifier(unittest.TestCase):
         }
         self.assertEquals(deploy_abort_event, expected_deploy_abort_event)
 
+    def test_deploy_progress_event(self):
+        deploy_progress_event = self.wf_notifier.deploy_progress_event(
+            completed=10, total=40, hosts_per_minute=12.5, eta=144)
+        self.assertEquals(
+            deploy_progress_event['annotations']['progress'],
+            '10/40 hosts, 12.5 hosts/min, 2m24s left')
+
     def test_deploy_end_event(self):
         deploy_end_event = self.wf_notifier.deploy_end_event()
         expected_deploy_end_event = {